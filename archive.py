@@ -0,0 +1,220 @@
+import argparse
+import datetime
+import gzip
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from store import Database, DB_PATH, PAGE_SIZE
+
+# Audit log retention. Entries older than the audit_retention_days setting
+# move out of shop.db into one gzip file of JSON lines per month, next to the
+# database. They move CHUNK at a time: the rows are read, appended to their
+# month's file as a new gzip member and synced to disk, then deleted in one
+# short transaction, with a pause before the next chunk, so a till never
+# waits on more than one small delete. audit_archive records how many bytes
+# of each file are committed; anything past that (written just before a
+# crash, still in the database) is cut off before the next append.
+ARCHIVE_DIR = "audit_archive"
+ARCHIVE_INTERVAL = 3600
+CHUNK = 500
+PAUSE = 0.05
+CACHED_MONTHS = 4
+
+
+class AuditArchive:
+    SORT_KEYS = {
+        'id': lambda row: (row[0], row[0]),
+        'time': lambda row: (row[1], row[0]),
+        'user': lambda row: (row[2], row[0]),
+        'action': lambda row: (row[3], row[0]),
+    }
+
+    def __init__(self, db, directory=None):
+        self.db = db
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(db.path)), ARCHIVE_DIR)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._months = OrderedDict()
+        self._sorted = (None, [])
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='audit-archive', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                days = self.db.settings.get_int('audit_retention_days', 0)
+                if days > 0:
+                    try:
+                        self.archive(days)
+                    except Exception as e:
+                        print(f"Audit archive error: {e}")
+                # There is no UI tick on this thread to write buffered entries
+                try:
+                    self.db.audit.flush()
+                except Exception as e:
+                    print(f"Audit log flush failed: {e}")
+                self._wake.wait(ARCHIVE_INTERVAL)
+                self._wake.clear()
+        finally:
+            self.db.pool.release()
+
+    def path(self, month):
+        return os.path.join(self.directory, f"audit-{month}.jsonl.gz")
+
+    def archive(self, days, chunk=CHUNK, pause=PAUSE):
+        # Moves entries older than days; returns how many moved
+        cutoff = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+        moved = 0
+        with self._lock:
+            while not self._stop.is_set():
+                count = self._archive_chunk(cutoff, chunk)
+                moved += count
+                if count < chunk:
+                    break
+                self._stop.wait(pause)
+        return moved
+
+    def _archive_chunk(self, cutoff, chunk):
+        conn = self.db.conn
+        rows = conn.execute("SELECT id, timestamp, user, action, details FROM audit_logs WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                            (cutoff, chunk)).fetchall()
+        if not rows:
+            return 0
+        months = {}
+        for row in rows:
+            months.setdefault(row[1][:7], []).append(row)
+        committed = dict(conn.execute(f"SELECT month, size FROM audit_archive WHERE month IN ({', '.join('?' * len(months))})", list(months)))
+
+        # Files first, outside any transaction
+        os.makedirs(self.directory, exist_ok=True)
+        sizes = {}
+        for month, entries in months.items():
+            data = "".join(json.dumps(row) + "\n" for row in entries).encode()
+            with open(self.path(month), 'ab') as f:
+                f.truncate(committed.get(month, 0))
+                f.write(gzip.compress(data))
+                f.flush()
+                os.fsync(f.fileno())
+                sizes[month] = f.tell()
+
+        ids = [row[0] for row in rows]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"DELETE FROM audit_logs WHERE id IN ({', '.join('?' * len(ids))})", ids)
+            conn.executemany("""INSERT INTO audit_archive (month, size, entries, first, last) VALUES (?, ?, ?, ?, ?)
+                                ON CONFLICT (month) DO UPDATE SET size = excluded.size, entries = entries + excluded.entries,
+                                    first = MIN(first, excluded.first), last = MAX(last, excluded.last)""",
+                             [(month, sizes[month], len(entries), entries[0][1], entries[-1][1]) for month, entries in months.items()])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self.db.changes.publish('audit_logs')
+        return len(rows)
+
+    def months(self, start=None, end=None):
+        # (month, committed size) of archived months overlapping start..end, oldest first
+        return self.db.conn.execute("""
+            SELECT month, size FROM audit_archive
+            WHERE (? IS NULL OR last >= ?) AND (? IS NULL OR first < date(?, '+1 day'))
+            ORDER BY month
+        """, (start, start, end, end)).fetchall()
+
+    def _load(self, month, size):
+        # A month's entries in time order; the last few months stay decoded
+        key = (month, size)
+        rows = self._months.get(key)
+        if rows is None:
+            with open(self.path(month), 'rb') as f:
+                data = gzip.decompress(f.read(size))
+            rows = sorted((tuple(json.loads(line)) for line in data.splitlines()), key=self.SORT_KEYS['time'])
+            self._months[key] = rows
+            if len(self._months) > CACHED_MONTHS:
+                self._months.popitem(last=False)
+        else:
+            self._months.move_to_end(key)
+        return rows
+
+    def page(self, after=None, sort='time', descending=True, limit=PAGE_SIZE, term='', user=None, action=None, start=None, end=None):
+        # Same arguments and results as AuditLog.page, over the archive
+        key = self.SORT_KEYS[sort]
+        months = self.months(start, end)
+        if sort == 'time':
+            # Read month by month, newest first when descending, until the page is full
+            if after is not None:
+                months = [m for m in months if (m[0] <= after[0][:7] if descending else m[0] >= after[0][:7])]
+            if descending:
+                months.reverse()
+            rows = (row for month, size in months for row in (reversed(self._load(month, size)) if descending else self._load(month, size)))
+        else:
+            # Other orders need every month in range; keep the last sort for paging
+            cache_key = (sort, descending, tuple(months))
+            if self._sorted[0] != cache_key:
+                self._sorted = (cache_key, sorted((row for month, size in months for row in self._load(month, size)), key=key, reverse=descending))
+            rows = self._sorted[1]
+
+        end_before = (datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat() if end else None
+        term = term.strip().lower()
+        after = tuple(after) if after is not None else None
+        page = []
+        for row in rows:
+            if after is not None and (key(row) >= after if descending else key(row) <= after):
+                continue
+            if user and row[2] != user or action and row[3] != action:
+                continue
+            if start and row[1] < start or end_before and row[1] >= end_before:
+                continue
+            if term and term not in (row[4] or '').lower():
+                continue
+            page.append(row)
+            if len(page) > limit:
+                break
+        if len(page) > limit:
+            return page[:limit], key(page[limit - 1])
+        return page, None
+
+
+# python archive.py [--days N] [--db shop.db] archives once; without --days
+# the audit_retention_days setting is used
+def main():
+    parser = argparse.ArgumentParser(description="Move old audit log entries into monthly archive files")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--days', type=int, help="keep this many days in the database")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    try:
+        days = args.days if args.days is not None else db.settings.get_int('audit_retention_days', 0)
+        if days <= 0:
+            print("No retention configured; set audit_retention_days or pass --days")
+            return 1
+        archive = AuditArchive(db)
+        moved = archive.archive(days)
+        print(f"Archived {moved} entries to {archive.directory}")
+        for month, size in archive.months():
+            print(f"  {month}: {size} bytes")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
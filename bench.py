@@ -0,0 +1,682 @@
+import argparse
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from store import Database, InsufficientStock
+
+# Benchmarks run against a throwaway database seeded here, never shop.db.
+
+
+def seed_products(db, count, quantity):
+    with db.conn:
+        db.conn.executemany("INSERT INTO products (name, category, quantity, price, min_stock) VALUES (?, ?, ?, ?, ?)",
+                            [(f"Bench product {i}", f"Category {i % 20}", quantity, 1.0 + i % 50, 5) for i in range(count)])
+        db.conn.execute("INSERT INTO customers (name) VALUES ('Bench customer')")
+    product_ids = [row[0] for row in db.conn.execute("SELECT id FROM products ORDER BY id")]
+    customer_id = db.conn.execute("SELECT id FROM customers WHERE name='Bench customer'").fetchone()[0]
+    return product_ids, customer_id
+
+
+def bench_sale(db, args):
+    product_ids, customer_id = seed_products(db, args.products, 10 ** 9)
+    print(f"{'lines':>6} {'sales':>7} {'seconds':>9} {'sales/s':>9} {'lines/s':>10}")
+    for lines in args.baskets:
+        items = [{'id': product_ids[i % len(product_ids)], 'quantity': 1, 'price': 2.5} for i in range(lines)]
+        start = time.perf_counter()
+        for _ in range(args.sales):
+            db.sales.create_sale(customer_id, items, 0, 'Cash')
+        elapsed = time.perf_counter() - start
+        print(f"{lines:>6} {args.sales:>7} {elapsed:>9.3f} {args.sales / elapsed:>9.1f} {args.sales * lines / elapsed:>10.1f}")
+
+    # A basket that cannot be filled must leave stock untouched
+    with db.conn:
+        db.conn.execute("UPDATE products SET quantity = 0 WHERE id = ?", (product_ids[-1],))
+    before = db.conn.execute("SELECT SUM(quantity) FROM products").fetchone()[0]
+    items = [{'id': product_id, 'quantity': 1, 'price': 2.5} for product_id in product_ids[-10:]]
+    try:
+        db.sales.create_sale(customer_id, items, 0, 'Cash')
+        print("shortage check: FAILED (sale went through)")
+    except InsufficientStock:
+        after = db.conn.execute("SELECT SUM(quantity) FROM products").fetchone()[0]
+        print("shortage check:", "ok" if before == after else "FAILED (stock changed)")
+
+
+def seed_sales(db, count, lines):
+    product_ids, customer_id = seed_products(db, max(lines, 100), 10 ** 9)
+    sale_ids = []
+    for i in range(count):
+        items = [{'id': product_ids[(i + j) % len(product_ids)], 'quantity': 1 + j % 3, 'price': 2.5} for j in range(lines)]
+        sale_ids.append(db.sales.create_sale(customer_id, items, 5 * (i % 2), 'Cash')[0])
+    return sale_ids
+
+
+def bench_receipts(db, args):
+    from receipts import ReceiptRenderer, IMAGE_DIR
+    from imagestore import ImageStore, THUMB_SIZES
+
+    sale_ids = seed_sales(db, args.receipts, args.lines)
+    if args.logo:
+        os.makedirs(IMAGE_DIR, exist_ok=True)
+        logo = 'bench_logo' + os.path.splitext(args.logo)[1]
+        shutil.copy(args.logo, os.path.join(IMAGE_DIR, logo))
+        db.settings.set('shop_logo', logo)
+
+    def cold():
+        # One renderer per receipt: settings, header and logo every time
+        for sale_id in sale_ids:
+            renderer = ReceiptRenderer(db)
+            list(renderer.iter_receipts([sale_id]))
+
+    renderer = ReceiptRenderer(db)
+    runs = [
+        ('cold, one file each', cold),
+        ('cached, one file each', lambda: list(renderer.iter_receipts(sale_ids))),
+        ('cached, one PDF', lambda: renderer.receipts(sale_ids, io.BytesIO())),
+    ]
+    try:
+        print(f"{'mode':<24} {'receipts':>9} {'seconds':>9} {'receipts/s':>11}")
+        for name, run in runs:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<24} {len(sale_ids):>9} {elapsed:>9.3f} {len(sale_ids) / elapsed:>11.1f}")
+    finally:
+        if args.logo:
+            os.remove(os.path.join(IMAGE_DIR, logo))
+            for size in THUMB_SIZES:
+                if os.path.exists(ImageStore(IMAGE_DIR).thumb_path(logo, size)):
+                    os.remove(ImageStore(IMAGE_DIR).thumb_path(logo, size))
+
+
+def bench_statement(db, args):
+    from receipts import ReceiptRenderer
+
+    seed_sales(db, args.sales, args.lines)
+    customer_id = db.conn.execute("SELECT id FROM customers WHERE name='Bench customer'").fetchone()[0]
+
+    start = time.perf_counter()
+    rows = len(db.customers.statement(customer_id).fetchall())
+    query = time.perf_counter() - start
+    print(f"statement query: {args.sales} sales, {rows} rows in {query * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    data = ReceiptRenderer(db).customer_report_bytes(customer_id)
+    elapsed = time.perf_counter() - start
+    print(f"statement PDF: {len(data) / 1024:.0f} KiB in {elapsed:.3f} s")
+
+
+# The report queries as they were before the rollup, for comparison
+RAW_REPORTS = {
+    'totals': "SELECT SUM(total) FROM sales WHERE date BETWEEN ? AND ?",
+    'by month': "SELECT strftime('%Y-%m', date) AS month, SUM(total) FROM sales WHERE date BETWEEN ? AND ? GROUP BY month",
+    'by category': """SELECT p.category, SUM(si.quantity * si.price) FROM sale_items si JOIN products p ON si.product_id = p.id
+        JOIN sales s ON si.sale_id = s.id WHERE s.date BETWEEN ? AND ? GROUP BY p.category""",
+    'top customers': """SELECT c.name, SUM(s.total) AS total_spent FROM sales s JOIN customers c ON s.customer_id = c.id
+        WHERE s.date BETWEEN ? AND ? GROUP BY c.id ORDER BY total_spent DESC LIMIT 10""",
+}
+
+
+def seed_history(db, args):
+    # Several years of history inserted directly; the rollup triggers fire as
+    # it goes in, so seeding also exercises incremental maintenance
+    import random
+
+    product_ids, customer_id = seed_products(db, args.products, 10 ** 9)
+    with db.conn:
+        db.conn.executemany("INSERT INTO customers (name) VALUES (?)", [(f"Customer {i}",) for i in range(args.customers)])
+    customer_ids = [row[0] for row in db.conn.execute("SELECT id FROM customers")]
+    rng = random.Random(1)
+    first = datetime.date.today() - datetime.timedelta(days=365 * args.years)
+    start = time.perf_counter()
+    with db.conn:
+        for _ in range(args.sales):
+            date = (first + datetime.timedelta(days=rng.randrange(365 * args.years))).isoformat()
+            lines = [(rng.choice(product_ids), rng.randint(1, 5), 1.0 + rng.randrange(50)) for _ in range(args.lines)]
+            discount = rng.choice((0, 0, 5, 10))
+            total = sum(quantity * price for product_id, quantity, price in lines) * (1 - discount / 100)
+            sale_id = db.conn.execute("INSERT INTO sales (customer_id, date, total, discount, payment_method) VALUES (?, ?, ?, ?, 'Cash')",
+                                      (rng.choice(customer_ids), date, total, discount)).lastrowid
+            db.conn.executemany("INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                                [(sale_id, product_id, quantity, price) for product_id, quantity, price in lines])
+    seeded = time.perf_counter() - start
+    rows = db.conn.execute("SELECT COUNT(*) FROM sales_rollup").fetchone()[0]
+    print(f"seeded {args.sales} sales x {args.lines} lines over {args.years} years in {seeded:.2f}s; {rows} rollup rows")
+    return first
+
+
+def bench_report(db, args):
+    first = seed_history(db, args)
+
+    reports = db.reports
+    rollup = {
+        'totals': lambda a, b: reports.period_totals(a, b)[0],
+        'by month': lambda a, b: reports.sales_by_period(a, b, 'month'),
+        'by category': reports.sales_by_category,
+        'top customers': reports.top_customers,
+    }
+    span = (first.isoformat(), datetime.date.today().isoformat())
+    print(f"{'report':<14} {'raw ms':>9} {'rollup ms':>10} {'same':>5}")
+    for name, sql in RAW_REPORTS.items():
+        start = time.perf_counter()
+        raw = db.conn.execute(sql, span).fetchall()
+        raw_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        result = rollup[name](*span)
+        rollup_ms = (time.perf_counter() - start) * 1000
+        if name == 'totals':
+            same = abs(raw[0][0] - result) < 0.01
+        else:
+            same = sorted((key, round(value, 2)) for key, value in raw) == sorted((key, round(value, 2)) for key, value in result)
+        print(f"{name:<14} {raw_ms:>9.1f} {rollup_ms:>10.1f} {'yes' if same else 'NO':>5}")
+    for granularity in ('day', 'week', 'quarter'):
+        start = time.perf_counter()
+        periods = len(reports.sales_by_period(*span, granularity))
+        print(f"by {granularity:<11} {'':>9} {(time.perf_counter() - start) * 1000:>10.1f}  ({periods} periods)")
+
+    # What the triggers maintained must match a rebuild from scratch
+    def snapshot():
+        return [row[:5] + tuple(round(value, 2) for value in row[5:])
+                for row in db.conn.execute("SELECT * FROM sales_rollup ORDER BY grain, day, product_id, category, customer_id")]
+    incremental = snapshot()
+    reports.rebuild_summaries()
+    print("rebuild check:", "ok" if snapshot() == incremental else "FAILED")
+
+
+def bench_audit(db, args):
+    # Writing: one commit per entry (the old log_action) vs the buffered writer
+    conn = db.conn
+    start = time.perf_counter()
+    for i in range(args.writes):
+        with conn:
+            conn.execute("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?, ?, ?, ?)",
+                         (datetime.datetime.now().isoformat(), 'admin', 'Update Product', f"Updated product ID {i}"))
+    direct = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(args.writes):
+        db.audit.log('admin', 'Update Product', f"Updated product ID {i}")
+    db.audit.flush()
+    buffered = time.perf_counter() - start
+    print(f"{args.writes} entries: {args.writes / direct:.0f}/s committed one by one, {args.writes / buffered:.0f}/s buffered")
+
+    # Searching: months of history spread over a handful of users and actions
+    import random
+
+    rng = random.Random(1)
+    users = [f"user{i}" for i in range(args.users)]
+    actions = ["Complete Sale", "Return Item", "Add Product", "Update Product", "Delete Product", "Add Customer", "Export"]
+    first = datetime.datetime.now() - datetime.timedelta(days=30 * args.months)
+    step = datetime.timedelta(days=30 * args.months) / args.rows
+    start = time.perf_counter()
+    with conn:
+        conn.executemany("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?, ?, ?, ?)",
+                         (((first + step * i).isoformat(), rng.choice(users), rng.choice(actions), f"Entry {i} ref {rng.randrange(10 ** 6)}")
+                          for i in range(args.rows)))
+    print(f"seeded {args.rows} entries over {args.months} months in {time.perf_counter() - start:.2f}s")
+
+    month = (datetime.date.today() - datetime.timedelta(days=60)).replace(day=1)
+    queries = {
+        'latest': {},
+        'one user': {'user': users[0]},
+        'one action': {'action': 'Return Item'},
+        'user + action': {'user': users[0], 'action': 'Export'},
+        'one month': {'start': month.isoformat(), 'end': (month + datetime.timedelta(days=30)).isoformat()},
+        'by user a-z': {'sort': 'user', 'descending': False},
+        'details term': {'term': 'ref 12345'},
+    }
+    print(f"{'query':<14} {'first ms':>9} {'10 pages ms':>12}")
+    for name, kwargs in queries.items():
+        start = time.perf_counter()
+        rows, after = db.audit.page(**kwargs)
+        first_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for _ in range(10):
+            if after is None:
+                break
+            rows, after = db.audit.page(after, **kwargs)
+        print(f"{name:<14} {first_ms:>9.1f} {(time.perf_counter() - start) * 1000:>12.1f}")
+
+
+def bench_archive(db, args):
+    # Sale latency with and without the archiver moving old audit entries
+    from archive import AuditArchive
+
+    product_ids, customer_id = seed_products(db, 100, 10 ** 9)
+    first = datetime.datetime.now() - datetime.timedelta(days=30 * args.months)
+    step = datetime.timedelta(days=30 * args.months) / args.rows
+    with db.conn:
+        db.conn.executemany("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?, ?, ?, ?)",
+                            (((first + step * i).isoformat(), f"user{i % 5}", "Update Product", f"Updated product ID {i % 1000}")
+                             for i in range(args.rows)))
+    items = [{'id': product_ids[i], 'quantity': 1, 'price': 2.5} for i in range(3)]
+
+    def sales(until):
+        latencies = []
+        while not until() and len(latencies) < args.sales:
+            start = time.perf_counter()
+            db.sales.create_sale(customer_id, items, 0, 'Cash', user='bench')
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    directory = tempfile.mkdtemp()
+    try:
+        archive = AuditArchive(db, directory)
+        baseline = sales(lambda: False)
+        done = threading.Event()
+        moved = []
+
+        def run():
+            start = time.perf_counter()
+            moved.append(archive.archive(args.days))
+            moved.append(time.perf_counter() - start)
+            db.pool.release()
+            done.set()
+
+        threading.Thread(target=run).start()
+        during = sales(done.is_set)
+        done.wait()
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"archived {moved[0]} of {args.rows} entries in {moved[1]:.2f}s into {len(os.listdir(directory))} files, {size / 1024:.0f} KiB")
+        print(f"{'sales':<16} {'count':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, latencies in (("alone", baseline), ("while archiving", during)):
+            print(f"{name:<16} {len(latencies):>6} {percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.99):>8.2f} {max(latencies):>8.2f}")
+
+        month = (datetime.date.today() - datetime.timedelta(days=30 * args.months // 2)).replace(day=1)
+        for name, kwargs in (("latest archived", {}), ("one month", {'start': month.isoformat(), 'end': (month + datetime.timedelta(days=30)).isoformat()}),
+                             ("details term", {'term': 'product id 999'})):
+            start = time.perf_counter()
+            rows, after = archive.page(**kwargs)
+            print(f"archive search {name:<16} {(time.perf_counter() - start) * 1000:>8.1f} ms")
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_images(db, args):
+    # Browsing a catalog of camera-sized JPEGs: full decode per view (the old
+    # products tab) vs thumbnails vs the LRU cache
+    from PIL import Image
+    from imagestore import ImageStore
+
+    directory = tempfile.mkdtemp()
+    store = ImageStore(os.path.join(directory, 'store'))
+    try:
+        sources = []
+        for i in range(args.images):
+            img = Image.linear_gradient('L').resize((args.width, args.height)).convert('RGB')
+            img.paste((40 * i % 256, 90, 160), (i * 7 % 500, 100, i * 7 % 500 + 400, 600))
+            path = os.path.join(directory, f"upload_{i}.jpg")
+            img.save(path, quality=90)
+            sources.append(path)
+        start = time.perf_counter()
+        names = [store.add(path) for path in sources]
+        uploaded = time.perf_counter() - start
+        store.wait()
+        thumbnailed = time.perf_counter() - start
+        copy = os.path.join(directory, 'same_image_again.jpg')
+        shutil.copy(sources[0], copy)
+        stored = len([name for name in os.listdir(store.directory) if name.endswith('.jpg')])
+        print(f"{args.images} uploads of {args.width}x{args.height}: {uploaded * 1000 / args.images:.1f} ms each on the caller, "
+              f"thumbnails done after {thumbnailed:.2f}s; dedupe:", "ok" if store.add(copy) == names[0] and stored == args.images else "FAILED")
+
+        views = [names[i % len(names)] for i in range(args.views)]
+
+        def legacy():
+            for name in views:
+                Image.open(store.path(name)).resize((200, 200), Image.LANCZOS)
+
+        def thumbnails():
+            for name in views:
+                store.load(name)
+
+        for name in views:
+            store.image(name)
+        runs = [("full decode", legacy), ("thumbnail", thumbnails), ("LRU cache", lambda: [store.image(name) for name in views])]
+        print(f"{'view':<12} {'views':>6} {'ms/view':>9}")
+        for name, run in runs:
+            start = time.perf_counter()
+            run()
+            print(f"{name:<12} {len(views):>6} {(time.perf_counter() - start) * 1000 / len(views):>9.3f}")
+    finally:
+        store.wait()
+        shutil.rmtree(directory)
+
+
+def bench_chart(db, args):
+    # The report chart over the whole history: clearing the axes and drawing
+    # every period (the old generate_report) vs the chart layer
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from charts import BarChart, SalesSeries
+
+    first = seed_history(db, args)
+    start, end = first.isoformat(), datetime.date.today().isoformat()
+
+    fig = Figure(figsize=(8, 4))
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    chart_fig = Figure(figsize=(8, 4))
+    chart = BarChart(chart_fig, FigureCanvasAgg(chart_fig))
+    series = SalesSeries(db)
+
+    def timed(run, repeat=args.repeat):
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        return (time.perf_counter() - start_time) * 1000 / repeat
+
+    def legacy(granularity):
+        rows = db.reports.sales_by_period(start, end, granularity)
+        ax.clear()
+        ax.bar([row[0] for row in rows], [row[1] for row in rows], color='#4682B4')
+        ax.set_title(f"Sales by {granularity}")
+        canvas.draw()
+
+    def cold(granularity):
+        series.invalidate()
+        series.get(start, end, granularity)
+
+    def draw(granularity):
+        result = series.submit(start, end, granularity).result()
+        chart.update(result['series'], f"Sales by {granularity}", granularity, "Total Sales ($)")
+
+    print(f"{args.years} years, {start} to {end}")
+    print(f"{'group by':<9} {'periods':>8} {'bars':>5} {'old ms':>8} {'query ms':>9} {'cached ms':>10} {'draw ms':>8}")
+    for granularity in ('day', 'week', 'month', 'quarter'):
+        periods = len(db.reports.sales_by_period(start, end, granularity))
+        old_ms = timed(lambda: legacy(granularity), 1 if periods > 500 else args.repeat)
+        query_ms = timed(lambda: cold(granularity))
+        cached_ms = timed(lambda: series.submit(start, end, granularity).result())
+        draw_ms = timed(lambda: draw(granularity))
+        bars = len(series.get(start, end, granularity)['series'])
+        print(f"{granularity:<9} {periods:>8} {bars:>5} {old_ms:>8.1f} {query_ms:>9.2f} {cached_ms:>10.3f} {draw_ms:>8.1f}")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_realtime(db, args):
+    # Needs python-socketio with its asyncio client (aiohttp) and uvicorn
+    import asyncio
+    import socket
+    import threading
+    import socketio
+    from realtime import RealtimeHub
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    hub = RealtimeHub(db, 'bench', batch_interval=args.batch_interval)
+    hub.start('127.0.0.1', port)
+    while hub.server is None or not hub.server.started:
+        time.sleep(0.01)
+
+    latencies = []
+    expected = args.clients * args.events
+
+    async def run():
+        done = asyncio.Event()
+
+        def received(data):
+            latencies.append(time.perf_counter() - data['sent'])
+            if len(latencies) >= expected:
+                done.set()
+
+        clients = []
+        for i in range(args.clients):
+            client = socketio.AsyncClient()
+            client.on('bench', received)
+            client.on('batch', lambda events: [received(data) for event, data in events if event == 'bench'])
+            await client.connect(f"http://127.0.0.1:{port}", auth={'store': 'bench', 'terminal': f"t{i}"}, transports=['websocket'])
+            clients.append(client)
+
+        # Emit from a plain thread, the way the Tk thread does
+        def produce():
+            for i in range(args.events):
+                hub.emit('bench', {'n': i, 'sent': time.perf_counter()})
+                if args.rate:
+                    time.sleep(1 / args.rate)
+
+        start = time.perf_counter()
+        producer = threading.Thread(target=produce)
+        producer.start()
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+        producer.join()
+        for client in clients:
+            await client.disconnect()
+        return elapsed
+
+    try:
+        elapsed = asyncio.run(run())
+    finally:
+        hub.stop()
+    print(f"{args.clients} clients, {args.events} events, batch interval {args.batch_interval * 1000:.0f} ms")
+    print(f"delivered {len(latencies)}/{expected} in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} deliveries/s")
+    if latencies:
+        print("latency ms: " + "  ".join(f"p{int(f * 100)} {percentile(latencies, f) * 1000:.1f}" for f in (0.5, 0.95, 0.99))
+              + f"  max {max(latencies) * 1000:.1f}")
+
+
+def bench_inventory(db, args):
+    # Concurrent terminals sending batches of stock deltas; every batch is
+    # acked and the final quantities must add up
+    import asyncio
+    import random
+    import socket
+    import socketio
+    import realtime
+    from realtime import RealtimeHub
+
+    product_ids, customer_id = seed_products(db, args.products, 10 ** 6)
+    start_total = db.conn.execute("SELECT SUM(quantity) FROM products").fetchone()[0]
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    realtime.UPDATE_RATE = realtime.UPDATE_BURST = 10 ** 9
+    hub = RealtimeHub(db, 'bench')
+    hub.start('127.0.0.1', port)
+    while hub.server is None or not hub.server.started:
+        time.sleep(0.01)
+
+    latencies = []
+    applied = []
+
+    async def terminal(i):
+        client = socketio.AsyncClient()
+        await client.connect(f"http://127.0.0.1:{port}", auth={'store': 'bench', 'terminal': f"t{i}"}, transports=['websocket'])
+        rng = random.Random(i)
+        for _ in range(args.batches):
+            ids = rng.sample(product_ids, args.size)
+            updates = [{'id': product_id, 'delta': rng.choice((-1, 1))} for product_id in ids]
+            sent = time.perf_counter()
+            ack = await client.call('update_inventory', {'updates': updates}, timeout=args.timeout)
+            latencies.append(time.perf_counter() - sent)
+            if ack['ok']:
+                applied.append(sum(update['delta'] for update in updates))
+        await client.disconnect()
+
+    async def run():
+        await asyncio.gather(*(terminal(i) for i in range(args.clients)))
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(run())
+    finally:
+        hub.stop()
+    elapsed = time.perf_counter() - start
+    end_total = db.conn.execute("SELECT SUM(quantity) FROM products").fetchone()[0]
+    batches = args.clients * args.batches
+    print(f"{args.clients} clients x {args.batches} batches of {args.size}: {batches / elapsed:.0f} batches/s, "
+          f"{batches * args.size / elapsed:.0f} updates/s, {len(applied)}/{batches} applied")
+    print("latency ms: " + "  ".join(f"p{int(f * 100)} {percentile(latencies, f) * 1000:.1f}" for f in (0.5, 0.95, 0.99)))
+    print("totals check:", "ok" if end_total == start_total + sum(applied) else "FAILED")
+
+
+def bench_sync(db, args):
+    # A hub and a terminal set up from copies of one database both sell
+    # while the terminal is offline; then it catches up in one sync round
+    import asyncio
+    import random
+    import socket
+    from realtime import RealtimeHub
+    from sync import SyncClient
+
+    product_ids, customer_id = seed_products(db, args.products, 10 ** 6)
+    db.sync.host()
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    path = db.path + '.terminal'
+    shutil.copy(db.path, path)
+    terminal = Database(path)
+    terminal.sync.join(db.sync.database_id())
+
+    rng = random.Random(1)
+    for _ in range(args.sales):
+        for shop in (db, terminal):
+            items = [{'id': product_id, 'quantity': rng.randint(1, 3), 'price': 2.5}
+                     for product_id in rng.sample(product_ids, args.lines)]
+            shop.sales.create_sale(customer_id, items, 0, 'Cash')
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    hub = RealtimeHub(db, 'bench')
+    hub.start('127.0.0.1', port)
+    while hub.server is None or not hub.server.started:
+        time.sleep(0.01)
+    client = SyncClient(terminal, f"http://127.0.0.1:{port}", 'bench')
+
+    async def run():
+        client.loop = asyncio.get_running_loop()
+        client._wake = asyncio.Event()
+        connection = await client._connect()
+        try:
+            start = time.perf_counter()
+            pushed, pulled = await client.sync_once(connection)
+            return pushed, pulled, time.perf_counter() - start
+        finally:
+            await connection.disconnect()
+
+    try:
+        pushed, pulled, elapsed = asyncio.run(run())
+    finally:
+        hub.stop()
+    print(f"{args.sales} sales of {args.lines} lines on each side: pushed {pushed}, pulled {pulled} changes "
+          f"in {elapsed:.3f}s ({(pushed + pulled) / elapsed:.0f} changes/s)")
+
+    def state(shop):
+        stock = shop.conn.execute("SELECT uid, quantity FROM products ORDER BY uid").fetchall()
+        return stock, shop.conn.execute("SELECT COUNT(*), ROUND(SUM(total), 2) FROM sales").fetchone(), \
+            shop.reports.dashboard_stats()
+
+    try:
+        print("convergence check:", "ok" if state(db) == state(terminal) else "FAILED")
+    finally:
+        terminal.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+BENCHMARKS = {
+    'sale': bench_sale,
+    'receipts': bench_receipts,
+    'statement': bench_statement,
+    'realtime': bench_realtime,
+    'inventory': bench_inventory,
+    'sync': bench_sync,
+    'report': bench_report,
+    'audit': bench_audit,
+    'archive': bench_archive,
+    'images': bench_images,
+    'chart': bench_chart,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shop performance benchmarks")
+    parser.add_argument('--db', help="database file (default: a temporary file)")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+    sale = sub.add_parser('sale', help="sale commits per second by basket size")
+    sale.add_argument('--sales', type=int, default=500)
+    sale.add_argument('--products', type=int, default=1000)
+    sale.add_argument('--baskets', type=int, nargs='+', default=[1, 10, 100])
+    receipts = sub.add_parser('receipts', help="receipts rendered per second")
+    receipts.add_argument('--receipts', type=int, default=200)
+    receipts.add_argument('--lines', type=int, default=5)
+    receipts.add_argument('--logo', help="image to use as the shop logo")
+    statement = sub.add_parser('statement', help="customer statement for one large account")
+    statement.add_argument('--sales', type=int, default=3000)
+    statement.add_argument('--lines', type=int, default=3)
+    realtime = sub.add_parser('realtime', help="realtime fan-out to many socket.io clients")
+    realtime.add_argument('--clients', type=int, default=50)
+    realtime.add_argument('--events', type=int, default=2000)
+    realtime.add_argument('--rate', type=float, default=0, help="events per second from the app (0: as fast as possible)")
+    realtime.add_argument('--batch-interval', type=float, default=0.05)
+    realtime.add_argument('--timeout', type=float, default=60)
+    inventory = sub.add_parser('inventory', help="batched inventory deltas from many terminals")
+    inventory.add_argument('--clients', type=int, default=20)
+    inventory.add_argument('--batches', type=int, default=50)
+    inventory.add_argument('--size', type=int, default=20, help="updates per batch")
+    inventory.add_argument('--products', type=int, default=1000)
+    inventory.add_argument('--timeout', type=float, default=30)
+    sync = sub.add_parser('sync', help="offline terminal catching up with the hub")
+    sync.add_argument('--sales', type=int, default=500)
+    sync.add_argument('--lines', type=int, default=3)
+    sync.add_argument('--products', type=int, default=1000)
+    report = sub.add_parser('report', help="report queries over years of history, raw tables vs rollup")
+    report.add_argument('--sales', type=int, default=100000)
+    report.add_argument('--lines', type=int, default=3)
+    report.add_argument('--years', type=int, default=5)
+    report.add_argument('--products', type=int, default=500)
+    report.add_argument('--customers', type=int, default=50)
+    audit = sub.add_parser('audit', help="audit log writes and searches over months of entries")
+    audit.add_argument('--writes', type=int, default=2000)
+    audit.add_argument('--rows', type=int, default=500000)
+    audit.add_argument('--months', type=int, default=12)
+    audit.add_argument('--users', type=int, default=10)
+    archive = sub.add_parser('archive', help="sale latency while old audit entries are archived")
+    archive.add_argument('--rows', type=int, default=300000)
+    archive.add_argument('--months', type=int, default=12)
+    archive.add_argument('--days', type=int, default=30, help="retention")
+    archive.add_argument('--sales', type=int, default=2000)
+    images = sub.add_parser('images', help="product image uploads and browsing")
+    images.add_argument('--images', type=int, default=50)
+    images.add_argument('--views', type=int, default=200)
+    images.add_argument('--width', type=int, default=4000)
+    images.add_argument('--height', type=int, default=3000)
+    chart = sub.add_parser('chart', help="report chart over years of history, redraw vs the chart layer")
+    chart.add_argument('--sales', type=int, default=50000)
+    chart.add_argument('--lines', type=int, default=3)
+    chart.add_argument('--years', type=int, default=5)
+    chart.add_argument('--products', type=int, default=500)
+    chart.add_argument('--customers', type=int, default=50)
+    chart.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.db:
+        path = args.db
+    else:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+    db = Database(path)
+    try:
+        BENCHMARKS[args.benchmark](db, args)
+    finally:
+        db.close()
+        if not args.db:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# The sales report chart. Series are queried on a worker thread and cached per
+# (range, granularity) until sales or expenses change. The bars are created
+# once and updated in place rather than clearing the axes, and series longer
+# than MAX_BARS are summed into wider buckets, so five years by day is still
+# a readable chart that draws quickly.
+MAX_BARS = 120
+MAX_LABELS = 12
+CACHE_SIZE = 32
+BAR_COLOR = '#4682B4'
+# Granularities whose periods are ISO dates, and the days each one spans
+DATE_PERIODS = {'day': 1, 'week': 7}
+
+
+def downsample(series, granularity, max_bars=MAX_BARS):
+    # Returns (series, periods per bar). Date periods go into equal spans of
+    # time, so gaps in the data don't stretch a bar; others into equal runs.
+    if len(series) <= max_bars:
+        return series, 1
+    days = DATE_PERIODS.get(granularity)
+    if days:
+        first = datetime.date.fromisoformat(series[0][0])
+        span = (datetime.date.fromisoformat(series[-1][0]) - first).days // days + 1
+        per_bar = -(-span // max_bars)
+        key = lambda index, period: (datetime.date.fromisoformat(period) - first).days // days // per_bar
+    else:
+        per_bar = -(-len(series) // max_bars)
+        key = lambda index, period: index // per_bar
+    buckets = OrderedDict()
+    for index, (period, total) in enumerate(series):
+        bucket = key(index, period)
+        if bucket in buckets:
+            buckets[bucket][1] += total
+        else:
+            buckets[bucket] = [period, total]
+    return [tuple(bucket) for bucket in buckets.values()], per_bar
+
+
+class SalesSeries:
+    def __init__(self, db, cache_size=CACHE_SIZE):
+        self.db = db
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._worker = None
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+            self._generation += 1
+
+    def get(self, start, end, granularity):
+        # {'totals': (sales, expenses), 'series': [(period, sales)], 'per_bar': n}
+        key = (start, end, granularity)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            generation = self._generation
+        reports = self.db.reports
+        series, per_bar = downsample(reports.sales_by_period(start, end, granularity), granularity)
+        result = {'totals': reports.period_totals(start, end), 'series': series, 'per_bar': per_bar}
+        with self._lock:
+            # Don't cache what was read before an invalidate
+            if generation == self._generation:
+                self._cache[key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def submit(self, start, end, granularity):
+        # A Future for get(); already done when the result is cached
+        key = (start, end, granularity)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(self._cache[key])
+                return future
+            if self._worker is None:
+                self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='charts')
+            return self._worker.submit(self.get, start, end, granularity)
+
+
+class BarChart:
+    def __init__(self, figure, canvas, max_bars=MAX_BARS, color=BAR_COLOR):
+        self.canvas = canvas
+        self.ax = figure.add_subplot()
+        self.bars = self.ax.bar(range(max_bars), [0] * max_bars, color=color).patches
+        for bar in self.bars:
+            bar.set_visible(False)
+        self.message = self.ax.text(0.5, 0.5, "", horizontalalignment='center', verticalalignment='center', transform=self.ax.transAxes)
+
+    def update(self, series, title, xlabel, ylabel, empty=""):
+        series = series[:len(self.bars)]
+        for index, bar in enumerate(self.bars):
+            if index < len(series):
+                bar.set_height(series[index][1])
+                bar.set_visible(True)
+            else:
+                bar.set_visible(False)
+        values = [total for period, total in series]
+        low, high = min(values + [0]), max(values + [0])
+        self.ax.set_xlim(-0.5, max(len(series), 1) - 0.5)
+        self.ax.set_ylim(low * 1.05, high * 1.05 or 1)
+        step = -(-len(series) // MAX_LABELS) or 1
+        self.ax.set_xticks(range(0, len(series), step))
+        self.ax.set_xticklabels([series[index][0] for index in range(0, len(series), step)])
+        self.ax.set_title(title)
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.message.set_text("" if series else empty)
+        self.canvas.draw_idle()
@@ -0,0 +1,101 @@
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from store import Database, DB_PATH
+from export_worker import RENDERERS, init_worker
+
+# Bulk receipt/statement export. Rendering is spread over worker processes,
+# each with its own connection and renderer; the parent only writes the
+# returned PDF bytes into a dated directory or a zip file. Workers are
+# spawned rather than forked, since the desktop app runs exports from a
+# thread alongside Tk and the other background threads.
+EXPORT_DIR = "exports"
+CHUNK_SIZE = 50
+
+
+def default_output(kind, as_zip=False):
+    stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
+    path = os.path.join(EXPORT_DIR, f"{kind}_{stamp}")
+    return path + ".zip" if as_zip else path
+
+
+def export(db_path, kind, ids, out, workers=None, progress=None, cancel=None):
+    # out is a directory, or a file name ending in .zip; progress(done, total)
+    # is called from this thread as chunks finish. Returns files written.
+    render = RENDERERS[kind]
+    chunks = [ids[start:start + CHUNK_SIZE] for start in range(0, len(ids), CHUNK_SIZE)]
+    if out.endswith('.zip'):
+        os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+        archive = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
+    else:
+        os.makedirs(out, exist_ok=True)
+        archive = None
+
+    done = written = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(db_path,)) as pool:
+            futures = {pool.submit(render, chunk): len(chunk) for chunk in chunks}
+            for future in as_completed(futures):
+                for name, data in future.result():
+                    if archive is not None:
+                        archive.writestr(name, data)
+                    else:
+                        with open(os.path.join(out, name), 'wb') as f:
+                            f.write(data)
+                    written += 1
+                done += futures[future]
+                if progress:
+                    progress(done, len(ids))
+                if cancel is not None and cancel.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+    finally:
+        if archive is not None:
+            archive.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export receipts or customer statements as PDF")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--workers', type=int, help="render processes (default: CPU count)")
+    parser.add_argument('--zip', action='store_true', help="write one zip file instead of a directory")
+    parser.add_argument('--out', help="output directory or .zip file (default: dated name under exports/)")
+    sub = parser.add_subparsers(dest='kind', required=True)
+    receipts = sub.add_parser('receipts', help="receipts for sales in a date range")
+    receipts.add_argument('--from', dest='start', required=True, help="YYYY-MM-DD")
+    receipts.add_argument('--to', dest='end', required=True, help="YYYY-MM-DD")
+    sub.add_parser('statements', help="statements for every customer")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    try:
+        if args.kind == 'receipts':
+            ids = db.sales.ids_between(args.start, args.end)
+        else:
+            ids = db.customers.ids()
+    finally:
+        db.close()
+    if not ids:
+        print("Nothing to export")
+        return 0
+
+    out = args.out or default_output(args.kind, args.zip)
+
+    def progress(done, total):
+        print(f"\r{done}/{total}", end='', flush=True)
+
+    written = export(args.db, args.kind, ids, out, args.workers, progress)
+    print(f"\nWrote {written} files to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+from store import Database
+from receipts import ReceiptRenderer
+
+# Entry points for export's worker processes. Workers are spawned and import
+# this module fresh, so it must not import pos or tkinter.
+_renderer = None
+
+
+def init_worker(db_path):
+    global _renderer
+    _renderer = ReceiptRenderer(Database(db_path))
+
+
+def render_receipts(sale_ids):
+    return [(f"receipt_{sale_id}.pdf", data) for sale_id, data in _renderer.iter_receipts(sale_ids)]
+
+
+def render_statements(customer_ids):
+    files = []
+    for customer_id in customer_ids:
+        data = _renderer.customer_report_bytes(customer_id)
+        if data is not None:
+            files.append((f"customer_report_{customer_id}.pdf", data))
+    return files
+
+
+RENDERERS = {
+    'receipts': render_receipts,
+    'statements': render_statements,
+}
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+# Content-addressed product images and logos. An upload is stored once, named
+# after the hash of its bytes, so re-uploading a file is free and two files
+# that happen to share a name no longer overwrite each other. A worker renders
+# JPEG thumbnails in THUMB_SIZES into images/thumbs right after the upload;
+# screens and PDFs use those instead of decoding the original, and the
+# CTkImages built from them are kept in an LRU cache.
+IMAGE_DIR = "images"
+THUMB_DIR = "thumbs"
+DISPLAY_SIZE = 200
+PRINT_SIZE = 400  # ~340 dpi for the 30 mm receipt logo
+THUMB_SIZES = (DISPLAY_SIZE, PRINT_SIZE)
+CACHE_SIZE = 256
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif'}
+
+
+class ImageStore:
+    def __init__(self, directory=IMAGE_DIR, cache_size=CACHE_SIZE):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def thumb_path(self, name, size):
+        return os.path.join(self.directory, THUMB_DIR, f"{os.path.splitext(name)[0]}_{size}.jpg")
+
+    def add(self, source):
+        # Stores the file at source and returns its name in the store
+        with Image.open(source) as img:
+            ext = FORMATS.get(img.format)
+            img.verify()
+        if ext is None:
+            raise ValueError("Only JPEG, PNG and GIF images are supported")
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        name = digest.hexdigest()[:40] + ext
+        path = self.path(name)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        with self._lock:
+            if self._worker is None:
+                self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnails')
+            self._worker.submit(self.thumbnails, name)
+        return name
+
+    def wait(self):
+        # Blocks until queued thumbnails are written
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.shutdown(wait=True)
+
+    def thumbnails(self, name):
+        for size in THUMB_SIZES:
+            try:
+                self.thumbnail(name, size)
+            except Exception as e:
+                print(f"Thumbnail for {name} failed: {e}")
+
+    def thumbnail(self, name, size):
+        # Path of the size x size thumbnail, rendered now if missing or older
+        # than the image (names from before the store aren't content hashed);
+        # None when the image itself is gone
+        source = self.path(name)
+        thumb = self.thumb_path(name, size)
+        try:
+            if os.path.getmtime(thumb) >= os.path.getmtime(source):
+                return thumb
+        except OSError:
+            if not os.path.exists(source):
+                return None
+        with Image.open(source) as img:
+            # For JPEGs this decodes at a fraction of full size
+            img.thumbnail((size, size), Image.LANCZOS)
+            img = ImageOps.exif_transpose(img)
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                img = img.convert('RGBA')
+                flat = Image.new('RGB', img.size, 'white')
+                flat.paste(img, mask=img.getchannel('A'))
+                img = flat
+            else:
+                img = img.convert('RGB')
+        os.makedirs(os.path.dirname(thumb), exist_ok=True)
+        tmp = f"{thumb}.{threading.get_ident()}.tmp"
+        img.save(tmp, 'JPEG', quality=85)
+        os.replace(tmp, thumb)
+        return thumb
+
+    def load(self, name, size=DISPLAY_SIZE):
+        # The image from its smallest thumbnail of at least size, or None
+        thumb = self.thumbnail(name, min((s for s in THUMB_SIZES if s >= size), default=THUMB_SIZES[-1]))
+        if thumb is None:
+            return None
+        img = Image.open(thumb)
+        img.load()
+        return img
+
+    def _cached(self, key, build):
+        value = self._cache.get(key)
+        if value is not None:
+            self._cache.move_to_end(key)
+            return value
+        value = build()
+        if value is not None:
+            self._cache[key] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def image(self, name, size=DISPLAY_SIZE):
+        # load(), from the LRU cache when possible
+        return self._cached(('image', name, size), lambda: self.load(name, size))
+
+    def ctk_image(self, name, size=DISPLAY_SIZE):
+        # A CTkImage fitting in size x size, from the LRU cache when possible
+        import customtkinter as ctk
+
+        def build():
+            img = self.image(name, size)
+            if img is None:
+                return None
+            scale = size / max(img.size)
+            return ctk.CTkImage(light_image=img, dark_image=img, size=(round(img.width * scale), round(img.height * scale)))
+
+        return self._cached(('ctk', name, size), build)
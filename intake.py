@@ -0,0 +1,211 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from pyzbar.pyzbar import decode
+
+from store import Database, DB_PATH, StoreError
+
+# Headless stock intake: decode barcodes from shelf photos and recorded video
+# in a process pool, match them to products.barcode and apply the resulting
+# quantity changes in one transaction.
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.m4v'}
+VIDEO_CHUNK = 300
+
+
+def decode_image(path):
+    # Every barcode in a photo counts as one item
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return path, [], "could not read image"
+    return path, [barcode.data.decode("utf-8") for barcode in decode(image)], None
+
+
+def decode_video_range(job):
+    # stop is None to read to the end of the video
+    path, start, stop, step = job
+    cap = cv2.VideoCapture(path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frames = []
+    index = start
+    try:
+        while stop is None or index < stop:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if (index - start) % step == 0:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                frames.append((index, {barcode.data.decode("utf-8") for barcode in decode(gray)}))
+            index += 1
+    finally:
+        cap.release()
+    return path, frames
+
+
+def video_jobs(path, step):
+    # None when the video can't be opened. Some containers and streams
+    # don't report a frame count; those are read start to end in one job.
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if total <= 0:
+        return [(path, 0, None, step)]
+    return [(path, start, min(start + VIDEO_CHUNK, total), step) for start in range(0, total, VIDEO_CHUNK)]
+
+
+def count_video(frames, step, gap):
+    # A code counts once per continuous appearance; it counts again only
+    # after being absent for more than gap sampled frames.
+    counts = Counter()
+    last_seen = {}
+    for index, codes in sorted(frames):
+        for code in codes:
+            if code not in last_seen or index - last_seen[code] > gap * step:
+                counts[code] += 1
+            last_seen[code] = index
+    return counts
+
+
+def collect(paths):
+    images, videos = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(root, name) for root, dirs, names in os.walk(path) for name in sorted(names)]
+        else:
+            files = [path]
+        for file in files:
+            extension = os.path.splitext(file)[1].lower()
+            if extension in IMAGE_EXTENSIONS:
+                images.append(file)
+            elif extension in VIDEO_EXTENSIONS:
+                videos.append(file)
+    return images, videos
+
+
+def scan(paths, workers=None, step=5, gap=10):
+    images, videos = collect(paths)
+    workers = workers or os.cpu_count() or 1
+    counts = Counter()
+    errors = []
+    frames_by_video = {video: [] for video in videos}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, codes, error in pool.map(decode_image, images, chunksize=max(1, len(images) // (workers * 4))):
+            if error:
+                errors.append((path, error))
+            counts.update(codes)
+        jobs = []
+        for video in videos:
+            chunks = video_jobs(video, step)
+            if chunks is None:
+                errors.append((video, "could not open video"))
+                del frames_by_video[video]
+            else:
+                jobs.extend(chunks)
+        for path, frames in pool.map(decode_video_range, jobs):
+            frames_by_video[path].extend(frames)
+    for video, frames in frames_by_video.items():
+        if not frames:
+            errors.append((video, "no frames could be read"))
+        counts.update(count_video(frames, step, gap))
+    elapsed = time.perf_counter() - start
+    sampled = len(images) + sum(len(frames) for frames in frames_by_video.values())
+    stats = {
+        'images': len(images),
+        'videos': len(videos),
+        'sampled_frames': sampled - len(images),
+        'seconds': elapsed,
+        'per_second': sampled / elapsed if elapsed else 0,
+        'per_core': sampled / elapsed / workers if elapsed else 0,
+        'workers': workers,
+    }
+    return counts, errors, stats
+
+
+def stock_delta(db, counts, mode):
+    # mode 'receive' adds what was scanned; 'count' makes scanned products
+    # match the count (products that were not scanned are left alone). The
+    # delta is a preview; apply_delta works from the stock at the time.
+    rows, unknown = [], []
+    for barcode, counted in sorted(counts.items()):
+        product = db.catalog.by_barcode(barcode)
+        if product is None:
+            unknown.append((barcode, counted))
+            continue
+        delta = counted if mode == 'receive' else counted - product.quantity
+        rows.append((barcode, product.id, product.name, product.quantity, counted, delta))
+    return rows, unknown
+
+
+def apply_delta(db, rows, mode):
+    # In one transaction against the current stock, so sales made since the
+    # preview aren't overwritten; returns (id, quantity, version) rows
+    if mode == 'receive':
+        updates = [(product_id, counted, None, None) for barcode, product_id, name, quantity, counted, delta in rows]
+    else:
+        updates = [(product_id, None, counted, None) for barcode, product_id, name, quantity, counted, delta in rows]
+    return db.products.apply_inventory(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count stock from barcode photos and videos")
+    parser.add_argument('paths', nargs='+', help="image/video files or folders")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--mode', choices=['count', 'receive'], default='receive',
+                        help="receive: add scanned items to stock; count: set scanned products to the counted quantity")
+    parser.add_argument('--workers', type=int, help="decoder processes (default: CPU count)")
+    parser.add_argument('--frame-step', type=int, default=5, help="decode every Nth video frame")
+    parser.add_argument('--gap', type=int, default=10, help="sampled frames a code must be absent before it counts again")
+    parser.add_argument('--csv', help="write the stock delta to this file")
+    parser.add_argument('--apply', action='store_true', help="apply the delta in one transaction")
+    parser.add_argument('--user', default='intake', help="user name for the audit log")
+    args = parser.parse_args()
+
+    counts, errors, stats = scan(args.paths, args.workers, args.frame_step, args.gap)
+    print(f"{stats['images']} images, {stats['videos']} videos ({stats['sampled_frames']} frames sampled) "
+          f"in {stats['seconds']:.2f}s: {stats['per_second']:.1f}/s, {stats['per_core']:.1f}/s per core ({stats['workers']} workers)")
+    for path, error in errors:
+        print(f"Skipped {path}: {error}")
+
+    db = Database(args.db)
+    try:
+        rows, unknown = stock_delta(db, counts, args.mode)
+        print(f"{'barcode':<20} {'product':<30} {'stock':>7} {'counted':>8} {'delta':>7}")
+        for barcode, product_id, name, quantity, counted, delta in rows:
+            print(f"{barcode:<20} {name[:30]:<30} {quantity:>7} {counted:>8} {delta:>+7}")
+        for barcode, counted in unknown:
+            print(f"Unknown barcode {barcode} (seen {counted} times)")
+        if args.csv:
+            with open(args.csv, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['barcode', 'product_id', 'name', 'stock', 'counted', 'delta'])
+                writer.writerows(rows)
+        if args.apply:
+            try:
+                applied = apply_delta(db, rows, args.mode)
+            except StoreError as e:
+                print(f"Error: {e}")
+                return 1
+            previewed = {product_id: quantity + delta for barcode, product_id, name, quantity, counted, delta in rows}
+            for product_id, quantity, version in applied:
+                if quantity != previewed[product_id]:
+                    print(f"Product {product_id} changed during the scan; stock is now {quantity}")
+            db.audit.log(args.user, "Stock Intake", f"{args.mode}: set stock for {len(applied)} products from {stats['images']} images and {stats['videos']} videos")
+            db.audit.flush()
+            print(f"Applied stock for {len(applied)} products")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
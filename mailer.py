@@ -0,0 +1,131 @@
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+
+# Background delivery for the email_outbox table. One thread drains due
+# messages over a single SMTP connection; failures are rescheduled by the
+# outbox with exponential backoff, so nothing here blocks the sale path.
+POLL_INTERVAL = 60
+SMTP_TIMEOUT = 15
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+class Mailer:
+    def __init__(self, db):
+        self.db = db
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='mailer', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Mailer error: {e}")
+                self._wake.wait(self._sleep_time())
+                self._wake.clear()
+        finally:
+            self.db.pool.release()
+
+    def _sleep_time(self):
+        next_due = self.db.outbox.next_due()
+        if next_due is None or self.config() is None:
+            return POLL_INTERVAL
+        return min(max(next_due - time.time(), 0.5), POLL_INTERVAL)
+
+    def config(self):
+        settings = self.db.settings
+        config = {
+            'server': settings.get('email_server'),
+            'port': settings.get_int('email_port', 587),
+            'username': settings.get('email_username'),
+            'password': settings.get('email_password'),
+            'alert_email': settings.get('alert_email'),
+        }
+        if not all(config.values()):
+            return None
+        return config
+
+    def batches(self, rows):
+        # Every due low-stock row goes out as one combined alert
+        low_stock = [row for row in rows if row[1] == 'low_stock']
+        batches = [([row[0]], row[2], row[3]) for row in rows if row[1] != 'low_stock']
+        if low_stock:
+            body = "The following products are low on stock:\n" + "\n".join(row[3] for row in low_stock) + "\n"
+            batches.insert(0, ([row[0] for row in low_stock], "Low Stock Alert", body))
+        return batches
+
+    def connect(self, config):
+        s = smtplib.SMTP(config['server'], config['port'], timeout=SMTP_TIMEOUT)
+        s.ehlo()
+        if s.has_extn('starttls'):
+            s.starttls()
+            s.ehlo()
+        elif config['server'] not in LOCAL_HOSTS:
+            s.close()
+            raise smtplib.SMTPNotSupportedError("Server does not support STARTTLS")
+        if s.has_extn('auth'):
+            s.login(config['username'], config['password'])
+        return s
+
+    def flush(self):
+        rows = self.db.outbox.due()
+        if not rows:
+            return 0
+        config = self.config()
+        if config is None:
+            print("Email settings are not configured")
+            return 0
+        batches = self.batches(rows)
+        try:
+            s = self.connect(config)
+        except (smtplib.SMTPException, OSError) as e:
+            print(f"Failed to connect to mail server: {e}")
+            self.db.outbox.retry_later([row[0] for row in rows], str(e))
+            return 0
+
+        sent = 0
+        try:
+            for index, (ids, subject, body) in enumerate(batches):
+                msg = MIMEText(body)
+                msg['Subject'] = subject
+                msg['From'] = config['username']
+                msg['To'] = config['alert_email']
+                try:
+                    s.sendmail(config['username'], [config['alert_email']], msg.as_string())
+                except smtplib.SMTPServerDisconnected as e:
+                    # Connection is gone; back off everything not yet sent
+                    print(f"Mail server disconnected: {e}")
+                    remaining = [message_id for batch in batches[index:] for message_id in batch[0]]
+                    self.db.outbox.retry_later(remaining, str(e))
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    print(f"Failed to send email: {e}")
+                    self.db.outbox.retry_later(ids, str(e))
+                    continue
+                self.db.outbox.mark_sent(ids)
+                sent += 1
+        finally:
+            try:
+                s.quit()
+            except (smtplib.SMTPException, OSError):
+                s.close()
+        return sent
@@ -1,180 +1,205 @@
+import time
+_started = time.perf_counter()
+
 import customtkinter as ctk
 from tkinter import ttk, messagebox, Menu, filedialog, simpledialog
 import sqlite3
 import hashlib
 import datetime
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from PIL import Image
-from fpdf import FPDF
 import os
+import queue
 import subprocess
-import cv2
-from pyzbar.pyzbar import decode
-import socketio
-import stripe
-import smtplib
-from email.mime.text import MIMEText
+import threading
+from store import Database, DB_PATH, StoreError, InsufficientStock
+from mailer import Mailer
+from archive import AuditArchive
+from imagestore import ImageStore
+
+# Camera (cv2/pyzbar), charts (matplotlib), PDF (fpdf), payments (stripe) and
+# the realtime hub (socket.io) are imported where they are first used, not
+# here, to keep startup fast.
+
+
+# Startup timing, printed with --startup-report
+class StartupTimer:
+    enabled = False
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.marks = []
+        self.done = False
+
+    def mark(self, label):
+        self.marks.append((label, time.perf_counter()))
+
+    def report(self, title):
+        self.done = True
+        if not self.enabled:
+            return
+        print(f"Startup timing ({title}):")
+        previous = self.started
+        for label, when in self.marks:
+            print(f"  {label:<24} {(when - previous) * 1000:8.1f} ms")
+            previous = when
+        print(f"  {'total':<24} {(previous - self.started) * 1000:8.1f} ms")
+
+
+startup = StartupTimer(_started)
+startup.mark("imports")
 
 # Configuration
 ctk.set_default_color_theme("blue")
-stripe.api_key = "your_stripe_api_key_here"  # Replace with your Stripe API key
+STRIPE_API_KEY = "your_stripe_api_key_here"  # Replace with your Stripe API key
+
+
+def load_stripe():
+    import stripe
+    stripe.api_key = STRIPE_API_KEY
+    return stripe
+
 
 # Database Setup
-conn = sqlite3.connect('shop.db')
-cursor = conn.cursor()
-
-# Create tables
-tables = [
-    '''CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        category TEXT NOT NULL,
-        quantity INTEGER NOT NULL CHECK(quantity >= 0),
-        price REAL NOT NULL CHECK(price >= 0),
-        supplier_id INTEGER,
-        min_stock INTEGER NOT NULL DEFAULT 5 CHECK(min_stock >= 0),
-        image_path TEXT,
-        barcode TEXT,
-        discount REAL DEFAULT 0 CHECK(discount >= 0 AND discount <= 100),
-        FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
-    )''',
-    '''CREATE TABLE IF NOT EXISTS customers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        phone TEXT,
-        email TEXT,
-        loyalty_points INTEGER DEFAULT 0 CHECK(loyalty_points >= 0),
-        notes TEXT
-    )''',
-    '''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        full_name TEXT,
-        email TEXT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        role TEXT NOT NULL CHECK(role IN ('staff', 'admin')) DEFAULT 'staff'
-    )''',
-    '''CREATE TABLE IF NOT EXISTS sales (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER NOT NULL,
-        date TEXT NOT NULL,
-        total REAL NOT NULL CHECK(total >= 0),
-        discount REAL DEFAULT 0 CHECK(discount >= 0 AND discount <= 100),
-        payment_method TEXT,
-        FOREIGN KEY (customer_id) REFERENCES customers(id)
-    )''',
-    '''CREATE TABLE IF NOT EXISTS sale_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sale_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        quantity INTEGER NOT NULL CHECK(quantity > 0),
-        price REAL NOT NULL CHECK(price >= 0),
-        FOREIGN KEY (sale_id) REFERENCES sales(id),
-        FOREIGN KEY (product_id) REFERENCES products(id)
-    )''',
-    '''CREATE TABLE IF NOT EXISTS suppliers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        contact TEXT,
-        email TEXT,
-        products TEXT
-    )''',
-    '''CREATE TABLE IF NOT EXISTS expenses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        date TEXT NOT NULL,
-        category TEXT NOT NULL,
-        amount REAL NOT NULL CHECK(amount >= 0),
-        description TEXT
-    )''',
-    '''CREATE TABLE IF NOT EXISTS purchase_orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        supplier_id INTEGER NOT NULL,
-        date TEXT NOT NULL,
-        status TEXT NOT NULL CHECK(status IN ('Pending', 'Completed', 'Cancelled')),
-        FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
-    )''',
-    '''CREATE TABLE IF NOT EXISTS purchase_order_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        po_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        quantity INTEGER NOT NULL CHECK(quantity > 0),
-        FOREIGN KEY (po_id) REFERENCES purchase_orders(id),
-        FOREIGN KEY (product_id) REFERENCES products(id)
-    )''',
-    '''CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )''',
-    '''CREATE TABLE IF NOT EXISTS audit_logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT NOT NULL,
-        user TEXT NOT NULL,
-        action TEXT NOT NULL,
-        details TEXT
-    )'''
-]
-
-for table in tables:
-    cursor.execute(table)
-
-# Add new columns if they don't exist
-cursor.execute("PRAGMA table_info(products)")
-columns = [row[1] for row in cursor.fetchall()]
-if 'image_path' not in columns:
-    cursor.execute("ALTER TABLE products ADD COLUMN image_path TEXT")
-if 'barcode' not in columns:
-    cursor.execute("ALTER TABLE products ADD COLUMN barcode TEXT")
-if 'discount' not in columns:
-    cursor.execute("ALTER TABLE products ADD COLUMN discount REAL DEFAULT 0 CHECK(discount >= 0 AND discount <= 100)")
-
-cursor.execute("PRAGMA table_info(customers)")
-columns = [row[1] for row in cursor.fetchall()]
-if 'notes' not in columns:
-    cursor.execute("ALTER TABLE customers ADD COLUMN notes TEXT")
-
-cursor.execute("PRAGMA table_info(users)")
-columns = [row[1] for row in cursor.fetchall()]
-if 'full_name' not in columns:
-    cursor.execute("ALTER TABLE users ADD COLUMN full_name TEXT")
-if 'email' not in columns:
-    cursor.execute("ALTER TABLE users ADD COLUMN email TEXT")
-
-cursor.execute("PRAGMA table_info(sales)")
-columns = [row[1] for row in cursor.fetchall()]
-if 'payment_method' not in columns:
-    cursor.execute("ALTER TABLE sales ADD COLUMN payment_method TEXT")
-
-conn.commit()
-
-# Real-Time WebSocket Setup
-sio = socketio.Server()
-
-@sio.event
-def connect(sid, environ):
-    print('Client connected:', sid)
-
-@sio.event
-def disconnect(sid):
-    print('Client disconnected:', sid)
-
-@sio.event
-def update_inventory(sid, data):
-    cursor.execute("UPDATE products SET quantity=? WHERE id=?", (data['quantity'], data['id']))
-    conn.commit()
-    sio.emit('inventory_updated', data)
-
-@sio.event
-def sale_made(sid, data):
-    sio.emit('new_sale', data)
-
-@sio.event
-def new_purchase_order(sid, data):
-    sio.emit('new_purchase_order', data)
-
-@sio.event
-def purchase_order_updated(sid, data):
-    sio.emit('purchase_order_updated', data)
+db = Database(DB_PATH)
+mailer = Mailer(db)
+audit_archive = AuditArchive(db)
+image_store = ImageStore()
+# Built in __main__ when the server starts
+realtime = None
+startup.mark("database")
+
+# Change-driven refresh: which sections display each table. Sections listed in
+# ROW_SECTIONS can repaint individual rows; the rest reload when shown.
+REFRESH_INTERVAL = 1000
+SEARCH_DELAY = 250
+TABLE_SECTIONS = {
+    'products': ('dashboard', 'products'),
+    'customers': ('dashboard', 'customers'),
+    'sales': ('dashboard', 'history', 'reports'),
+    'expenses': ('dashboard', 'expenses', 'reports'),
+    'suppliers': ('products', 'suppliers'),
+    'purchase_orders': ('purchase_orders',),
+    'users': ('users',),
+    'audit_logs': ('audit',),
+}
+ROW_SECTIONS = {'products': 'products', 'customers': 'customers', 'history': 'sales'}
+
+
+class PagedTree:
+    # Virtual list over a Treeview: pages are keyset-fetched from the store as
+    # the user scrolls, sorting is done in SQL, and refreshes only touch rows
+    # whose values changed. fetch(after, sort, descending, limit, term) returns
+    # (rows, next_after); fetch_ids(ids) returns the current rows for ids.
+    PAGE_SIZE = 200
+
+    def __init__(self, tree, fetch, fetch_ids, sort_keys, sort='id', descending=False, formatter=tuple, scrollbar=None):
+        self.tree = tree
+        self.fetch = fetch
+        self.fetch_ids = fetch_ids
+        self.sort = sort
+        self.descending = descending
+        self.formatter = formatter
+        self.scrollbar = scrollbar
+        self.term = ''
+        self.rows = {}
+        self.after = None
+        self.exhausted = False
+        self.pending = False
+        tree.configure(yscrollcommand=self.on_scroll)
+        for heading, key in sort_keys.items():
+            tree.heading(heading, command=lambda key=key: self.sort_by(key))
+
+    def on_scroll(self, first, last):
+        if self.scrollbar:
+            self.scrollbar.set(first, last)
+        if float(last) > 0.9 and not self.exhausted and not self.pending:
+            self.pending = True
+            self.tree.after_idle(self.load_more)
+
+    def load_more(self):
+        self.pending = False
+        if self.exhausted:
+            return
+        rows, self.after = self.fetch(self.after, self.sort, self.descending, self.PAGE_SIZE, self.term)
+        self.exhausted = self.after is None
+        for row in rows:
+            iid = str(row[0])
+            if iid not in self.rows:
+                self.rows[iid] = self.formatter(row)
+                self.tree.insert("", "end", iid=iid, values=self.rows[iid])
+
+    def reset(self):
+        self.tree.delete(*self.tree.get_children())
+        self.rows = {}
+        self.after = None
+        self.exhausted = False
+        self.load_more()
+
+    def search(self, term):
+        term = term.strip()
+        if term == self.term:
+            return
+        self.term = term
+        self.reset()
+
+    def sort_by(self, key):
+        if key == self.sort:
+            self.descending = not self.descending
+        else:
+            self.sort, self.descending = key, False
+        self.reset()
+
+    def refresh(self):
+        # Re-read the rows already loaded so the scroll position survives
+        limit = max(len(self.rows), self.PAGE_SIZE)
+        rows, self.after = self.fetch(None, self.sort, self.descending, limit, self.term)
+        self.exhausted = self.after is None
+        new = {str(row[0]): self.formatter(row) for row in rows}
+        for iid in self.rows.keys() - new.keys():
+            self.tree.delete(iid)
+        for index, (iid, values) in enumerate(new.items()):
+            if iid not in self.rows:
+                self.tree.insert("", index, iid=iid, values=values)
+            elif self.rows[iid] != values:
+                self.tree.item(iid, values=values)
+        self.rows = new
+
+    def update(self, ids):
+        if self.term:
+            # Can't tell whether changed rows still match the search
+            self.refresh()
+            return
+        found = set()
+        added = []
+        for row in self.fetch_ids(ids):
+            iid = str(row[0])
+            values = self.formatter(row)
+            found.add(iid)
+            if iid not in self.rows:
+                added.append((row[0], iid, values))
+            elif self.rows[iid] != values:
+                self.tree.item(iid, values=values)
+                self.rows[iid] = values
+        for iid in {str(i) for i in ids} - found:
+            if iid in self.rows:
+                self.tree.delete(iid)
+                del self.rows[iid]
+        if not added:
+            return
+        if self.sort != 'id':
+            self.refresh()
+            return
+        # New rows have the highest ids: they go on top of a descending list
+        # and, in ascending order, are reached by paging unless fully loaded
+        for _, iid, values in sorted(added):
+            if self.descending:
+                self.tree.insert("", 0, iid=iid, values=values)
+            elif self.exhausted:
+                self.tree.insert("", "end", iid=iid, values=values)
+            else:
+                continue
+            self.rows[iid] = values
+
 
 # Login Window
 class LoginWindow:
@@ -186,14 +211,19 @@ class LoginWindow:
 
         ctk.CTkLabel(self.window, text="My Shop", font=("Arial", 30, "bold")).pack(pady=20)
 
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] == 0:
+        if db.users.count() == 0:
             self.show_first_run()
         else:
             self.show_login()
 
+        if not startup.done:
+            self.window.after_idle(self.first_draw)
         self.window.mainloop()
 
+    def first_draw(self):
+        startup.mark("login window")
+        startup.report("cold start")
+
     def show_first_run(self):
         self.window.minsize(400, 400)
         self.window.resizable(True, True)
@@ -255,8 +285,7 @@ class LoginWindow:
 
         hashed = hashlib.sha256(password.encode()).hexdigest()
         try:
-            cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, hashed, 'admin'))
-            conn.commit()
+            db.users.add(username, hashed, 'admin')
             messagebox.showinfo("Success", "Admin account created")
             self.window.destroy()
             MainApp('admin', username)
@@ -272,8 +301,7 @@ class LoginWindow:
             return
 
         hashed = hashlib.sha256(password.encode()).hexdigest()
-        cursor.execute("SELECT * FROM users WHERE username=? AND password=?", (username, hashed))
-        user = cursor.fetchone()
+        user = db.users.authenticate(username, hashed)
 
         if user:
             self.window.destroy()
@@ -290,7 +318,11 @@ class MainApp:
         self.role = role
         self.username = username
         self.product_image_filename = None
-        self.sio = sio
+        self.pending_jobs = {}
+        self.timer = StartupTimer()
+        self.realtime = realtime
+        self.db = db
+        self._receipts = None
 
         # Load appearance mode
         appearance_mode = self.get_setting('appearance_mode', 'System')
@@ -330,6 +362,7 @@ class MainApp:
                 ("purchase_orders", "Purchase Orders", self.show_purchase_orders),
                 ("reports", "Reports", self.show_reports),
                 ("users", "User Management", self.show_users),
+                ("audit", "Audit Log", self.show_audit),
                 ("settings", "Settings", self.show_settings)
             ]
 
@@ -344,26 +377,32 @@ class MainApp:
             button.pack(fill="x", padx=10, pady=5)
             self.nav_buttons[key] = button
 
-        # Content frames
+        # Content frames; each section's widgets are built on its first visit
         self.content_frames = {}
         for section in [s[0] for s in sections]:
             self.content_frames[section] = ctk.CTkScrollableFrame(self.window)
-
-        # Create sections
-        self.create_dashboard()
-        self.create_products()
-        self.create_customers()
-        self.create_sales()
-        self.create_history()
-        if role == 'admin':
-            self.create_suppliers()
-            self.create_expenses()
-            self.create_purchase_orders()
-            self.create_reports()
-            self.create_users()
-            self.create_settings()
+        self.section_builders = {
+            'dashboard': self.create_dashboard,
+            'products': self.create_products,
+            'customers': self.create_customers,
+            'sales': self.create_sales,
+            'history': self.create_history,
+            'suppliers': self.create_suppliers,
+            'expenses': self.create_expenses,
+            'purchase_orders': self.create_purchase_orders,
+            'reports': self.create_reports,
+            'users': self.create_users,
+            'audit': self.create_audit,
+            'settings': self.create_settings,
+        }
+        self.built_sections = set()
+        self.dirty_sections = {}
+        self.timer.mark("window and sidebar")
 
         # Show dashboard by default
+        self.build_section('dashboard')
+        self.timer.mark("dashboard")
+        self.current_section = 'dashboard'
         self.current_frame = self.content_frames['dashboard']
         self.current_frame.pack(side="right", fill="both", expand=True)
         self.nav_buttons['dashboard'].configure(fg_color="#4682B4")
@@ -382,13 +421,19 @@ class MainApp:
         self.window.bind("<Control-4>", lambda event: self.show_sales())
         self.window.bind("<Control-5>", lambda event: self.show_history())
 
-        # Auto-refresh (increased interval to 5 seconds for performance)
-        self.window.after(5000, self.refresh_realtime)
+        # Auto-refresh: repaint only what changed since the last tick
+        self.db.external_change()
+        self.window.after(REFRESH_INTERVAL, self.refresh_realtime)
         self.update_time()
 
         self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.window.after_idle(self.first_draw)
         self.window.mainloop()
 
+    def first_draw(self):
+        self.timer.mark("first draw")
+        self.timer.report("main window")
+
     # Utility Methods
     def update_time(self):
         self.date_label.configure(text=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
@@ -398,17 +443,36 @@ class MainApp:
         for button in self.nav_buttons.values():
             button.configure(fg_color="transparent")
 
+    @property
+    def receipts(self):
+        if self._receipts is None:
+            from receipts import ReceiptRenderer
+            self._receipts = ReceiptRenderer(self.db)
+        return self._receipts
+
+    def build_section(self, section):
+        if section in self.built_sections:
+            return
+        self.built_sections.add(section)
+        self.section_builders[section]()
+        # Freshly loaded, so earlier changes are already on screen
+        self.dirty_sections.pop(section, None)
+
     def show_section(self, section):
+        self.build_section(section)
         self.reset_nav_buttons()
         self.nav_buttons[section].configure(fg_color="#4682B4")
         self.current_frame.pack_forget()
+        self.current_section = section
         self.current_frame = self.content_frames[section]
         self.current_frame.pack(side="right", fill="both", expand=True)
+        self.refresh_changes()
 
     def show_dashboard(self): self.show_section('dashboard')
     def show_products(self): self.show_section('products')
     def show_customers(self): self.show_section('customers')
     def show_sales(self):
+        self.build_section('sales')
         self.load_customers_combobox()
         self.load_products_combobox()
         self.show_section('sales')
@@ -418,6 +482,7 @@ class MainApp:
     def show_purchase_orders(self): self.show_section('purchase_orders')
     def show_reports(self): self.show_section('reports')
     def show_users(self): self.show_section('users')
+    def show_audit(self): self.show_section('audit')
     def show_settings(self): self.show_section('settings')
 
     def logout(self):
@@ -426,66 +491,77 @@ class MainApp:
             LoginWindow()
 
     def on_closing(self):
+        # The background threads still use the database; __main__ stops them
+        # and then closes it
         if messagebox.askyesno("Exit", "Are you sure you want to exit?"):
-            conn.close()
             self.window.destroy()
 
     def refresh_realtime(self):
-        self.update_dashboard()
-        self.load_products()
-        self.load_sales_history()
-        self.load_purchase_orders()
-        self.window.after(5000, self.refresh_realtime)
+        # Audit entries logged since the last tick, on this thread's connection
+        try:
+            self.db.audit.flush()
+        except sqlite3.Error as e:
+            print(f"Audit log flush failed: {e}")
+        if self.db.external_change():
+            # Another terminal or process wrote; row ids are unknown
+            for table in TABLE_SECTIONS:
+                self.mark_dirty(table, None)
+        self.refresh_changes()
+        self.window.after(REFRESH_INTERVAL, self.refresh_realtime)
+
+    def debounce(self, name, callback, delay=SEARCH_DELAY):
+        # Run callback once input has been idle for delay ms
+        job = self.pending_jobs.pop(name, None)
+        if job:
+            self.window.after_cancel(job)
+        self.pending_jobs[name] = self.window.after(delay, callback)
+
+    def mark_dirty(self, table, ids):
+        for section in TABLE_SECTIONS.get(table, ()):
+            if section not in self.content_frames:
+                continue
+            if ids is None or ROW_SECTIONS.get(section) != table:
+                self.dirty_sections[section] = None
+            elif section not in self.dirty_sections:
+                self.dirty_sections[section] = set(ids)
+            elif self.dirty_sections[section] is not None:
+                self.dirty_sections[section].update(ids)
+
+    def refresh_changes(self):
+        for table, ids in self.db.changes.drain().items():
+            self.mark_dirty(table, ids)
+        # Hidden sections stay dirty until they are shown
+        section = self.current_section
+        if section not in self.dirty_sections:
+            return
+        ids = self.dirty_sections.pop(section)
+        refreshers = {
+            'dashboard': self.update_dashboard,
+            'products': lambda: self.load_products(ids),
+            'customers': lambda: self.load_customers(ids),
+            'history': lambda: self.load_sales_history(ids),
+            'suppliers': self.load_suppliers,
+            'expenses': self.load_expenses,
+            'purchase_orders': self.load_purchase_orders,
+            'users': self.load_users,
+            'reports': self.refresh_report,
+            'audit': lambda: self.audit_pages.refresh(),
+        }
+        refreshers[section]()
 
     def get_setting(self, key, default=''):
-        cursor.execute("SELECT value FROM settings WHERE key=?", (key,))
-        result = cursor.fetchone()
-        return result[0] if result else default
+        return self.db.settings.get(key, default)
 
     def set_setting(self, key, value):
-        cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
-        conn.commit()
-
-    def get_logo_position(self):
-        horizontal = self.get_setting('logo_horizontal', 'Left')
-        vertical = self.get_setting('logo_vertical', 'Top')
-        page_width = 210  # A4 width in mm
-        logo_width = 30
-        logo_height = 30
-        x = {'Left': 10, 'Center': (page_width - logo_width) / 2, 'Right': page_width - logo_width - 10}.get(horizontal, 10)
-        y = {'Top': 10, 'Middle': (297 - logo_height) / 2, 'Bottom': 297 - logo_height - 10}.get(vertical, 10)
-        return x, y
+        self.db.settings.set(key, value)
 
     def send_email(self, subject, body):
-        server = self.get_setting('email_server')
-        port = int(self.get_setting('email_port', '587'))
-        username = self.get_setting('email_username')
-        password = self.get_setting('email_password')
-        alert_email = self.get_setting('alert_email')
-
-        if not all([server, port, username, password, alert_email]):
-            print("Email settings are not configured")
-            return
-
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = username
-        msg['To'] = alert_email
-
-        try:
-            with smtplib.SMTP(server, port) as s:
-                s.starttls()
-                s.login(username, password)
-                s.sendmail(username, [alert_email], msg.as_string())
-            print("Email sent successfully")
-        except Exception as e:
-            print(f"Failed to send email: {e}")
+        # Queued; mailer delivers it in the background
+        self.db.outbox.enqueue(subject, body)
+        mailer.wake()
 
     def log_action(self, action, details):
-        timestamp = datetime.datetime.now().isoformat()
-        user = self.username
-        cursor.execute("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?, ?, ?, ?)", (timestamp, user, action, details))
-        conn.commit()
+        self.db.audit.log(self.username, action, details)
 
     # Dashboard Section
     def create_dashboard(self):
@@ -519,44 +595,26 @@ class MainApp:
         self.update_dashboard()
 
     def update_dashboard(self):
-        cursor.execute("SELECT COUNT(*) FROM products")
-        products = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM customers")
-        customers = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*), SUM(total) FROM sales")
-        sales, revenue = cursor.fetchone()
-        revenue = revenue or 0
-        cursor.execute("SELECT SUM(amount) FROM expenses")
-        expenses = cursor.fetchone()[0] or 0
-
-        self.stats_labels['products'].configure(text=f"Products: {products}")
-        self.stats_labels['customers'].configure(text=f"Customers: {customers}")
-        self.stats_labels['sales'].configure(text=f"Sales: {sales}")
-        self.stats_labels['revenue'].configure(text=f"Revenue: ${revenue:.2f}")
-        self.stats_labels['expenses'].configure(text=f"Expenses: ${expenses:.2f}")
-
-        cursor.execute("SELECT p.name, SUM(si.quantity) as total_sold FROM sale_items si JOIN products p ON si.product_id = p.id GROUP BY p.id ORDER BY total_sold DESC LIMIT 1")
-        best_seller = cursor.fetchone()
-        if best_seller:
-            self.stats_labels['best_seller'].configure(text=f"Best Seller: {best_seller[0]} ({best_seller[1]} sold)")
+        stats = self.db.reports.dashboard_stats()
 
-        today = datetime.date.today()
-        first_day_this_month = today.replace(day=1)
-        last_month = first_day_this_month - datetime.timedelta(days=1)
-        first_day_last_month = last_month.replace(day=1)
+        self.stats_labels['products'].configure(text=f"Products: {stats['products']}")
+        self.stats_labels['customers'].configure(text=f"Customers: {stats['customers']}")
+        self.stats_labels['sales'].configure(text=f"Sales: {stats['sales']}")
+        self.stats_labels['revenue'].configure(text=f"Revenue: ${stats['revenue']:.2f}")
+        self.stats_labels['expenses'].configure(text=f"Expenses: ${stats['expenses']:.2f}")
 
-        cursor.execute("SELECT SUM(total) FROM sales WHERE date >= ? AND date < ?", (first_day_this_month.isoformat(), today.isoformat()))
-        sales_this_month = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(total) FROM sales WHERE date >= ? AND date < ?", (first_day_last_month.isoformat(), first_day_this_month.isoformat()))
-        sales_last_month = cursor.fetchone()[0] or 0
+        best_seller = stats['best_seller']
+        if best_seller:
+            self.stats_labels['best_seller'].configure(text=f"Best Seller: {best_seller[0]} ({best_seller[1]} sold)")
 
+        sales_this_month = stats['sales_this_month']
+        sales_last_month = stats['sales_last_month']
         trend = "N/A" if sales_last_month == 0 else f"{(sales_this_month - sales_last_month) / sales_last_month * 100:.2f}%"
         self.stats_labels['sales_trend'].configure(text=f"Sales Trend: {trend}")
 
         for item in self.alert_tree.get_children():
             self.alert_tree.delete(item)
-        cursor.execute("SELECT name, quantity FROM products WHERE quantity < min_stock")
-        low_stock = cursor.fetchall()
+        low_stock = stats['low_stock']
         if low_stock:
             for name, qty in low_stock:
                 self.alert_tree.insert("", "end", values=(name, qty))
@@ -613,54 +671,48 @@ class MainApp:
         self.add_update_product_button.pack(side="left", padx=5)
         ctk.CTkButton(button_frame, text="Delete Product", command=self.delete_product, fg_color="#d9534f", hover_color="#c9302c", height=40, font=("Arial", 14)).pack(side="left", padx=5)
 
-        self.product_tree = ttk.Treeview(frame, columns=("ID", "Name", "Category", "Qty", "Price", "Min Stock", "Supplier", "Barcode", "Image", "Discount"), show="headings")
+        tree_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        tree_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        self.product_tree = ttk.Treeview(tree_frame, columns=("ID", "Name", "Category", "Qty", "Price", "Min Stock", "Supplier", "Barcode", "Image", "Discount"), show="headings")
         for col in self.product_tree["columns"]:
             self.product_tree.heading(col, text=col)
             self.product_tree.column(col, width=100)
-        self.product_tree.pack(fill="both", expand=True, padx=20, pady=10)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.product_tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.product_tree.pack(side="left", fill="both", expand=True)
         self.product_tree.bind("<Double-1>", self.select_product)
+        sort_keys = {"ID": 'id', "Name": 'name', "Category": 'category', "Qty": 'quantity', "Price": 'price', "Min Stock": 'min_stock',
+                     "Supplier": 'supplier', "Barcode": 'barcode', "Image": 'image', "Discount": 'discount'}
+        self.product_pages = PagedTree(self.product_tree, self.db.products.page, self.db.products.rows, sort_keys, scrollbar=scrollbar)
 
         self.product_image_display = ctk.CTkLabel(frame, text="")
         self.product_image_display.pack(pady=10)
 
-        self.load_products()
+        self.product_pages.reset()
         self.selected_product_id = None
 
     def upload_product_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.jpeg *.png *.gif")])
         if file_path:
             try:
-                img = Image.open(file_path)
-                filename = os.path.basename(file_path)
-                dest_path = os.path.join("images", filename)
-                if not os.path.exists("images"):
-                    os.makedirs("images")
-                img.save(dest_path)
-                self.product_image_filename = filename
-                self.product_image_label.configure(text=filename)
+                self.product_image_filename = image_store.add(file_path)
+                self.product_image_label.configure(text=os.path.basename(file_path))
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to upload image: {e}")
 
     def load_suppliers_combobox(self, combobox):
-        cursor.execute("SELECT name FROM suppliers")
-        suppliers = ["None"] + [row[0] for row in cursor.fetchall()]
+        suppliers = ["None"] + self.db.suppliers.names()
         combobox.configure(values=suppliers)
         combobox.set("None")
 
-    def load_products(self):
-        for item in self.product_tree.get_children():
-            self.product_tree.delete(item)
-        cursor.execute("SELECT p.id, p.name, p.category, p.quantity, p.price, p.min_stock, s.name, p.barcode, p.image_path, p.discount FROM products p LEFT JOIN suppliers s ON p.supplier_id = s.id")
-        for row in cursor.fetchall():
-            self.product_tree.insert("", "end", values=row)
+    def load_products(self, ids=None):
+        if ids:
+            self.product_pages.update(ids)
+        else:
+            self.product_pages.refresh()
 
     def filter_products(self, event):
-        search_term = self.product_search.get().lower()
-        for item in self.product_tree.get_children():
-            self.product_tree.delete(item)
-        cursor.execute("SELECT p.id, p.name, p.category, p.quantity, p.price, p.min_stock, s.name, p.barcode, p.image_path, p.discount FROM products p LEFT JOIN suppliers s ON p.supplier_id = s.id WHERE LOWER(p.name) LIKE ? OR LOWER(p.barcode) LIKE ?", (f"%{search_term}%", f"%{search_term}%"))
-        for row in cursor.fetchall():
-            self.product_tree.insert("", "end", values=row)
+        self.debounce('product_search', lambda: self.product_pages.search(self.product_search.get()))
 
     def select_product(self, event):
         selected = self.product_tree.selection()
@@ -687,16 +739,14 @@ class MainApp:
             self.product_entries['discount'].insert(0, values[9] if len(values) > 9 else "0")
             self.add_update_product_button.configure(text="Update Product")
 
-            if values[8] and os.path.exists(os.path.join("images", values[8])):
-                try:
-                    img = Image.open(os.path.join("images", values[8]))
-                    img = img.resize((200, 200), Image.LANCZOS)
-                    self.product_image = ctk.CTkImage(light_image=img, dark_image=img, size=(200, 200))
-                    self.product_image_display.configure(image=self.product_image)
-                    self.product_image_display.image = self.product_image
-                except Exception as e:
-                    print(f"Error loading image: {e}")
-                    self.product_image_display.configure(image=None, text="Error loading image")
+            try:
+                self.product_image = image_store.ctk_image(values[8]) if values[8] else None
+            except Exception as e:
+                print(f"Error loading image: {e}")
+                self.product_image_display.configure(image=None, text="Error loading image")
+                return
+            if self.product_image:
+                self.product_image_display.configure(image=self.product_image, text="")
             else:
                 self.product_image_display.configure(image=None, text="No image")
 
@@ -706,10 +756,8 @@ class MainApp:
             item = self.product_tree.item(selected[0])
             product_id = item['values'][0]
             if messagebox.askyesno("Confirm", "Are you sure you want to delete this product?"):
-                cursor.execute("DELETE FROM products WHERE id=?", (product_id,))
-                conn.commit()
-                self.load_products()
-                self.update_dashboard()
+                self.db.products.delete(product_id)
+                self.refresh_changes()
                 self.log_action("Delete Product", f"Deleted product ID {product_id}")
                 messagebox.showinfo("Success", "Product deleted")
         else:
@@ -742,30 +790,30 @@ class MainApp:
 
         supplier_id = None
         if supplier_name != "None":
-            cursor.execute("SELECT id FROM suppliers WHERE name=?", (supplier_name,))
-            supplier = cursor.fetchone()
-            if supplier:
-                supplier_id = supplier[0]
-            else:
+            supplier_id = self.db.suppliers.id_for_name(supplier_name)
+            if supplier_id is None:
                 messagebox.showerror("Error", "Supplier not found")
                 return
 
         if self.selected_product_id:
-            cursor.execute("UPDATE products SET name=?, category=?, quantity=?, price=?, min_stock=?, supplier_id=?, barcode=?, image_path=?, discount=? WHERE id=?",
-                           (name, category, quantity, price, min_stock, supplier_id, barcode, self.product_image_filename, discount, self.selected_product_id))
-            conn.commit()
-            self.sio.emit('inventory_updated', {'id': self.selected_product_id, 'quantity': quantity})
-            self.load_products()
-            self.update_dashboard()
+            try:
+                product_id, quantity, version = self.db.products.update(self.selected_product_id, name, category, quantity, price, min_stock, supplier_id,
+                                                                        barcode, self.product_image_filename, discount)
+            except sqlite3.IntegrityError:
+                messagebox.showerror("Error", "Barcode already belongs to another product")
+                return
+            self.realtime.emit('inventory_updated', {'id': product_id, 'quantity': quantity, 'version': version})
+            self.refresh_changes()
             self.log_action("Update Product", f"Updated product ID {self.selected_product_id}")
             messagebox.showinfo("Success", "Product updated")
             self.clear_product_form()
         else:
-            cursor.execute("INSERT INTO products (name, category, quantity, price, min_stock, supplier_id, barcode, image_path, discount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                           (name, category, quantity, price, min_stock, supplier_id, barcode, self.product_image_filename, discount))
-            conn.commit()
-            self.load_products()
-            self.update_dashboard()
+            try:
+                self.db.products.add(name, category, quantity, price, min_stock, supplier_id, barcode, self.product_image_filename, discount)
+            except sqlite3.IntegrityError:
+                messagebox.showerror("Error", "Barcode already belongs to another product")
+                return
+            self.refresh_changes()
             self.log_action("Add Product", f"Added new product: {name}")
             messagebox.showinfo("Success", "Product added")
             self.clear_product_form()
@@ -819,32 +867,40 @@ class MainApp:
         self.add_update_customer_button.pack(side="left", padx=5)
         ctk.CTkButton(button_frame, text="Delete Customer", command=self.delete_customer, fg_color="#d9534f", hover_color="#c9302c", height=40, font=("Arial", 14)).pack(side="left", padx=5)
 
-        self.customer_tree = ttk.Treeview(frame, columns=("ID", "Name", "Phone", "Email", "Points", "Notes"), show="headings")
+        tree_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        tree_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        self.customer_tree = ttk.Treeview(tree_frame, columns=("ID", "Name", "Phone", "Email", "Points", "Notes"), show="headings")
         for col in self.customer_tree["columns"]:
             self.customer_tree.heading(col, text=col)
             self.customer_tree.column(col, width=150)
-        self.customer_tree.pack(fill="both", expand=True, padx=20, pady=10)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.customer_tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.customer_tree.pack(side="left", fill="both", expand=True)
         self.customer_tree.bind("<Double-1>", self.select_customer)
-        self.load_customers()
-
-        ctk.CTkButton(frame, text="Generate Customer Report", command=self.generate_customer_report, height=40, font=("Arial", 14)).pack(pady=10)
+        sort_keys = {"ID": 'id', "Name": 'name', "Phone": 'phone', "Email": 'email', "Points": 'points', "Notes": 'notes'}
+        self.customer_pages = PagedTree(self.customer_tree, self.db.customers.page, self.db.customers.rows, sort_keys, scrollbar=scrollbar)
+        self.customer_pages.reset()
+
+        report_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        report_frame.pack(pady=10)
+        ctk.CTkLabel(report_frame, text="From:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.report_start_date = ctk.CTkEntry(report_frame, placeholder_text="YYYY-MM-DD", width=150, height=40, font=("Arial", 14))
+        self.report_start_date.pack(side="left", padx=5)
+        ctk.CTkLabel(report_frame, text="To:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.report_end_date = ctk.CTkEntry(report_frame, placeholder_text="YYYY-MM-DD", width=150, height=40, font=("Arial", 14))
+        self.report_end_date.pack(side="left", padx=5)
+        ctk.CTkButton(report_frame, text="Generate Customer Report", command=self.generate_customer_report, height=40, font=("Arial", 14)).pack(side="left", padx=10)
 
         self.selected_customer_id = None
 
-    def load_customers(self):
-        for item in self.customer_tree.get_children():
-            self.customer_tree.delete(item)
-        cursor.execute("SELECT id, name, phone, email, loyalty_points, notes FROM customers")
-        for row in cursor.fetchall():
-            self.customer_tree.insert("", "end", values=row)
+    def load_customers(self, ids=None):
+        if ids:
+            self.customer_pages.update(ids)
+        else:
+            self.customer_pages.refresh()
 
     def filter_customers(self, event):
-        search_term = self.customer_search.get().lower()
-        for item in self.customer_tree.get_children():
-            self.customer_tree.delete(item)
-        cursor.execute("SELECT id, name, phone, email, loyalty_points, notes FROM customers WHERE LOWER(name) LIKE ?", (f"%{search_term}%",))
-        for row in cursor.fetchall():
-            self.customer_tree.insert("", "end", values=row)
+        self.debounce('customer_search', lambda: self.customer_pages.search(self.customer_search.get()))
 
     def select_customer(self, event):
         selected = self.customer_tree.selection()
@@ -870,10 +926,8 @@ class MainApp:
             item = self.customer_tree.item(selected[0])
             customer_id = item['values'][0]
             if messagebox.askyesno("Confirm", "Are you sure you want to delete this customer?"):
-                cursor.execute("DELETE FROM customers WHERE id=?", (customer_id,))
-                conn.commit()
-                self.load_customers()
-                self.update_dashboard()
+                self.db.customers.delete(customer_id)
+                self.refresh_changes()
                 self.log_action("Delete Customer", f"Deleted customer ID {customer_id}")
                 messagebox.showinfo("Success", "Customer deleted")
         else:
@@ -899,20 +953,14 @@ class MainApp:
             return
 
         if self.selected_customer_id:
-            cursor.execute("UPDATE customers SET name=?, phone=?, email=?, loyalty_points=?, notes=? WHERE id=?",
-                           (name, phone, email, points, notes, self.selected_customer_id))
-            conn.commit()
-            self.load_customers()
-            self.update_dashboard()
+            self.db.customers.update(self.selected_customer_id, name, phone, email, points, notes)
+            self.refresh_changes()
             self.log_action("Update Customer", f"Updated customer ID {self.selected_customer_id}")
             messagebox.showinfo("Success", "Customer updated")
             self.clear_customer_form()
         else:
-            cursor.execute("INSERT INTO customers (name, phone, email, loyalty_points, notes) VALUES (?, ?, ?, ?, ?)",
-                           (name, phone, email, points, notes))
-            conn.commit()
-            self.load_customers()
-            self.update_dashboard()
+            self.db.customers.add(name, phone, email, points, notes)
+            self.refresh_changes()
             self.log_action("Add Customer", f"Added new customer: {name}")
             messagebox.showinfo("Success", "Customer added")
             self.clear_customer_form()
@@ -933,109 +981,29 @@ class MainApp:
             return
         item = self.customer_tree.item(selected[0])
         customer_id = item['values'][0]
-        cursor.execute("SELECT name, phone, email, loyalty_points,notes FROM customers WHERE id=?", (customer_id,))
-        customer = cursor.fetchone()
+        customer = self.db.customers.get(customer_id)
         if not customer:
             messagebox.showerror("Error", "Customer not found")
             return
         name, phone, email, points, notes= customer
 
-        cursor.execute("SELECT s.id, s.date, s.total, s.discount FROM sales s WHERE s.customer_id=?", (customer_id,))
-        sales = cursor.fetchall()
+        # Both dates are optional; blank means no limit on that side
+        start = self.report_start_date.get().strip() or None
+        end = self.report_end_date.get().strip() or None
+        try:
+            for date in (start, end):
+                if date:
+                    datetime.datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
+            return
 
-        pdf_file = self.generate_customer_report_pdf(customer_id, name, phone, email, points, sales, notes)
+        pdf_file = self.generate_customer_report_pdf(customer_id, name, phone, email, start, end)
         if pdf_file:
             messagebox.showinfo("Success", f"Customer report generated: {pdf_file}")
 
-    def generate_customer_report_pdf(self, customer_id, name, phone, email, points, sales, notes):
-        shop_name = self.get_setting('shop_name', 'My Shop')
-        shop_phone = self.get_setting('shop_phone', '')
-        shop_email = self.get_setting('shop_email', '')
-        shop_location = self.get_setting('shop_location','')
-        greeting_message = self.get_setting('greeting_message', 'Thank you for your purchase!')
-        shop_logo = self.get_setting('shop_logo')
-
-        logo_x, logo_y = self.get_logo_position()
-        text_start_y = logo_y + 35 if self.get_setting('logo_vertical', 'Top') == "Top" else 10
-
-        align = {'Left': 'L', 'Center': 'C', 'Right': 'R'}.get(self.get_setting('shop_info_alignment', 'Center'), 'C')
-
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        if shop_logo and os.path.exists(os.path.join("images", shop_logo)):
-            pdf.image(os.path.join("images", shop_logo), x=logo_x, y=logo_y, w=30)
-
-        pdf.set_xy(10, text_start_y)
-        pdf.cell(200, 10, txt=shop_name, ln=True, align=align)
-        if shop_phone:
-            pdf.cell(200, 10, txt=f"Phone: {shop_phone}", ln=True, align=align)
-        if shop_email:
-            pdf.cell(200, 10, txt=f"Email: {shop_email}", ln=True, align=align)
-        #pdf.ln(10)
-        if shop_location:
-            pdf.cell(200, 10, txt=f"Shop Location : {shop_location}", ln=True, align=align)
-
-        #pdf.cell(200, 10, txt="Customer Report", ln=True, align='C')
-        pdf.ln(10)
-
-        pdf.cell(200, 10, txt=f"Customer: {name}", ln=True)
-        pdf.cell(200, 10, txt=f"Phone: {phone}", ln=True)
-        pdf.cell(200, 10, txt=f"Email: {email}", ln=True)
-       # pdf.cell(200, 10, txt=f"Loyalty Points: {points}", ln=True)
-       # pdf.cell(200, 10, txt=f"Notes: {notes}", ln=True)
-        pdf.ln(10)
-
-        pdf.cell(200, 10, txt="Purchase History:", ln=True)
-        if not sales:
-            pdf.cell(200, 10, txt="No purchase history", ln=True)
-        else:
-            total_spent = 0
-            for sale in sales:
-                sale_id, date, total, discount = sale
-                cursor.execute("SELECT p.name, si.quantity, si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id=?", (sale_id,))
-                items = cursor.fetchall()
-
-                subtotal = sum(item[1] * item[2] for item in items)
-                discount_amount = subtotal * (discount / 100) if discount > 0 else 0
-                total_spent += total
-
-                pdf.cell(200, 10, txt=f"Sale ID: {sale_id}   Date: {date}", ln=True)
-                pdf.cell(80, 10, txt="Product Name", border=1)
-                pdf.cell(30, 10, txt="Quantity", border=1)
-                pdf.cell(30, 10, txt="Price", border=1)
-                pdf.cell(50, 10, txt="Subtotal", border=1)
-                pdf.ln()
-
-                for item in items:
-                    product, quantity, price = item
-                    subtotal_item = quantity * price
-                    pdf.cell(80, 10, txt=product, border=1)
-                    pdf.cell(30, 10, txt=str(quantity), border=1)
-                    pdf.cell(30, 10, txt=f"${price:.2f}", border=1)
-                    pdf.cell(50, 10, txt=f"${subtotal_item:.2f}", border=1)
-                    pdf.ln()
-
-                pdf.cell(140, 10, txt="", ln=False)
-                pdf.cell(50, 10, txt=f"Subtotal: ${subtotal:.2f}", ln=True)
-                if discount > 0:
-                    pdf.cell(140, 10, txt="", ln=False)
-                    pdf.cell(50, 10, txt=f"Discount ({discount}%): -${discount_amount:.2f}", ln=True)
-                pdf.cell(140, 10, txt="", ln=False)
-                pdf.cell(50, 10, txt=f"Total: ${total:.2f}", ln=True)
-                pdf.ln(10)
-
-            pdf.ln(10)
-            pdf.cell(140, 10, txt="", ln=False)
-            pdf.cell(50, 10, txt=f"Total Spent: ${total_spent:.2f}", ln=True)
-
-        pdf.ln(20)
-        pdf.cell(200, 10, txt=greeting_message, ln=True, align='C')
-
-        pdf_file = f"customer_report_{customer_id}.pdf"
-        pdf.output(pdf_file)
-        return pdf_file
+    def generate_customer_report_pdf(self, customer_id, name, phone, email, start=None, end=None):
+        return self.receipts.customer_report(customer_id, name, phone, email, start, end)
 
     # Sales Section
     def create_sales(self):
@@ -1092,54 +1060,55 @@ class MainApp:
         top = ctk.CTkToplevel(self.window)
         top.title("Scan Barcode")
         top.geometry("640x480")
-        label = ctk.CTkLabel(top)
+        label = ctk.CTkLabel(top, text="")
         label.pack(fill="both", expand=True)
-        cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
-            messagebox.showerror("Error", "Could not access camera")
+        from scanner import BarcodeScanner
+
+        scanner = BarcodeScanner(0)
+        try:
+            scanner.start()
+        except RuntimeError as e:
+            messagebox.showerror("Error", str(e))
             top.destroy()
             return
+        last_preview = 0
 
-        def update_frame():
-            ret, frame = cap.read()
-            if ret:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                barcodes = decode(gray)
-                for barcode in barcodes:
-                    barcode_data = barcode.data.decode("utf-8")
-                    cursor.execute("SELECT name FROM products WHERE barcode=?", (barcode_data,))
-                    product = cursor.fetchone()
-                    if product:
-                        self.product_combobox.set(product[0])
-                        cap.release()
-                        top.destroy()
-                        return
-                    (x, y, w, h) = barcode.rect
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                img = Image.fromarray(frame)
+        def close():
+            scanner.stop()
+            top.destroy()
+
+        # Capture and decoding run on the scanner's threads; Tk only shows the
+        # newest preview and looks up codes the scanner has already debounced.
+        def poll():
+            nonlocal last_preview
+            while not scanner.codes.empty():
+                product = self.db.catalog.by_barcode(scanner.codes.get_nowait())
+                if product:
+                    self.product_combobox.set(product.name)
+                    close()
+                    return
+            if scanner.finished.is_set():
+                messagebox.showerror("Error", f"Failed to capture frame: {scanner.error}")
+                close()
+                return
+            last_preview, img = scanner.preview(last_preview)
+            if img is not None:
                 imgtk = ctk.CTkImage(light_image=img, dark_image=img, size=(640, 480))
                 label.configure(image=imgtk)
                 label.image = imgtk
-                top.after(10, update_frame)
-            else:
-                messagebox.showerror("Error", "Failed to capture frame")
-                cap.release()
-                top.destroy()
+            top.after(30, poll)
 
-        update_frame()
-        top.protocol("WM_DELETE_WINDOW", lambda: (cap.release(), top.destroy()))
+        poll()
+        top.protocol("WM_DELETE_WINDOW", close)
 
     def load_customers_combobox(self):
-        cursor.execute("SELECT name FROM customers")
-        customers = [row[0] for row in cursor.fetchall()]
+        customers = self.db.customers.names()
         self.customer_combobox.configure(values=customers)
         if customers:
             self.customer_combobox.set(customers[0])
 
     def load_products_combobox(self):
-        cursor.execute("SELECT name FROM products")
-        products = [row[0] for row in cursor.fetchall()]
+        products = self.db.catalog.names()
         self.product_combobox.configure(values=products)
         if products:
             self.product_combobox.set(products[0])
@@ -1160,18 +1129,17 @@ class MainApp:
             messagebox.showerror("Error", "Quantity must be a positive integer")
             return
 
-        cursor.execute("SELECT id, name, quantity, price, discount FROM products WHERE name=?", (product_name,))
-        product = cursor.fetchone()
+        product = self.db.catalog.by_name(product_name)
         if not product:
             messagebox.showerror("Error", "Product not found")
             return
 
-        product_id, name, available_qty, price, discount = product
-        if quantity > available_qty:
-            messagebox.showerror("Error", f"Insufficient stock. Available: {available_qty}")
+        product_id, name = product.id, product.name
+        if quantity > product.quantity:
+            messagebox.showerror("Error", f"Insufficient stock. Available: {product.quantity}")
             return
 
-        discounted_price = price * (1 - discount / 100)
+        discounted_price = product.price * (1 - product.discount / 100)
         subtotal_item = quantity * discounted_price
         self.sale_tree.insert("", "end", values=(name, quantity, f"${discounted_price:.2f}", f"${subtotal_item:.2f}"))
 
@@ -1215,6 +1183,7 @@ class MainApp:
         total = sum(item['quantity'] * item['price'] for item in self.current_sale_items) * (1 - self.current_discount / 100)
         try:
             # Simulate payment processing (replace with actual integration)
+            load_stripe()
             messagebox.showinfo("Payment", f"Processing {payment_method} payment for ${total:.2f}")
             self.finalize_sale_common(payment_method)
         except Exception as e:
@@ -1230,43 +1199,28 @@ class MainApp:
             messagebox.showerror("Error", "No items in the sale")
             return
 
-        cursor.execute("SELECT id FROM customers WHERE name=?", (customer_name,))
-        customer = cursor.fetchone()
-        if not customer:
+        customer_id = self.db.customers.id_for_name(customer_name)
+        if customer_id is None:
             messagebox.showerror("Error", "Customer not found")
             return
-        customer_id = customer[0]
-
-        subtotal = sum(item['quantity'] * item['price'] for item in self.current_sale_items)
-        total = subtotal * (1 - self.current_discount / 100)
 
-        date = datetime.date.today().isoformat()
-        cursor.execute("INSERT INTO sales (customer_id, date, total, discount, payment_method) VALUES (?, ?, ?, ?, ?)",
-                       (customer_id, date, total, self.current_discount, payment_method))
-        sale_id = cursor.lastrowid
-
-        for item in self.current_sale_items:
-            cursor.execute("INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
-                           (sale_id, item['id'], item['quantity'], item['price']))
-            cursor.execute("UPDATE products SET quantity = quantity - ? WHERE id = ?",
-                           (item['quantity'], item['id']))
-            self.sio.emit('inventory_updated', {'id': item['id'], 'quantity': item['quantity']})
-
-        points_earned = int(total // 10)
-        cursor.execute("UPDATE customers SET loyalty_points = loyalty_points + ? WHERE id = ?",
-                       (points_earned, customer_id))
-
-        conn.commit()
+        try:
+            sale_id, total, date, stock = self.db.sales.create_sale(customer_id, self.current_sale_items, self.current_discount, payment_method,
+                                                                    user=self.username)
+        except InsufficientStock as e:
+            # Another terminal sold the stock since the items were added
+            messagebox.showerror("Error", str(e))
+            self.refresh_changes()
+            return
 
-        self.sio.emit('new_sale', {'customer': customer_name, 'total': total, 'date': date})
+        # Same payload as the hub's: the resulting stock, not the units sold
+        for product_id, quantity, version in stock:
+            self.realtime.emit('inventory_updated', {'id': product_id, 'quantity': quantity, 'version': version})
+        self.realtime.emit('new_sale', {'customer': customer_name, 'total': total, 'date': date})
 
-        cursor.execute("SELECT name, quantity, min_stock FROM products WHERE quantity < min_stock")
-        low_stock_products = cursor.fetchall()
-        if low_stock_products:
-            body = "The following products are low on stock:\n"
-            for product in low_stock_products:
-                body += f"- {product[0]}: {product[1]} (min: {product[2]})\n"
-            self.send_email("Low Stock Alert", body)
+        low_stock_products = self.db.products.low_stock()
+        if low_stock_products and self.db.outbox.enqueue_low_stock(low_stock_products):
+            mailer.wake()
 
         self.sale_tree.delete(*self.sale_tree.get_children())
         self.subtotal_label.configure(text="Subtotal: $0.00")
@@ -1274,9 +1228,7 @@ class MainApp:
         self.discount_entry.delete(0, "end")
         self.current_sale_items = []
         self.current_discount = 0.0
-        self.update_dashboard()
-        self.load_sales_history()
-        self.log_action("Complete Sale", f"Completed sale ID {sale_id} via {payment_method}")
+        self.refresh_changes()
         messagebox.showinfo("Success", f"Sale completed via {payment_method}")
 
     # Sales History Section
@@ -1284,12 +1236,20 @@ class MainApp:
         frame = self.content_frames['history']
         frame.configure(fg_color="#FFFFFF")
 
-        self.history_tree = ttk.Treeview(frame, columns=("ID", "Date", "Customer", "Total", "Payment Method"), show="headings")
+        tree_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        tree_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        self.history_tree = ttk.Treeview(tree_frame, columns=("ID", "Date", "Customer", "Total", "Payment Method"), show="headings")
         for col in self.history_tree["columns"]:
             self.history_tree.heading(col, text=col)
             self.history_tree.column(col, width=150)
-        self.history_tree.pack(fill="both", expand=True, padx=20, pady=10)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.history_tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.history_tree.pack(side="left", fill="both", expand=True)
         self.history_tree.bind("<<TreeviewSelect>>", self.update_sale_items)
+        sort_keys = {"ID": 'id', "Date": 'date', "Customer": 'customer', "Total": 'total', "Payment Method": 'payment_method'}
+        self.history_pages = PagedTree(self.history_tree, self.db.sales.history_page, self.db.sales.history_rows, sort_keys,
+                                       descending=True, formatter=lambda row: (row[0], row[1], row[2], f"${row[3]:.2f}", row[4]),
+                                       scrollbar=scrollbar)
 
         self.sale_items_tree = ttk.Treeview(frame, columns=("Product", "Quantity", "Price", "Subtotal"), show="headings")
         for col in self.sale_items_tree["columns"]:
@@ -1303,14 +1263,13 @@ class MainApp:
         ctk.CTkButton(button_frame, text="Print Receipt", command=self.print_receipt, height=40, font=("Arial", 14)).pack(side="left", padx=5)
         ctk.CTkButton(button_frame, text="Process Return", command=self.process_return, height=40, font=("Arial", 14)).pack(side="left", padx=5)
 
-        self.load_sales_history()
+        self.history_pages.reset()
 
-    def load_sales_history(self):
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
-        cursor.execute("SELECT s.id, s.date, c.name, s.total, s.payment_method FROM sales s JOIN customers c ON s.customer_id = c.id")
-        for row in cursor.fetchall():
-            self.history_tree.insert("", "end", values=(row[0], row[1], row[2], f"${row[3]:.2f}", row[4]))
+    def load_sales_history(self, ids=None):
+        if ids:
+            self.history_pages.update(ids)
+        else:
+            self.history_pages.refresh()
 
     def update_sale_items(self, event):
         selected = self.history_tree.selection()
@@ -1319,8 +1278,7 @@ class MainApp:
             sale_id = item['values'][0]
             for i in self.sale_items_tree.get_children():
                 self.sale_items_tree.delete(i)
-            cursor.execute("SELECT p.name, si.quantity, si.price, si.quantity * si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id=?", (sale_id,))
-            for row in cursor.fetchall():
+            for row in self.db.sales.items(sale_id):
                 self.sale_items_tree.insert("", "end", values=row)
 
     def generate_receipt(self):
@@ -1353,86 +1311,7 @@ class MainApp:
                 messagebox.showerror("Error", f"Failed to print: {e}")
 
     def generate_receipt_pdf(self, sale_id):
-        cursor.execute("SELECT s.date, c.name, s.total, s.discount, s.payment_method FROM sales s JOIN customers c ON s.customer_id = c.id WHERE s.id=?", (sale_id,))
-        sale = cursor.fetchone()
-        if not sale:
-            return None
-        date, customer_name, total, discount, payment_method = sale
-
-        cursor.execute("SELECT p.name, si.quantity, si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id=?", (sale_id,))
-        items = cursor.fetchall()
-
-        shop_name = self.get_setting('shop_name', 'My Shop')
-        shop_phone = self.get_setting('shop_phone', '')
-        shop_email = self.get_setting('shop_email', '')
-        shop_location = self.get_setting('shop_location', '')
-        greeting_message = self.get_setting('greeting_message', 'Thank you for your purchase!')
-        shop_logo = self.get_setting('shop_logo')
-
-        logo_x, logo_y = self.get_logo_position()
-        text_start_y = logo_y + 35 if self.get_setting('logo_vertical', 'Top') == "Top" else 10
-
-        align = {'Left': 'L', 'Center': 'C', 'Right': 'R'}.get(self.get_setting('shop_info_alignment', 'Center'), 'C')
-
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        if shop_logo and os.path.exists(os.path.join("images", shop_logo)):
-            pdf.image(os.path.join("images", shop_logo), x=logo_x, y=logo_y, w=30)
-
-        pdf.set_xy(10, text_start_y)
-        pdf.cell(200, 10, txt=shop_name, ln=True, align=align)
-        if shop_phone:
-            pdf.cell(200, 10, txt=f"Phone: {shop_phone}", ln=True, align=align)
-        if shop_email:
-            pdf.cell(200, 10, txt=f"Email: {shop_email}", ln=True, align=align)
-        
-        pdf.cell(200, 10, txt=f"Shop Location: {shop_location}", ln=True, align=align)
-        pdf.ln(10)
-
-        pdf.cell(200, 10, txt=f"Sale ID: {sale_id}", ln=True)
-        pdf.cell(200, 10, txt=f"Date: {date}", ln=True)
-        pdf.cell(200, 10, txt=f"Customer: {customer_name}", ln=True)
-        pdf.cell(200, 10, txt=f"Payment Method: {payment_method}", ln=True)
-        pdf.ln(10)
-
-        pdf.cell(80, 10, txt="Product", border=1)
-        pdf.cell(30, 10, txt="Quantity", border=1)
-        pdf.cell(30, 10, txt="Price", border=1)
-        pdf.cell(50, 10, txt="Subtotal", border=1)
-        pdf.ln()
-
-        for item in items:
-            product, quantity, price = item
-            subtotal = quantity * price
-            pdf.cell(80, 10, txt=product, border=1)
-            pdf.cell(30, 10, txt=str(quantity), border=1)
-            pdf.cell(30, 10, txt=f"${price:.2f}", border=1)
-            pdf.cell(50, 10, txt=f"${subtotal:.2f}", border=1)
-            pdf.ln()
-
-        pdf.ln(10)
-        pdf.cell(140, 10, txt="Subtotal", border=1)
-        subtotal = sum(item[1] * item[2] for item in items)
-        pdf.cell(50, 10, txt=f"${subtotal:.2f}", border=1)
-        pdf.ln()
-
-        if discount > 0:
-            pdf.cell(140, 10, txt=f"Discount ({discount}%)", border=1)
-            discount_amount = subtotal * (discount / 100)
-            pdf.cell(50, 10, txt=f"-${discount_amount:.2f}", border=1)
-            pdf.ln()
-
-        pdf.cell(140, 10, txt="Total", border=1)
-        pdf.cell(50, 10, txt=f"${total:.2f}", border=1)
-        pdf.ln(20)
-
-        pdf.cell(200, 10, txt=greeting_message, ln=True, align='C')
-
-        pdf_file = f"receipt_{sale_id}.pdf"
-        pdf.output(pdf_file)
-        return pdf_file
+        return self.receipts.receipt(sale_id)
 
     def process_return(self):
         selected = self.history_tree.selection()
@@ -1442,8 +1321,7 @@ class MainApp:
         item = self.history_tree.item(selected[0])
         sale_id = item['values'][0]
 
-        cursor.execute("SELECT si.id, p.name, si.quantity, si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id=?", (sale_id,))
-        sale_items = cursor.fetchall()
+        sale_items = self.db.sales.returnable_items(sale_id)
 
         return_window = ctk.CTkToplevel(self.window)
         return_window.title("Process Return")
@@ -1474,25 +1352,16 @@ class MainApp:
         tree.bind("<Double-1>", update_return_qty)
 
         def confirm_return():
-            total_return = 0
-            for item_id, var in return_quantities.items():
-                qty = var.get()
-                if qty > 0:
-                    cursor.execute("SELECT quantity, price FROM sale_items WHERE id=?", (item_id,))
-                    sale_qty, price = cursor.fetchone()
-                    if qty > sale_qty:
-                        messagebox.showerror("Error", f"Cannot return more than sold for item ID {item_id}")
-                        return
-                    total_return += qty * price
-                    cursor.execute("UPDATE products SET quantity = quantity + ? WHERE id = (SELECT product_id FROM sale_items WHERE id=?)", (qty, item_id))
-                    self.log_action("Return Item", f"Returned {qty} of item ID {item_id} from sale ID {sale_id}")
+            quantities = {item_id: var.get() for item_id, var in return_quantities.items()}
+            try:
+                total_return, returned = self.db.sales.process_return(sale_id, quantities, user=self.username)
+            except StoreError as e:
+                messagebox.showerror("Error", str(e))
+                return
 
             if total_return > 0:
-                cursor.execute("UPDATE sales SET total = total - ? WHERE id=?", (total_return, sale_id))
-                conn.commit()
                 messagebox.showinfo("Success", f"Return processed. Total refunded: ${total_return:.2f}")
-                self.load_sales_history()
-                self.update_dashboard()
+                self.refresh_changes()
                 return_window.destroy()
             else:
                 messagebox.showwarning("Warning", "No items to return")
@@ -1534,8 +1403,7 @@ class MainApp:
     def load_suppliers(self):
         for item in self.supplier_tree.get_children():
             self.supplier_tree.delete(item)
-        cursor.execute("SELECT id, name, contact, email, products FROM suppliers")
-        for row in cursor.fetchall():
+        for row in self.db.suppliers.all():
             self.supplier_tree.insert("", "end", values=row)
 
     def select_supplier(self, event):
@@ -1560,9 +1428,8 @@ class MainApp:
             item = self.supplier_tree.item(selected[0])
             supplier_id = item['values'][0]
             if messagebox.askyesno("Confirm", "Are you sure you want to delete this supplier?"):
-                cursor.execute("DELETE FROM suppliers WHERE id=?", (supplier_id,))
-                conn.commit()
-                self.load_suppliers()
+                self.db.suppliers.delete(supplier_id)
+                self.refresh_changes()
                 messagebox.showinfo("Success", "Supplier deleted")
         else:
             messagebox.showwarning("Warning", "Please select a supplier")
@@ -1578,19 +1445,17 @@ class MainApp:
             return
 
         if self.selected_supplier_id:
-            cursor.execute("UPDATE suppliers SET name=?, contact=?, email=?, products=? WHERE id=?",
-                           (name, contact, email, products, self.selected_supplier_id))
-            conn.commit()
-            self.load_suppliers()
-            self.load_suppliers_combobox(self.product_entries['supplier'])
+            self.db.suppliers.update(self.selected_supplier_id, name, contact, email, products)
+            self.refresh_changes()
+            if 'products' in self.built_sections:
+                self.load_suppliers_combobox(self.product_entries['supplier'])
             messagebox.showinfo("Success", "Supplier updated")
             self.clear_supplier_form()
         else:
-            cursor.execute("INSERT INTO suppliers (name, contact, email, products) VALUES (?, ?, ?, ?)",
-                           (name, contact, email, products))
-            conn.commit()
-            self.load_suppliers()
-            self.load_suppliers_combobox(self.product_entries['supplier'])
+            self.db.suppliers.add(name, contact, email, products)
+            self.refresh_changes()
+            if 'products' in self.built_sections:
+                self.load_suppliers_combobox(self.product_entries['supplier'])
             messagebox.showinfo("Success", "Supplier added")
             self.clear_supplier_form()
 
@@ -1628,8 +1493,7 @@ class MainApp:
     def load_expenses(self):
         for item in self.expense_tree.get_children():
             self.expense_tree.delete(item)
-        cursor.execute("SELECT id, date, category, amount, description FROM expenses")
-        for row in cursor.fetchall():
+        for row in self.db.expenses.all():
             self.expense_tree.insert("", "end", values=(row[0], row[1], row[2], f"${row[3]:.2f}", row[4]))
 
     def add_expense(self):
@@ -1651,10 +1515,8 @@ class MainApp:
             messagebox.showerror("Error", "Invalid date or amount")
             return
 
-        cursor.execute("INSERT INTO expenses (date, category, amount, description) VALUES (?, ?, ?, ?)", (date, category, amount, description))
-        conn.commit()
-        self.load_expenses()
-        self.update_dashboard()
+        self.db.expenses.add(date, category, amount, description)
+        self.refresh_changes()
         messagebox.showinfo("Success", "Expense added")
 
     # Purchase Orders Section
@@ -1708,8 +1570,7 @@ class MainApp:
         self.current_po_items = []
 
     def load_products_combobox_po(self):
-        cursor.execute("SELECT name FROM products")
-        products = [row[0] for row in cursor.fetchall()]
+        products = self.db.catalog.names()
         self.po_product.configure(values=products)
         if products:
             self.po_product.set(products[0])
@@ -1729,8 +1590,7 @@ class MainApp:
             messagebox.showerror("Error", "Quantity must be a positive integer")
             return
 
-        cursor.execute("SELECT id, name FROM products WHERE name=?", (product_name,))
-        product = cursor.fetchone()
+        product = self.db.purchase_orders.product_for_name(product_name)
         if not product:
             messagebox.showerror("Error", "Product not found")
             return
@@ -1750,61 +1610,34 @@ class MainApp:
             messagebox.showerror("Error", "No items in order")
             return
 
-        cursor.execute("SELECT id FROM suppliers WHERE name=?", (supplier_name,))
-        supplier = cursor.fetchone()
-        if not supplier:
+        supplier_id = self.db.suppliers.id_for_name(supplier_name)
+        if supplier_id is None:
             messagebox.showerror("Error", "Supplier not found")
             return
-        supplier_id = supplier[0]
 
-        date = datetime.date.today().isoformat()
-        cursor.execute("INSERT INTO purchase_orders (supplier_id, date, status) VALUES (?, ?, ?)", (supplier_id, date, "Pending"))
-        po_id = cursor.lastrowid
-
-        for item in self.current_po_items:
-            cursor.execute("INSERT INTO purchase_order_items (po_id, product_id, quantity) VALUES (?, ?, ?)", (po_id, item['id'], item['quantity']))
-
-        conn.commit()
-        self.sio.emit('new_purchase_order', {'po_id': po_id, 'supplier': supplier_name, 'date': date, 'status': 'Pending'})
+        po_id, date = self.db.purchase_orders.create(supplier_id, self.current_po_items)
+        self.realtime.emit('new_purchase_order', {'po_id': po_id, 'supplier': supplier_name, 'date': date, 'status': 'Pending'})
         self.po_items_tree.delete(*self.po_items_tree.get_children())
         self.current_po_items = []
-        self.load_purchase_orders()
+        self.refresh_changes()
         messagebox.showinfo("Success", "Purchase order created")
 
     def auto_generate_pos(self):
-        cursor.execute("SELECT p.id, p.name, p.quantity, p.min_stock, p.supplier_id FROM products p WHERE p.quantity < p.min_stock AND p.supplier_id IS NOT NULL")
-        low_stock_products = cursor.fetchall()
-        if not low_stock_products:
+        created = self.db.purchase_orders.auto_generate()
+        if not created:
             messagebox.showinfo("Info", "No low stock products to reorder")
             return
 
-        suppliers = {}
-        for product in low_stock_products:
-            product_id, name, quantity, min_stock, supplier_id = product
-            reorder_qty = min_stock - quantity + 10
-            if supplier_id not in suppliers:
-                suppliers[supplier_id] = []
-            suppliers[supplier_id].append({'id': product_id, 'name': name, 'quantity': reorder_qty})
-
-        for supplier_id, items in suppliers.items():
-            date = datetime.date.today().isoformat()
-            cursor.execute("INSERT INTO purchase_orders (supplier_id, date, status) VALUES (?, ?, ?)", (supplier_id, date, "Pending"))
-            po_id = cursor.lastrowid
-            for item in items:
-                cursor.execute("INSERT INTO purchase_order_items (po_id, product_id, quantity) VALUES (?, ?, ?)", (po_id, item['id'], item['quantity']))
-            conn.commit()
-            cursor.execute("SELECT name FROM suppliers WHERE id=?", (supplier_id,))
-            supplier_name = cursor.fetchone()[0]
-            self.sio.emit('new_purchase_order', {'po_id': po_id, 'supplier': supplier_name, 'date': date, 'status': 'Pending'})
+        for po in created:
+            self.realtime.emit('new_purchase_order', po)
 
-        self.load_purchase_orders()
+        self.refresh_changes()
         messagebox.showinfo("Success", "Purchase orders generated for low stock products")
 
     def load_purchase_orders(self):
         for item in self.po_tree.get_children():
             self.po_tree.delete(item)
-        cursor.execute("SELECT po.id, s.name, po.date, po.status FROM purchase_orders po JOIN suppliers s ON po.supplier_id = s.id")
-        for row in cursor.fetchall():
+        for row in self.db.purchase_orders.all():
             self.po_tree.insert("", "end", values=row)
 
     def mark_po_completed(self):
@@ -1812,10 +1645,9 @@ class MainApp:
         if selected:
             item = self.po_tree.item(selected[0])
             po_id = item['values'][0]
-            cursor.execute("UPDATE purchase_orders SET status='Completed' WHERE id=?", (po_id,))
-            conn.commit()
-            self.load_purchase_orders()
-            self.sio.emit('purchase_order_updated', {'po_id': po_id, 'status': 'Completed'})
+            self.db.purchase_orders.set_status(po_id, 'Completed')
+            self.refresh_changes()
+            self.realtime.emit('purchase_order_updated', {'po_id': po_id, 'status': 'Completed'})
             messagebox.showinfo("Success", "Purchase order marked as completed")
         else:
             messagebox.showwarning("Warning", "Please select a purchase order")
@@ -1825,10 +1657,9 @@ class MainApp:
         if selected:
             item = self.po_tree.item(selected[0])
             po_id = item['values'][0]
-            cursor.execute("UPDATE purchase_orders SET status='Cancelled' WHERE id=?", (po_id,))
-            conn.commit()
-            self.load_purchase_orders()
-            self.sio.emit('purchase_order_updated', {'po_id': po_id, 'status': 'Cancelled'})
+            self.db.purchase_orders.set_status(po_id, 'Cancelled')
+            self.refresh_changes()
+            self.realtime.emit('purchase_order_updated', {'po_id': po_id, 'status': 'Cancelled'})
             messagebox.showinfo("Success", "Purchase order marked as cancelled")
         else:
             messagebox.showwarning("Warning", "Please select a purchase order")
@@ -1846,6 +1677,10 @@ class MainApp:
         ctk.CTkLabel(date_frame, text="To:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
         self.end_date = ctk.CTkEntry(date_frame, placeholder_text="YYYY-MM-DD", width=150, height=40, font=("Arial", 14))
         self.end_date.pack(side="left", padx=5)
+        ctk.CTkLabel(date_frame, text="Group by:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.report_granularity = ctk.CTkComboBox(date_frame, values=["Day", "Week", "Month", "Quarter"], width=120, height=40, font=("Arial", 14))
+        self.report_granularity.set("Month")
+        self.report_granularity.pack(side="left", padx=5)
         ctk.CTkButton(date_frame, text="Generate", command=self.generate_report, height=40, font=("Arial", 14)).pack(side="left", padx=10)
 
         self.report_tree = ttk.Treeview(frame, columns=("Period", "Total Sales", "Total Expenses", "Profit"), show="headings")
@@ -1856,14 +1691,91 @@ class MainApp:
 
         chart_frame = ctk.CTkFrame(frame, fg_color="transparent")
         chart_frame.pack(pady=10, fill="both", expand=True)
-        self.fig, self.ax = plt.subplots(figsize=(8, 4))
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from charts import BarChart, SalesSeries
+
+        self.fig = Figure(figsize=(8, 4))
         self.canvas = FigureCanvasTkAgg(self.fig, master=chart_frame)
         self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.sales_chart = BarChart(self.fig, self.canvas)
+        self.report_series = SalesSeries(self.db)
+        self.report_params = None
+        self.report_request = None
 
         report_button_frame = ctk.CTkFrame(frame, fg_color="transparent")
         report_button_frame.pack(pady=10)
         ctk.CTkButton(report_button_frame, text="Sales by Category", command=self.generate_sales_by_category, height=40, font=("Arial", 14)).pack(side="left", padx=5)
         ctk.CTkButton(report_button_frame, text="Top Customers", command=self.generate_top_customers, height=40, font=("Arial", 14)).pack(side="left", padx=5)
+        ctk.CTkButton(report_button_frame, text="Export Receipts", command=lambda: self.start_export('receipts'), height=40, font=("Arial", 14)).pack(side="left", padx=5)
+        ctk.CTkButton(report_button_frame, text="Export Statements", command=lambda: self.start_export('statements'), height=40, font=("Arial", 14)).pack(side="left", padx=5)
+
+        export_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        export_frame.pack(pady=5)
+        self.export_progress = ctk.CTkProgressBar(export_frame, width=400)
+        self.export_progress.set(0)
+        self.export_progress.pack(side="left", padx=5)
+        self.export_label = ctk.CTkLabel(export_frame, text="", font=("Arial", 12))
+        self.export_label.pack(side="left", padx=5)
+        self.export_thread = None
+
+    def start_export(self, kind):
+        from export import export, default_output
+
+        if self.export_thread and self.export_thread.is_alive():
+            messagebox.showwarning("Warning", "An export is already running")
+            return
+        if kind == 'receipts':
+            start = self.start_date.get().strip()
+            end = self.end_date.get().strip()
+            try:
+                datetime.datetime.strptime(start, "%Y-%m-%d")
+                datetime.datetime.strptime(end, "%Y-%m-%d")
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
+                return
+            ids = self.db.sales.ids_between(start, end)
+        else:
+            ids = self.db.customers.ids()
+        if not ids:
+            messagebox.showinfo("Export", "Nothing to export")
+            return
+
+        out = default_output(kind, messagebox.askyesno("Export", "Bundle the PDFs into a single zip file?"))
+        updates = queue.Queue()
+
+        # Rendering runs in worker processes; this thread only feeds progress
+        # back to Tk through the queue.
+        def run():
+            try:
+                written = export(self.db.path, kind, ids, out, progress=lambda done, total: updates.put(('progress', done, total)))
+                updates.put(('done', written, out))
+            except Exception as e:
+                updates.put(('error', str(e), None))
+
+        self.export_progress.set(0)
+        self.export_label.configure(text=f"Exporting {len(ids)} {kind}...")
+        self.export_thread = threading.Thread(target=run, daemon=True)
+        self.export_thread.start()
+        self.poll_export(kind, updates)
+
+    def poll_export(self, kind, updates):
+        while not updates.empty():
+            status, value, extra = updates.get_nowait()
+            if status == 'progress':
+                self.export_progress.set(value / extra)
+                self.export_label.configure(text=f"Exporting {kind}: {value}/{extra}")
+            elif status == 'done':
+                self.export_progress.set(1)
+                self.export_label.configure(text=f"Exported {value} files")
+                self.log_action("Export", f"Exported {value} {kind} to {extra}")
+                messagebox.showinfo("Success", f"Exported {value} files to {extra}")
+                return
+            else:
+                self.export_label.configure(text="Export failed")
+                messagebox.showerror("Error", f"Export failed: {value}")
+                return
+        self.window.after(200, lambda: self.poll_export(kind, updates))
 
     def generate_report(self):
         start = self.start_date.get().strip()
@@ -1876,30 +1788,42 @@ class MainApp:
             messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
             return
 
-        cursor.execute("SELECT SUM(total) FROM sales WHERE date BETWEEN ? AND ?", (start, end))
-        total_sales = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(amount) FROM expenses WHERE date BETWEEN ? AND ?", (start, end))
-        total_expenses = cursor.fetchone()[0] or 0
-        profit = total_sales - total_expenses
+        self.report_params = (start, end, self.report_granularity.get())
+        self.show_report()
+
+    def refresh_report(self):
+        # Sales or expenses changed: cached series are stale
+        self.report_series.invalidate()
+        if self.report_params:
+            self.show_report()
+
+    def show_report(self):
+        # The series are read on a worker thread; Tk polls for the result
+        start, end, granularity = self.report_params
+        self.report_request = self.report_series.submit(start, end, granularity.lower())
+        self.poll_report(self.report_request, start, end, granularity)
+
+    def poll_report(self, request, start, end, granularity):
+        if request is not self.report_request:
+            # A newer report replaced this one
+            return
+        if not request.done():
+            self.window.after(30, lambda: self.poll_report(request, start, end, granularity))
+            return
+        try:
+            result = request.result()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load report: {e}")
+            return
 
+        total_sales, total_expenses = result['totals']
+        profit = total_sales - total_expenses
         for item in self.report_tree.get_children():
             self.report_tree.delete(item)
         self.report_tree.insert("", "end", values=(f"{start} to {end}", f"${total_sales:.2f}", f"${total_expenses:.2f}", f"${profit:.2f}"))
 
-        cursor.execute("SELECT strftime('%Y-%m', date) AS month, SUM(total) FROM sales WHERE date BETWEEN ? AND ? GROUP BY month", (start, end))
-        monthly_sales = cursor.fetchall()
-        self.ax.clear()
-        if monthly_sales:
-            months = [row[0] for row in monthly_sales]
-            sales = [row[1] for row in monthly_sales]
-            self.ax.bar(months, sales, color='#4682B4')
-            self.ax.set_title("Monthly Sales")
-            self.ax.set_xlabel("Month")
-            self.ax.set_ylabel("Total Sales ($)")
-            self.canvas.draw()
-        else:
-            self.ax.text(0.5, 0.5, "No sales data for this period", horizontalalignment='center', verticalalignment='center')
-            self.canvas.draw()
+        xlabel = granularity if result['per_bar'] == 1 else f"{granularity} ({result['per_bar']} per bar)"
+        self.sales_chart.update(result['series'], f"Sales by {granularity}", xlabel, "Total Sales ($)", "No sales data for this period")
 
     def generate_sales_by_category(self):
         start = self.start_date.get().strip()
@@ -1911,15 +1835,7 @@ class MainApp:
             messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
             return
 
-        cursor.execute("""
-            SELECT p.category, SUM(si.quantity * si.price) as total
-            FROM sale_items si
-            JOIN products p ON si.product_id = p.id
-            JOIN sales s ON si.sale_id = s.id
-            WHERE s.date BETWEEN ? AND ?
-            GROUP BY p.category
-        """, (start, end))
-        data = cursor.fetchall()
+        data = self.db.reports.sales_by_category(start, end)
 
         report_window = ctk.CTkToplevel(self.window)
         report_window.title("Sales by Category")
@@ -1944,16 +1860,7 @@ class MainApp:
             messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
             return
 
-        cursor.execute("""
-            SELECT c.name, SUM(s.total) as total_spent
-            FROM sales s
-            JOIN customers c ON s.customer_id = c.id
-            WHERE s.date BETWEEN ? AND ?
-            GROUP BY c.id
-            ORDER BY total_spent DESC
-            LIMIT 10
-        """, (start, end))
-        data = cursor.fetchall()
+        data = self.db.reports.top_customers(start, end)
 
         report_window = ctk.CTkToplevel(self.window)
         report_window.title("Top Customers")
@@ -2022,9 +1929,8 @@ class MainApp:
 
         hashed = hashlib.sha256(password.encode()).hexdigest()
         try:
-            cursor.execute("INSERT INTO users (full_name, email, username, password, role) VALUES (?, ?, ?, ?, ?)", (full_name, email, username, hashed, role))
-            conn.commit()
-            self.load_users()
+            self.db.users.add(username, hashed, role, full_name, email)
+            self.refresh_changes()
             self.new_full_name.delete(0, "end")
             self.new_email.delete(0, "end")
             self.new_username.delete(0, "end")
@@ -2036,10 +1942,81 @@ class MainApp:
     def load_users(self):
         for item in self.user_tree.get_children():
             self.user_tree.delete(item)
-        cursor.execute("SELECT id, full_name, email, username, role FROM users")
-        for row in cursor.fetchall():
+        for row in self.db.users.all():
             self.user_tree.insert("", "end", values=row)
 
+    # Audit Log Section
+    def create_audit(self):
+        frame = self.content_frames['audit']
+        frame.configure(fg_color="#FFFFFF")
+
+        filter_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        filter_frame.pack(pady=10, padx=20, fill="x")
+        ctk.CTkLabel(filter_frame, text="User:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.audit_user = ctk.CTkComboBox(filter_frame, values=["All"] + self.db.audit.users(), width=140, height=40, font=("Arial", 14))
+        self.audit_user.set("All")
+        self.audit_user.pack(side="left", padx=5)
+        ctk.CTkLabel(filter_frame, text="Action:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.audit_action = ctk.CTkComboBox(filter_frame, values=["All"] + self.db.audit.actions(), width=160, height=40, font=("Arial", 14))
+        self.audit_action.set("All")
+        self.audit_action.pack(side="left", padx=5)
+        ctk.CTkLabel(filter_frame, text="From:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.audit_start = ctk.CTkEntry(filter_frame, placeholder_text="YYYY-MM-DD", width=120, height=40, font=("Arial", 14))
+        self.audit_start.pack(side="left", padx=5)
+        ctk.CTkLabel(filter_frame, text="To:", font=("Arial", 14, "bold")).pack(side="left", padx=5)
+        self.audit_end = ctk.CTkEntry(filter_frame, placeholder_text="YYYY-MM-DD", width=120, height=40, font=("Arial", 14))
+        self.audit_end.pack(side="left", padx=5)
+        self.audit_search = ctk.CTkEntry(filter_frame, placeholder_text="Search details", width=200, height=40, font=("Arial", 14))
+        self.audit_search.pack(side="left", padx=5)
+        self.audit_search.bind("<Return>", lambda event: self.search_audit())
+        self.audit_archived = ctk.CTkCheckBox(filter_frame, text="Archived", font=("Arial", 14))
+        self.audit_archived.pack(side="left", padx=5)
+        ctk.CTkButton(filter_frame, text="Search", command=self.search_audit, height=40, font=("Arial", 14)).pack(side="left", padx=5)
+
+        tree_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        tree_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        self.audit_tree = ttk.Treeview(tree_frame, columns=("ID", "Time", "User", "Action", "Details"), show="headings", height=20)
+        for col, width in (("ID", 80), ("Time", 200), ("User", 120), ("Action", 160), ("Details", 500)):
+            self.audit_tree.heading(col, text=col)
+            self.audit_tree.column(col, width=width)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.audit_tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.audit_tree.pack(side="left", fill="both", expand=True)
+
+        # Filters other than the search term are applied through the fetch;
+        # entries past the retention period are searched in the archive
+        self.audit_filters = {}
+        self.audit_source = self.db.audit
+        sort_keys = {"ID": 'id', "Time": 'time', "User": 'user', "Action": 'action'}
+        self.audit_pages = PagedTree(self.audit_tree,
+                                     lambda after, sort, descending, limit, term: self.audit_source.page(after, sort, descending, limit, term, **self.audit_filters),
+                                     self.db.audit.rows, sort_keys, sort='time', descending=True,
+                                     formatter=lambda row: (row[0], row[1][:19].replace('T', ' '), row[2], row[3], row[4]),
+                                     scrollbar=scrollbar)
+        self.audit_pages.reset()
+
+    def search_audit(self):
+        start = self.audit_start.get().strip()
+        end = self.audit_end.get().strip()
+        try:
+            for value in (start, end):
+                if value:
+                    datetime.datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
+            return
+        user = self.audit_user.get()
+        action = self.audit_action.get()
+        self.audit_filters = {
+            'user': None if user == "All" else user,
+            'action': None if action == "All" else action,
+            'start': start or None,
+            'end': end or None,
+        }
+        self.audit_source = audit_archive if self.audit_archived.get() else self.db.audit
+        self.audit_pages.term = self.audit_search.get().strip()
+        self.audit_pages.reset()
+
     # Settings Section
     def create_settings(self):
         frame = self.content_frames['settings']
@@ -2058,7 +2035,9 @@ class MainApp:
             ('email_port', 'Email Port'),
             ('email_username', 'Email Username'),
             ('email_password', 'Email Password'),
-            ('alert_email', 'Alert Email')
+            ('alert_email', 'Alert Email'),
+            ('sync_hub', 'Sync Hub URL'),
+            ('audit_retention_days', 'Audit Retention (days)')
         ]
 
         self.settings_entries = {}
@@ -2107,42 +2086,52 @@ class MainApp:
         file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.jpeg *.png *.gif")])
         if file_path:
             try:
-                img = Image.open(file_path)
-                filename = os.path.basename(file_path)
-                dest_path = os.path.join("images", filename)
-                if not os.path.exists("images"):
-                    os.makedirs("images")
-                img.save(dest_path)
+                filename = image_store.add(file_path)
                 self.set_setting('shop_logo', filename)
-                self.shop_logo_label.configure(text=filename)
+                self.shop_logo_label.configure(text=os.path.basename(file_path))
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to upload logo: {e}")
 
     def save_settings(self):
-        for key, entry in self.settings_entries.items():
-            value = entry.get().strip()
-            self.set_setting(key, value)
-        appearance_mode = self.appearance_mode.get()
-        self.set_setting('appearance_mode', appearance_mode)
-        ctk.set_appearance_mode(appearance_mode)
-        logo_horizontal = self.logo_horizontal.get()
-        logo_vertical = self.logo_vertical.get()
-        shop_info_alignment = self.shop_info_alignment.get()
-        self.set_setting('logo_horizontal', logo_horizontal)
-        self.set_setting('logo_vertical', logo_vertical)
-        self.set_setting('shop_info_alignment', shop_info_alignment)
+        values = {key: entry.get().strip() for key, entry in self.settings_entries.items()}
+        values['appearance_mode'] = self.appearance_mode.get()
+        values['logo_horizontal'] = self.logo_horizontal.get()
+        values['logo_vertical'] = self.logo_vertical.get()
+        values['shop_info_alignment'] = self.shop_info_alignment.get()
+        if values['audit_retention_days'] and not values['audit_retention_days'].isdigit():
+            messagebox.showerror("Error", "Audit retention must be a whole number of days (empty keeps everything)")
+            return
+        self.db.settings.update(values)
+        audit_archive.wake()
+        ctk.set_appearance_mode(values['appearance_mode'])
         messagebox.showinfo("Success", "Settings saved")
 
 # Run Application
 if __name__ == "__main__":
-    import threading
-    import uvicorn
-    from socketio import ASGIApp
-
-    app = ASGIApp(sio)
-
-    def run_server():
-        uvicorn.run(app, host="127.0.0.1", port=5000)
-
-    threading.Thread(target=run_server, daemon=True).start()
-    LoginWindow()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shop Management System")
+    parser.add_argument('--startup-report', action='store_true', help="print startup timings")
+    StartupTimer.enabled = parser.parse_args().startup_report
+
+    from realtime import RealtimeHub, STORE_ID, HOST
+
+    # Set realtime_host to 0.0.0.0 on the hub so other tills can reach it
+    realtime = RealtimeHub(db, db.settings.get('store_id', STORE_ID))
+    realtime.start(db.settings.get('realtime_host') or HOST)
+    mailer.start()
+    # Tills other than the hub sync through it; takes effect on restart
+    sync = None
+    if db.settings.get('sync_hub'):
+        from sync import SyncClient
+        sync = SyncClient(db, db.settings.get('sync_hub'), realtime.store)
+        sync.start()
+    audit_archive.start()
+    LoginWindow()
+    if sync:
+        sync.stop()
+    audit_archive.stop()
+    mailer.stop()
+    realtime.stop()
+    # Flushes the audit log, including what the threads logged on their way out
+    db.close()
\ No newline at end of file
@@ -0,0 +1,307 @@
+import asyncio
+import hmac
+import sqlite3
+import threading
+import time
+
+import socketio
+
+from store import InventoryConflict, StoreError, SYNC_TABLES, SYNC_PAGE
+
+# Realtime hub for terminals and dashboards, served over ASGI by uvicorn on
+# its own thread and event loop. The desktop app calls emit() from the Tk
+# thread; events are queued and flushed from the loop every BATCH_INTERVAL,
+# several events for the same room going out as one 'batch' message.
+HOST = "127.0.0.1"
+PORT = 5000
+STORE_ID = "main"
+BATCH_INTERVAL = 0.05
+BATCH_MAX = 200
+# Inventory updates from terminals and counters: at most MAX_UPDATES entries
+# per message, and each client gets UPDATE_RATE entries per second with
+# bursts up to UPDATE_BURST
+MAX_UPDATES = 500
+MAX_QUANTITY = 10 ** 9
+UPDATE_RATE = 200
+UPDATE_BURST = 1000
+NOT_A_COPY = "this database is not a copy of the hub's; copy the hub's shop.db and run sync.py --join"
+NOT_HOSTING = "this till doesn't host sync; run sync.py --host on it first"
+NOT_AUTHORIZED = "sync needs the hub's secret; run sync.py --secret with the one sync.py --host printed"
+
+
+def store_room(store):
+    return f"store:{store}"
+
+
+def terminal_room(terminal):
+    return f"terminal:{terminal}"
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_inventory_updates(data):
+    # {'updates': [{'id', 'delta' or 'quantity', 'version'?}, ...]}, or the
+    # single {'id', 'quantity'} older clients send. Returns the tuples
+    # ProductStore.apply_inventory takes; raises ValueError on bad input.
+    if not isinstance(data, dict):
+        raise ValueError("expected an object")
+    updates = data.get('updates', [data] if 'id' in data else None)
+    if not isinstance(updates, list) or not updates:
+        raise ValueError("expected a non-empty 'updates' list")
+    if len(updates) > MAX_UPDATES:
+        raise ValueError(f"at most {MAX_UPDATES} updates per message")
+    parsed = []
+    seen = set()
+    for update in updates:
+        if not isinstance(update, dict) or not _is_int(update.get('id')):
+            raise ValueError("each update needs an integer 'id'")
+        product_id = update['id']
+        if product_id in seen:
+            raise ValueError(f"product {product_id} appears more than once")
+        seen.add(product_id)
+        delta = update.get('delta')
+        quantity = update.get('quantity')
+        version = update.get('version')
+        if (delta is None) == (quantity is None):
+            raise ValueError(f"product {product_id}: give either 'delta' or 'quantity'")
+        if delta is not None and not (_is_int(delta) and abs(delta) <= MAX_QUANTITY):
+            raise ValueError(f"product {product_id}: bad delta")
+        if quantity is not None and not (_is_int(quantity) and 0 <= quantity <= MAX_QUANTITY):
+            raise ValueError(f"product {product_id}: bad quantity")
+        if version is not None and not _is_int(version):
+            raise ValueError(f"product {product_id}: bad version")
+        parsed.append((product_id, delta, quantity, version))
+    return parsed
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, count):
+        # Returns 0 when allowed, otherwise seconds until it would be
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0
+        return (count - self.tokens) / self.rate
+
+
+class RealtimeHub:
+    def __init__(self, db, store=STORE_ID, batch_interval=BATCH_INTERVAL):
+        self.db = db
+        self.store = store
+        self.batch_interval = batch_interval
+        self.sio = socketio.AsyncServer(async_mode='asgi')
+        self.app = socketio.ASGIApp(self.sio)
+        self.loop = None
+        self.server = None
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flush_scheduled = False
+        self._flush_task = None
+        self._thread = None
+        self._buckets = {}
+        self._register_handlers()
+        db.changes.subscribe(self._on_change)
+
+    def _register_handlers(self):
+        sio = self.sio
+
+        @sio.event
+        async def connect(sid, environ, auth=None):
+            # Clients pass {'store': ..., 'terminal': ...} as auth, and sync
+            # clients the hub's 'secret' as well
+            auth = auth if isinstance(auth, dict) else {}
+            store = auth.get('store') or self.store
+            terminal = auth.get('terminal') or sid
+            secret = await asyncio.to_thread(self.db.settings.get, 'sync_secret')
+            sync = bool(secret) and hmac.compare_digest(str(auth.get('secret') or '').encode(), secret.encode())
+            await sio.save_session(sid, {'store': store, 'terminal': terminal, 'sync': sync})
+            await sio.enter_room(sid, store_room(store))
+            await sio.enter_room(sid, terminal_room(terminal))
+            print('Client connected:', sid, store, terminal)
+
+        @sio.event
+        async def disconnect(sid, *args):
+            self._buckets.pop(sid, None)
+            print('Client disconnected:', sid)
+
+        @sio.event
+        async def update_inventory(sid, data):
+            # The return value is the client's ack
+            return await self._update_inventory(sid, data)
+
+        @sio.event
+        async def sync_hello(sid, data=None):
+            error = await self._sync_error(sid)
+            if error:
+                return {'ok': False, 'error': error}
+            return {'ok': True, 'database': await asyncio.to_thread(self.db.sync.database_id)}
+
+        @sio.event
+        async def sync_push(sid, data):
+            return await self._sync_push(sid, data)
+
+        @sio.event
+        async def sync_pull(sid, data):
+            return await self._sync_pull(sid, data)
+
+        @sio.event
+        async def sale_made(sid, data):
+            await self._relay(sid, 'new_sale', data)
+
+        @sio.event
+        async def new_purchase_order(sid, data):
+            await self._relay(sid, 'new_purchase_order', data)
+
+        @sio.event
+        async def purchase_order_updated(sid, data):
+            await self._relay(sid, 'purchase_order_updated', data)
+
+    async def _update_inventory(self, sid, data):
+        try:
+            updates = parse_inventory_updates(data)
+        except ValueError as e:
+            return {'ok': False, 'error': str(e)}
+        bucket = self._buckets.get(sid)
+        if bucket is None:
+            bucket = self._buckets[sid] = TokenBucket(UPDATE_RATE, UPDATE_BURST)
+        wait = bucket.take(len(updates))
+        if wait:
+            return {'ok': False, 'error': 'rate limited', 'retry_after': round(wait, 3)}
+        try:
+            rows = await asyncio.to_thread(self._write, self.db.products.apply_inventory, updates)
+        except InventoryConflict as e:
+            return {'ok': False, 'error': 'conflict', 'conflicts': e.conflicts}
+        products = [{'id': product_id, 'quantity': quantity, 'version': version} for product_id, quantity, version in rows]
+        session = await self.sio.get_session(sid)
+        room = store_room(session['store'])
+        for product in products:
+            self.emit('inventory_updated', product, room)
+        return {'ok': True, 'products': products}
+
+    async def _sync_push(self, sid, data):
+        # A terminal's own changes; acked with the last seq applied
+        changes = data.get('changes') if isinstance(data, dict) else None
+        if not isinstance(changes, list) or len(changes) > SYNC_PAGE:
+            return {'ok': False, 'error': f"expected a 'changes' list of at most {SYNC_PAGE}"}
+        error = await self._sync_error(sid, data)
+        if error:
+            return {'ok': False, 'error': error}
+        session = await self.sio.get_session(sid)
+        try:
+            seq = await asyncio.to_thread(self._write, self.db.sync.apply, session['terminal'], changes, 'received')
+        except StoreError as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': True, 'seq': seq}
+
+    async def _sync_pull(self, sid, data):
+        after = data.get('after') if isinstance(data, dict) else None
+        if not _is_int(after) or after < 0:
+            return {'ok': False, 'error': "expected an integer 'after'"}
+        error = await self._sync_error(sid, data)
+        if error:
+            return {'ok': False, 'error': error}
+        session = await self.sio.get_session(sid)
+        try:
+            # after is everything the terminal has; older log can go
+            await asyncio.to_thread(self._write, self.db.sync.record_pull, session['terminal'], after)
+        except StoreError as e:
+            return {'ok': False, 'error': str(e)}
+        changes, last, more = await asyncio.to_thread(self.db.sync.changes_since, after, session['terminal'])
+        return {'ok': True, 'changes': changes, 'last': last, 'more': more}
+
+    def _write(self, call, *args):
+        # On a worker thread. Audit entries buffered meanwhile are written
+        # here too; a hub may have no UI tick to do it (see AuditLog.log)
+        try:
+            return call(*args)
+        finally:
+            try:
+                self.db.audit.flush()
+            except sqlite3.Error as e:
+                print(f"Audit log flush failed: {e}")
+
+    async def _sync_error(self, sid, data=None):
+        if not await asyncio.to_thread(self.db.sync.enabled):
+            return NOT_HOSTING
+        session = await self.sio.get_session(sid)
+        if not session['sync']:
+            return NOT_AUTHORIZED
+        # Only copies of the hub's database can sync with it; see migrate_13
+        if data is not None and data.get('database') != await asyncio.to_thread(self.db.sync.database_id):
+            return NOT_A_COPY
+
+    def _on_change(self, table, ids):
+        # Tell sync clients there is something new to pull
+        if table in SYNC_TABLES:
+            self.emit('sync_available', {'table': table})
+
+    async def _relay(self, sid, event, data):
+        session = await self.sio.get_session(sid)
+        await self.sio.emit(event, data, room=store_room(session['store']))
+
+    def emit(self, event, data, room=None):
+        # Safe from any thread; dropped when the server isn't running
+        loop = self.loop
+        if loop is None:
+            return
+        with self._lock:
+            self._pending.append((room or store_room(self.store), event, data))
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+        if schedule:
+            try:
+                loop.call_soon_threadsafe(self._schedule_flush)
+            except RuntimeError:
+                # Loop closed while shutting down
+                pass
+
+    def _schedule_flush(self):
+        self._flush_task = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        await asyncio.sleep(self.batch_interval)
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._flush_scheduled = False
+        rooms = {}
+        for room, event, data in pending:
+            rooms.setdefault(room, []).append([event, data])
+        for room, events in rooms.items():
+            if len(events) == 1:
+                await self.sio.emit(events[0][0], events[0][1], room=room)
+                continue
+            for start in range(0, len(events), BATCH_MAX):
+                await self.sio.emit('batch', events[start:start + BATCH_MAX], room=room)
+
+    def start(self, host=HOST, port=PORT):
+        if self._thread is None:
+            self._thread = threading.Thread(target=asyncio.run, args=(self._serve(host, port),), name='realtime', daemon=True)
+            self._thread.start()
+
+    async def _serve(self, host, port):
+        # Imported here so uvicorn loads off the UI thread
+        import uvicorn
+
+        self.loop = asyncio.get_running_loop()
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        try:
+            await self.server.serve()
+        finally:
+            self.loop = None
+
+    def stop(self, timeout=5):
+        if self.server is not None:
+            self.server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
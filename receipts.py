@@ -0,0 +1,328 @@
+import os
+
+from fpdf import FPDF, FPDF_VERSION
+
+from imagestore import ImageStore, IMAGE_DIR, PRINT_SIZE
+
+# PDF receipts and customer reports. The shop header (settings, logo
+# placement, alignment) is compiled once per distinct set of settings and the
+# parsed logo is reused across documents, so rendering a receipt is mostly
+# drawing its own rows. The logo is drawn from its print-size thumbnail.
+PAGE_WIDTH = 210  # A4 width in mm
+PAGE_HEIGHT = 297
+LOGO_SIZE = 30
+BATCH_SIZE = 500
+HEADER_SETTINGS = {
+    'shop_name': 'My Shop',
+    'shop_phone': '',
+    'shop_email': '',
+    'shop_location': '',
+    'greeting_message': 'Thank you for your purchase!',
+    'shop_logo': '',
+    'logo_horizontal': 'Left',
+    'logo_vertical': 'Top',
+    'shop_info_alignment': 'Center',
+}
+# PyFPDF 1.x appends every line of output to a str, copying the page or the
+# whole document each time; see StatementPDF
+BUFFER_OUTPUT = FPDF_VERSION.startswith('1.')
+
+
+class ShopTemplate:
+    def __init__(self, settings):
+        horizontal = settings['logo_horizontal']
+        vertical = settings['logo_vertical']
+        self.logo_x = {'Left': 10, 'Center': (PAGE_WIDTH - LOGO_SIZE) / 2, 'Right': PAGE_WIDTH - LOGO_SIZE - 10}.get(horizontal, 10)
+        self.logo_y = {'Top': 10, 'Middle': (PAGE_HEIGHT - LOGO_SIZE) / 2, 'Bottom': PAGE_HEIGHT - LOGO_SIZE - 10}.get(vertical, 10)
+        self.text_start_y = self.logo_y + 35 if vertical == "Top" else 10
+        self.align = {'Left': 'L', 'Center': 'C', 'Right': 'R'}.get(settings['shop_info_alignment'], 'C')
+        self.greeting = settings['greeting_message']
+
+        logo = settings['shop_logo']
+        self.logo = ImageStore(IMAGE_DIR).thumbnail(logo, PRINT_SIZE) if logo else None
+
+        contact = [settings['shop_name']]
+        if settings['shop_phone']:
+            contact.append(f"Phone: {settings['shop_phone']}")
+        if settings['shop_email']:
+            contact.append(f"Email: {settings['shop_email']}")
+        # Receipts always show the location line, reports only when it is set
+        self.receipt_header = contact + [f"Shop Location: {settings['shop_location']}"]
+        self.report_header = contact + ([f"Shop Location : {settings['shop_location']}"] if settings['shop_location'] else [])
+
+
+class OutputBuffer:
+    # Stands in for PyFPDF's document str while it is assembled: fpdf only
+    # appends to it with += and takes its len() for the xref offsets
+    def __init__(self, text):
+        self.parts = [text]
+        self.size = len(text)
+
+    def __iadd__(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        return self
+
+    def __len__(self):
+        return self.size
+
+    def text(self):
+        return "".join(self.parts)
+
+
+class StatementPDF(FPDF):
+    # Page contents and the document are collected in lists and joined once,
+    # so a long statement costs time in proportion to its length
+    _lines = None
+
+    # Statements can run to many pages; number them
+    def footer(self):
+        self.set_y(-15)
+        self.set_font("Arial", size=8)
+        self.cell(0, 10, txt=f"Page {self.page_no()}/{{nb}}", align='C')
+
+    def _beginpage(self, *args, **kwargs):
+        super()._beginpage(*args, **kwargs)
+        if BUFFER_OUTPUT:
+            self._lines = []
+
+    def _out(self, s):
+        if self._lines is not None and self.state == 2:
+            self._lines.append(s.decode('latin1') if isinstance(s, bytes) else str(s))
+        else:
+            super()._out(s)
+
+    def _endpage(self):
+        if self._lines is not None:
+            self.pages[self.page] += "".join(line + "\n" for line in self._lines)
+            self._lines = None
+        super()._endpage()
+
+    def _enddoc(self):
+        if not BUFFER_OUTPUT:
+            return super()._enddoc()
+        self.buffer = OutputBuffer(self.buffer)
+        try:
+            super()._enddoc()
+        finally:
+            self.buffer = self.buffer.text()
+
+
+class ReceiptRenderer:
+    def __init__(self, db):
+        self.db = db
+        self._settings_version = None
+        self._template = None
+        self._logos = {}
+
+    def template(self):
+        version = self.db.settings.version
+        if self._template is None or version != self._settings_version:
+            self._template = ShopTemplate(self.db.settings.get_many(HEADER_SETTINGS))
+            self._settings_version = self.db.settings.version
+        return self._template
+
+    def _draw_logo(self, pdf, template):
+        # PyFPDF parses an image once per document; hand later documents the
+        # already parsed copy so the file is not decoded again.
+        path = template.logo
+        key = (path, os.path.getmtime(path))
+        images = getattr(pdf, 'images', None)
+        if isinstance(images, dict) and key in self._logos and path not in images:
+            images[path] = dict(self._logos[key], i=len(images) + 1)
+        pdf.image(path, x=template.logo_x, y=template.logo_y, w=LOGO_SIZE)
+        if isinstance(images, dict) and path in images and key not in self._logos:
+            # Copy: output() drops the image data from the document's dict
+            self._logos = {key: dict(images[path])}
+
+    def _draw_header(self, pdf, template, lines):
+        pdf.add_page()
+        pdf.set_font("Arial", size=12)
+        if template.logo:
+            self._draw_logo(pdf, template)
+        pdf.set_xy(10, template.text_start_y)
+        for line in lines:
+            pdf.cell(200, 10, txt=line, ln=True, align=template.align)
+
+    def draw_receipt(self, pdf, template, sale_id, sale, items):
+        date, customer_name, total, discount, payment_method = sale
+        self._draw_header(pdf, template, template.receipt_header)
+        pdf.ln(10)
+
+        pdf.cell(200, 10, txt=f"Sale ID: {sale_id}", ln=True)
+        pdf.cell(200, 10, txt=f"Date: {date}", ln=True)
+        pdf.cell(200, 10, txt=f"Customer: {customer_name}", ln=True)
+        pdf.cell(200, 10, txt=f"Payment Method: {payment_method}", ln=True)
+        pdf.ln(10)
+
+        pdf.cell(80, 10, txt="Product", border=1)
+        pdf.cell(30, 10, txt="Quantity", border=1)
+        pdf.cell(30, 10, txt="Price", border=1)
+        pdf.cell(50, 10, txt="Subtotal", border=1)
+        pdf.ln()
+
+        for product, quantity, price in items:
+            pdf.cell(80, 10, txt=product, border=1)
+            pdf.cell(30, 10, txt=str(quantity), border=1)
+            pdf.cell(30, 10, txt=f"${price:.2f}", border=1)
+            pdf.cell(50, 10, txt=f"${quantity * price:.2f}", border=1)
+            pdf.ln()
+
+        pdf.ln(10)
+        subtotal = sum(quantity * price for product, quantity, price in items)
+        pdf.cell(140, 10, txt="Subtotal", border=1)
+        pdf.cell(50, 10, txt=f"${subtotal:.2f}", border=1)
+        pdf.ln()
+
+        if discount > 0:
+            pdf.cell(140, 10, txt=f"Discount ({discount}%)", border=1)
+            pdf.cell(50, 10, txt=f"-${subtotal * (discount / 100):.2f}", border=1)
+            pdf.ln()
+
+        pdf.cell(140, 10, txt="Total", border=1)
+        pdf.cell(50, 10, txt=f"${total:.2f}", border=1)
+        pdf.ln(20)
+
+        pdf.cell(200, 10, txt=template.greeting, ln=True, align='C')
+
+    def receipt(self, sale_id, path=None):
+        sale, items = self.db.sales.receipt(sale_id)
+        if not sale:
+            return None
+        pdf = FPDF()
+        self.draw_receipt(pdf, self.template(), sale_id, sale, items)
+        path = path or f"receipt_{sale_id}.pdf"
+        pdf.output(path)
+        return path
+
+    def _batches(self, sale_ids):
+        sale_ids = list(sale_ids)
+        for start in range(0, len(sale_ids), BATCH_SIZE):
+            batch = sale_ids[start:start + BATCH_SIZE]
+            receipts = self.db.sales.receipts(batch)
+            for sale_id in batch:
+                if sale_id in receipts:
+                    yield sale_id, receipts[sale_id]
+
+    def receipts(self, sale_ids, out):
+        # Many receipts, one page each, into a single PDF (path or binary file)
+        template = self.template()
+        pdf = FPDF()
+        count = 0
+        for sale_id, (sale, items) in self._batches(sale_ids):
+            self.draw_receipt(pdf, template, sale_id, sale, items)
+            count += 1
+        if count:
+            write_pdf(pdf, out)
+        return count
+
+    def iter_receipts(self, sale_ids):
+        # Yields (sale_id, pdf bytes) one receipt at a time
+        template = self.template()
+        for sale_id, (sale, items) in self._batches(sale_ids):
+            pdf = FPDF()
+            self.draw_receipt(pdf, template, sale_id, sale, items)
+            yield sale_id, pdf_bytes(pdf)
+
+    def customer_report(self, customer_id, name, phone, email, start=None, end=None, path=None):
+        rows = self.db.customers.statement(customer_id, start, end)
+        pdf = self._customer_report_pdf(name, phone, email, rows, start, end)
+        path = path or f"customer_report_{customer_id}.pdf"
+        pdf.output(path)
+        return path
+
+    def customer_report_bytes(self, customer_id, start=None, end=None):
+        customer = self.db.customers.get(customer_id)
+        if not customer:
+            return None
+        name, phone, email, points, notes = customer
+        rows = self.db.customers.statement(customer_id, start, end)
+        return pdf_bytes(self._customer_report_pdf(name, phone, email, rows, start, end))
+
+    def receipt_bytes(self, sale_id):
+        sale, items = self.db.sales.receipt(sale_id)
+        if not sale:
+            return None
+        pdf = FPDF()
+        self.draw_receipt(pdf, self.template(), sale_id, sale, items)
+        return pdf_bytes(pdf)
+
+    def _customer_report_pdf(self, name, phone, email, rows, start=None, end=None):
+        # rows come from CustomerStore.statement and are consumed as they stream
+        template = self.template()
+        pdf = StatementPDF()
+        pdf.alias_nb_pages()
+        self._draw_header(pdf, template, template.report_header)
+        pdf.ln(10)
+
+        pdf.cell(200, 10, txt=f"Customer: {name}", ln=True)
+        pdf.cell(200, 10, txt=f"Phone: {phone}", ln=True)
+        pdf.cell(200, 10, txt=f"Email: {email}", ln=True)
+        if start or end:
+            pdf.cell(200, 10, txt=f"Period: {start or 'first sale'} to {end or 'today'}", ln=True)
+        pdf.ln(10)
+
+        pdf.cell(200, 10, txt="Purchase History:", ln=True)
+        total_spent = 0
+        current = None
+        for sale_id, date, total, discount, subtotal, product, quantity, price in rows:
+            if current is None or sale_id != current[0]:
+                if current is not None:
+                    self._draw_sale_totals(pdf, *current[1:])
+                current = (sale_id, subtotal, discount, total)
+                total_spent += total
+                pdf.cell(200, 10, txt=f"Sale ID: {sale_id}   Date: {date}", ln=True)
+                self._draw_item_heading(pdf)
+            if quantity is None:
+                continue
+            if pdf.get_y() + 10 > pdf.h - pdf.b_margin:
+                # Repeat the column headings on the next page
+                pdf.add_page()
+                self._draw_item_heading(pdf)
+            pdf.cell(80, 10, txt=product, border=1)
+            pdf.cell(30, 10, txt=str(quantity), border=1)
+            pdf.cell(30, 10, txt=f"${price:.2f}", border=1)
+            pdf.cell(50, 10, txt=f"${quantity * price:.2f}", border=1)
+            pdf.ln()
+
+        if current is None:
+            pdf.cell(200, 10, txt="No purchase history", ln=True)
+        else:
+            self._draw_sale_totals(pdf, *current[1:])
+            pdf.ln(10)
+            pdf.cell(140, 10, txt="", ln=False)
+            pdf.cell(50, 10, txt=f"Total Spent: ${total_spent:.2f}", ln=True)
+
+        pdf.ln(20)
+        pdf.cell(200, 10, txt=template.greeting, ln=True, align='C')
+        return pdf
+
+    def _draw_item_heading(self, pdf):
+        pdf.cell(80, 10, txt="Product Name", border=1)
+        pdf.cell(30, 10, txt="Quantity", border=1)
+        pdf.cell(30, 10, txt="Price", border=1)
+        pdf.cell(50, 10, txt="Subtotal", border=1)
+        pdf.ln()
+
+    def _draw_sale_totals(self, pdf, subtotal, discount, total):
+        pdf.cell(140, 10, txt="", ln=False)
+        pdf.cell(50, 10, txt=f"Subtotal: ${subtotal:.2f}", ln=True)
+        if discount > 0:
+            pdf.cell(140, 10, txt="", ln=False)
+            pdf.cell(50, 10, txt=f"Discount ({discount}%): -${subtotal * (discount / 100):.2f}", ln=True)
+        pdf.cell(140, 10, txt="", ln=False)
+        pdf.cell(50, 10, txt=f"Total: ${total:.2f}", ln=True)
+        pdf.ln(10)
+
+def pdf_bytes(pdf):
+    # PyFPDF 1.x returns a latin-1 str, fpdf2 returns bytes
+    data = pdf.output(dest='S')
+    return data.encode('latin-1') if isinstance(data, str) else bytes(data)
+
+
+def write_pdf(pdf, out):
+    if isinstance(out, (str, os.PathLike)):
+        pdf.output(out)
+    else:
+        out.write(pdf_bytes(pdf))
+
@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+
+import cv2
+from PIL import Image
+from pyzbar.pyzbar import decode
+
+# Camera capture and barcode decoding off the Tk thread. The capture thread
+# keeps only the newest frame; the decode thread works on a downscaled
+# grayscale copy (falling back to a full-resolution centre crop now and then)
+# and publishes a ready-made PIL preview plus debounced barcode strings.
+DECODE_SCALE = 0.5
+ROI_EVERY = 5
+ROI_FRACTION = 0.6
+DEBOUNCE = 2.0
+PREVIEW_SIZE = (640, 480)
+
+
+class BarcodeScanner:
+    def __init__(self, source=0, scale=DECODE_SCALE, debounce=DEBOUNCE, preview_size=PREVIEW_SIZE):
+        # source: camera index, video file path, or an iterable of BGR frames
+        self.source = source
+        self.scale = scale
+        self.debounce = debounce
+        self.preview_size = preview_size
+        self.codes = queue.Queue()
+        self.error = None
+        self.finished = threading.Event()
+        self._frames = queue.Queue(maxsize=1)
+        self._captured = threading.Event()
+        self._stop = threading.Event()
+        self._preview_lock = threading.Lock()
+        self._preview = None
+        self._preview_id = 0
+        self._seen = {}
+        self._threads = []
+
+    def start(self):
+        if isinstance(self.source, (int, str)):
+            cap = cv2.VideoCapture(self.source)
+            if not cap.isOpened():
+                raise RuntimeError("Could not access camera")
+            frames = self._capture_frames(cap)
+        else:
+            frames = iter(self.source)
+        self._threads = [
+            threading.Thread(target=self._capture, args=(frames,), name='barcode-capture', daemon=True),
+            threading.Thread(target=self._decode, name='barcode-decode', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=2):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def preview(self, last_id=0):
+        # Returns (preview_id, image); image is None when nothing newer than last_id
+        with self._preview_lock:
+            if self._preview_id == last_id:
+                return last_id, None
+            return self._preview_id, self._preview
+
+    def _capture_frames(self, cap):
+        # Video files are paced at their own frame rate, cameras at theirs
+        delay = 0
+        if isinstance(self.source, str):
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            delay = 1 / fps if fps else 0
+        try:
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if delay:
+                        return
+                    raise RuntimeError("Failed to capture frame")
+                yield frame
+                if delay:
+                    time.sleep(delay)
+        finally:
+            cap.release()
+
+    def _capture(self, frames):
+        try:
+            for frame in frames:
+                if self._stop.is_set():
+                    break
+                # Drop the frame the decoder has not picked up yet
+                try:
+                    self._frames.get_nowait()
+                except queue.Empty:
+                    pass
+                self._frames.put_nowait(frame)
+        except Exception as e:
+            self.error = e
+        finally:
+            if hasattr(frames, 'close'):
+                frames.close()
+            self._captured.set()
+
+    def _decode(self):
+        count = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    frame = self._frames.get(timeout=0.1)
+                except queue.Empty:
+                    if self._captured.is_set():
+                        break
+                    continue
+                count += 1
+                barcodes = self.find_barcodes(frame, use_roi=count % ROI_EVERY == 0)
+                now = time.monotonic()
+                for data, rect in barcodes:
+                    if now - self._seen.get(data, -self.debounce) >= self.debounce:
+                        self.codes.put(data)
+                    self._seen[data] = now
+                    x, y, w, h = rect
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                rgb = cv2.cvtColor(cv2.resize(frame, self.preview_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+                image = Image.fromarray(rgb)
+                with self._preview_lock:
+                    self._preview = image
+                    self._preview_id += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished.set()
+
+    def find_barcodes(self, frame, use_roi=False):
+        # Returns [(data, (x, y, w, h))] in full-frame coordinates
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        found = [(barcode, 1 / self.scale, 0, 0) for barcode in decode(small)]
+        if not found and use_roi:
+            # Small or dense codes can vanish when downscaled
+            height, width = gray.shape
+            roi_w, roi_h = int(width * ROI_FRACTION), int(height * ROI_FRACTION)
+            left, top = (width - roi_w) // 2, (height - roi_h) // 2
+            roi = gray[top:top + roi_h, left:left + roi_w]
+            found = [(barcode, 1, left, top) for barcode in decode(roi)]
+        results = []
+        for barcode, factor, left, top in found:
+            x, y, w, h = barcode.rect
+            rect = (int(x * factor) + left, int(y * factor) + top, int(w * factor), int(h * factor))
+            results.append((barcode.data.decode("utf-8"), rect))
+        return results
+
+
+# Decode a video file or camera without the UI: python scanner.py [source]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print barcodes decoded from a camera or video file")
+    parser.add_argument('source', nargs='?', default='0', help="camera index or video file")
+    args = parser.parse_args()
+    scanner = BarcodeScanner(int(args.source) if args.source.isdigit() else args.source)
+    scanner.start()
+    try:
+        while not scanner.finished.is_set() or not scanner.codes.empty():
+            try:
+                print(scanner.codes.get(timeout=0.1))
+            except queue.Empty:
+                pass
+    except KeyboardInterrupt:
+        pass
+    scanner.stop()
+    if scanner.error:
+        print(f"Error: {scanner.error}")
@@ -0,0 +1,1875 @@
+import sqlite3
+import datetime
+import json
+import secrets
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Database Setup
+DB_PATH = 'shop.db'
+
+# Connection tuning: WAL lets the UI thread and the realtime server read while
+# a sale commits; NORMAL sync is durable under WAL except on power loss.
+BUSY_TIMEOUT = 5.0
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+]
+
+# Create tables
+tables = [
+    '''CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        quantity INTEGER NOT NULL CHECK(quantity >= 0),
+        price REAL NOT NULL CHECK(price >= 0),
+        supplier_id INTEGER,
+        min_stock INTEGER NOT NULL DEFAULT 5 CHECK(min_stock >= 0),
+        image_path TEXT,
+        barcode TEXT,
+        discount REAL DEFAULT 0 CHECK(discount >= 0 AND discount <= 100),
+        FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT,
+        email TEXT,
+        loyalty_points INTEGER DEFAULT 0 CHECK(loyalty_points >= 0),
+        notes TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        full_name TEXT,
+        email TEXT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL CHECK(role IN ('staff', 'admin')) DEFAULT 'staff'
+    )''',
+    '''CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        total REAL NOT NULL CHECK(total >= 0),
+        discount REAL DEFAULT 0 CHECK(discount >= 0 AND discount <= 100),
+        payment_method TEXT,
+        FOREIGN KEY (customer_id) REFERENCES customers(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS sale_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sale_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK(quantity > 0),
+        price REAL NOT NULL CHECK(price >= 0),
+        FOREIGN KEY (sale_id) REFERENCES sales(id),
+        FOREIGN KEY (product_id) REFERENCES products(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS suppliers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        contact TEXT,
+        email TEXT,
+        products TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        amount REAL NOT NULL CHECK(amount >= 0),
+        description TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS purchase_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        supplier_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('Pending', 'Completed', 'Cancelled')),
+        FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS purchase_order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        po_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK(quantity > 0),
+        FOREIGN KEY (po_id) REFERENCES purchase_orders(id),
+        FOREIGN KEY (product_id) REFERENCES products(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS audit_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        user TEXT NOT NULL,
+        action TEXT NOT NULL,
+        details TEXT
+    )'''
+]
+
+
+class StoreError(Exception):
+    pass
+
+
+class InsufficientStock(StoreError):
+    def __init__(self, shortages):
+        # shortages are (product_id, name, available, requested)
+        self.shortages = shortages
+        lines = [f"{name or f'Product ID {product_id}'}: {available} available, {requested} requested"
+                 for product_id, name, available, requested in shortages]
+        super().__init__("Insufficient stock:\n" + "\n".join(lines))
+
+
+class InventoryConflict(StoreError):
+    def __init__(self, conflicts):
+        # conflicts are dicts with id, reason and the current quantity/version
+        self.conflicts = conflicts
+        super().__init__("Inventory update rejected: " + ", ".join(f"{c['id']} ({c['reason']})" for c in conflicts))
+
+
+# Dashboard summaries: running totals kept in the same transaction as the
+# writes that change them, so the dashboard reads a handful of rows no matter
+# how much history there is. rebuild_summaries() recomputes them from scratch.
+def bump_stat(conn, key, amount):
+    conn.execute("INSERT INTO dashboard_stats (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = value + excluded.value", (key, amount))
+
+
+def rebuild_summaries(conn):
+    conn.execute("DELETE FROM dashboard_stats")
+    conn.execute("""INSERT INTO dashboard_stats (key, value)
+        SELECT 'products', COUNT(*) FROM products
+        UNION ALL SELECT 'customers', COUNT(*) FROM customers
+        UNION ALL SELECT 'sales', COUNT(*) FROM sales
+        UNION ALL SELECT 'revenue', COALESCE(SUM(total), 0) FROM sales
+        UNION ALL SELECT 'expenses', COALESCE(SUM(amount), 0) FROM expenses""")
+    conn.execute("DELETE FROM daily_sales")
+    conn.execute("INSERT INTO daily_sales (date, sales_count, revenue) SELECT date, COUNT(*), SUM(total) FROM sales GROUP BY date")
+    conn.execute("DELETE FROM product_sales")
+    conn.execute("INSERT INTO product_sales (product_id, units_sold) SELECT product_id, SUM(quantity) FROM sale_items GROUP BY product_id")
+    if 'sales_rollup' in [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]:
+        rebuild_rollup(conn)
+
+
+# Report rollup, kept up to date by triggers so sales, returns and synced
+# changes all land in it. 'item' rows are one per day, product, category and
+# customer; 'day', 'category' and 'customer' rows are the same figures summed
+# down to that dimension so reports over years read a few thousand rows.
+# Revenue is after the sale's discount; later changes to a sale's total
+# (returns) are booked against product 0 with an empty category.
+ROLLUP_GRAINS = "SELECT 'item' AS grain UNION ALL SELECT 'day' UNION ALL SELECT 'category' UNION ALL SELECT 'customer'"
+
+
+def rebuild_rollup(conn):
+    conn.execute("DELETE FROM sales_rollup")
+    conn.execute("""INSERT INTO sales_rollup (grain, day, product_id, category, customer_id, units, amount, revenue)
+        SELECT 'item', s.date, si.product_id, COALESCE(p.category, ''), s.customer_id, SUM(si.quantity), SUM(si.quantity * si.price),
+               SUM(si.quantity * si.price * (1 - COALESCE(s.discount, 0) / 100.0))
+        FROM sale_items si JOIN sales s ON s.id = si.sale_id LEFT JOIN products p ON p.id = si.product_id
+        GROUP BY s.date, si.product_id, COALESCE(p.category, ''), s.customer_id""")
+    conn.execute("""INSERT INTO sales_rollup (grain, day, product_id, category, customer_id, revenue)
+        SELECT 'item', s.date, 0, '', s.customer_id, SUM(s.total - COALESCE(i.amount, 0) * (1 - COALESCE(s.discount, 0) / 100.0)) AS adjustment
+        FROM sales s LEFT JOIN (SELECT sale_id, SUM(quantity * price) AS amount FROM sale_items GROUP BY sale_id) i ON i.sale_id = s.id
+        GROUP BY s.date, s.customer_id
+        HAVING ABS(adjustment) > 0.005""")
+    conn.execute("""INSERT INTO sales_rollup (grain, day, units, amount, revenue)
+        SELECT 'day', day, SUM(units), SUM(amount), SUM(revenue) FROM sales_rollup WHERE grain = 'item' GROUP BY day""")
+    conn.execute("""INSERT INTO sales_rollup (grain, day, category, units, amount, revenue)
+        SELECT 'category', day, category, SUM(units), SUM(amount), SUM(revenue) FROM sales_rollup
+        WHERE grain = 'item' AND product_id != 0 GROUP BY day, category""")
+    conn.execute("""INSERT INTO sales_rollup (grain, day, customer_id, units, amount, revenue)
+        SELECT 'customer', day, customer_id, SUM(units), SUM(amount), SUM(revenue) FROM sales_rollup
+        WHERE grain = 'item' GROUP BY day, customer_id""")
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+# Schema migrations, applied in order and tracked in PRAGMA user_version.
+# Append new steps to MIGRATIONS; never edit one that has shipped.
+def migrate_1_baseline(conn):
+    for table in tables:
+        conn.execute(table)
+
+    # Databases created before versioning may lack these columns
+    columns = _columns(conn, 'products')
+    if 'image_path' not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN image_path TEXT")
+    if 'barcode' not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN barcode TEXT")
+    if 'discount' not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN discount REAL DEFAULT 0 CHECK(discount >= 0 AND discount <= 100)")
+
+    if 'notes' not in _columns(conn, 'customers'):
+        conn.execute("ALTER TABLE customers ADD COLUMN notes TEXT")
+
+    columns = _columns(conn, 'users')
+    if 'full_name' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN full_name TEXT")
+    if 'email' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN email TEXT")
+
+    if 'payment_method' not in _columns(conn, 'sales'):
+        conn.execute("ALTER TABLE sales ADD COLUMN payment_method TEXT")
+
+
+def migrate_2_indexes(conn):
+    # Blank barcodes become NULL so the unique index only covers real codes
+    conn.execute("UPDATE products SET barcode = NULL WHERE TRIM(barcode) = ''")
+    # A duplicated code stays on its oldest product; the others lose it, and
+    # the audit log says which, so they can be re-labelled from Products
+    duplicates = conn.execute("""
+        SELECT p.id, p.barcode, (SELECT MIN(id) FROM products WHERE barcode = p.barcode)
+        FROM products p
+        WHERE p.barcode IS NOT NULL AND p.id > (SELECT MIN(id) FROM products WHERE barcode = p.barcode)
+        ORDER BY p.id
+    """).fetchall()
+    now = datetime.datetime.now().isoformat()
+    conn.executemany("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?, 'system', 'Upgrade', ?)",
+                     [(now, f"Cleared duplicate barcode {barcode} from product ID {product_id} (kept on product ID {kept})")
+                      for product_id, barcode, kept in duplicates])
+    conn.executemany("UPDATE products SET barcode = NULL WHERE id = ?", [(product_id,) for product_id, barcode, kept in duplicates])
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer_id ON sales(customer_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items(sale_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_product_id ON sale_items(product_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchase_order_items_po_id ON purchase_order_items(po_id)")
+
+
+def migrate_3_product_search(conn):
+    # Trigram full-text index over the searchable product fields, keyed by
+    # products.id and kept in sync by triggers. Stock updates don't fire them.
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(name, category, supplier, barcode, tokenize='trigram')")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name, category, supplier, barcode)
+        VALUES (new.id, new.name, new.category, (SELECT name FROM suppliers WHERE id = new.supplier_id), new.barcode);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, category, supplier_id, barcode ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+        INSERT INTO products_fts (rowid, name, category, supplier, barcode)
+        VALUES (new.id, new.name, new.category, (SELECT name FROM suppliers WHERE id = new.supplier_id), new.barcode);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS suppliers_fts_update AFTER UPDATE OF name ON suppliers BEGIN
+        UPDATE products_fts SET supplier = new.name WHERE rowid IN (SELECT id FROM products WHERE supplier_id = new.id);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS suppliers_fts_delete AFTER DELETE ON suppliers BEGIN
+        UPDATE products_fts SET supplier = NULL WHERE rowid IN (SELECT id FROM products WHERE supplier_id = old.id);
+    END""")
+    conn.execute("DELETE FROM products_fts")
+    conn.execute("""INSERT INTO products_fts (rowid, name, category, supplier, barcode)
+        SELECT p.id, p.name, p.category, s.name, p.barcode FROM products p LEFT JOIN suppliers s ON p.supplier_id = s.id""")
+
+
+def migrate_4_dashboard_summaries(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS dashboard_stats (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL DEFAULT 0
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS daily_sales (
+        date TEXT PRIMARY KEY,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS product_sales (
+        product_id INTEGER PRIMARY KEY,
+        units_sold INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_units ON product_sales(units_sold)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_low_stock ON products(id) WHERE quantity < min_stock")
+    rebuild_summaries(conn)
+
+
+def migrate_5_email_outbox(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL DEFAULT 'email',
+        dedupe_key TEXT,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'sent', 'failed')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        next_attempt REAL NOT NULL,
+        sent_at REAL,
+        last_error TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_dedupe ON email_outbox(dedupe_key, created_at)")
+
+
+def migrate_6_customer_statement_index(conn):
+    # Statements filter by customer and date range and stream in date order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer_date ON sales(customer_id, date)")
+    conn.execute("DROP INDEX IF EXISTS idx_sales_customer_id")
+
+
+def migrate_7_product_versions(conn):
+    # Every stock change bumps the row version so remote terminals can send
+    # updates against the version they last saw
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(products)")]
+    if 'version' not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS products_version AFTER UPDATE OF quantity ON products
+        WHEN new.quantity IS NOT old.quantity BEGIN
+            UPDATE products SET version = old.version + 1 WHERE id = new.id;
+        END""")
+
+
+# Multi-terminal sync. Replicated rows carry a uid that is the same on every
+# terminal, and triggers append each change to change_log for the terminals
+# to exchange. Plain columns are copied (last writer wins), counters travel
+# as deltas so concurrent stock and points changes add up, and references are
+# sent as the referenced row's uid (suppliers, not replicated, by name).
+SYNC_TABLES = {
+    'products': (('name', 'category', 'price', 'min_stock', 'barcode', 'image_path', 'discount'), ('quantity',),
+                 {'supplier_id': ('suppliers', 'name')}),
+    'customers': (('name', 'phone', 'email', 'notes'), ('loyalty_points',), {}),
+    'sales': (('date', 'discount', 'payment_method'), ('total',), {'customer_id': ('customers', 'uid')}),
+    'sale_items': (('quantity', 'price'), (), {'sale_id': ('sales', 'uid'), 'product_id': ('products', 'uid')}),
+}
+SYNC_OPS = ('insert', 'update', 'add', 'delete')
+
+
+def _sync_json(table, row, counters=True):
+    fields, counter_columns, refs = SYNC_TABLES[table]
+    parts = [f"'{column}', {row}.{column}" for column in fields + (counter_columns if counters else ())]
+    parts += [f"'{column}', (SELECT {key} FROM {ref} WHERE id = {row}.{column})" for column, (ref, key) in refs.items()]
+    return "json_object(" + ", ".join(parts) + ")"
+
+
+def migrate_8_sync_log(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        uid TEXT NOT NULL,
+        op TEXT NOT NULL CHECK(op IN ('insert', 'update', 'add', 'delete')),
+        data TEXT,
+        origin TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_log_origin ON change_log(origin, seq)")
+    # origin is set while another terminal's changes are applied, so they are
+    # logged as theirs and never sent back
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_state (id INTEGER PRIMARY KEY CHECK(id = 1), origin TEXT)")
+    conn.execute("INSERT OR IGNORE INTO sync_state (id) VALUES (1)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS sync_cursors (
+        peer TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        PRIMARY KEY (peer, kind)
+    )""")
+    for table in SYNC_TABLES:
+        if 'uid' not in _columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN uid TEXT")
+        # Existing rows get id-based uids so terminals set up from copies of
+        # the same database agree on them
+        conn.execute(f"UPDATE {table} SET uid = 'legacy-' || id WHERE uid IS NULL")
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_uid ON {table}(uid)")
+    create_sync_triggers(conn)
+
+
+def create_sync_triggers(conn):
+    origin = "(SELECT origin FROM sync_state)"
+    for table, (fields, counters, refs) in SYNC_TABLES.items():
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} BEGIN
+            UPDATE {table} SET uid = lower(hex(randomblob(16))) WHERE id = new.id AND uid IS NULL;
+            INSERT INTO change_log (tbl, uid, op, data, origin)
+            SELECT '{table}', uid, 'insert', {_sync_json(table, 'new')}, {origin} FROM {table} WHERE id = new.id;
+        END""")
+        columns = fields + tuple(refs)
+        changed = " OR ".join(f"new.{column} IS NOT old.{column}" for column in columns)
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE OF {', '.join(columns)} ON {table}
+            WHEN {changed} BEGIN
+            INSERT INTO change_log (tbl, uid, op, data, origin)
+            VALUES ('{table}', new.uid, 'update', {_sync_json(table, 'new', counters=False)}, {origin});
+        END""")
+        for column in counters:
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_{column} AFTER UPDATE OF {column} ON {table}
+                WHEN new.{column} IS NOT old.{column} BEGIN
+                INSERT INTO change_log (tbl, uid, op, data, origin)
+                VALUES ('{table}', new.uid, 'add', json_object('{column}', new.{column} - old.{column}), {origin});
+            END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO change_log (tbl, uid, op, data, origin) VALUES ('{table}', old.uid, 'delete', NULL, {origin});
+        END""")
+
+
+def drop_sync_triggers(conn):
+    for table, (fields, counters, refs) in SYNC_TABLES.items():
+        for name in ('insert', 'update', 'delete') + counters:
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_sync_{name}")
+
+
+def migrate_9_sales_rollup(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS sales_rollup (
+        grain TEXT NOT NULL,
+        day TEXT NOT NULL,
+        product_id INTEGER NOT NULL DEFAULT 0,
+        category TEXT NOT NULL DEFAULT '',
+        customer_id INTEGER NOT NULL DEFAULT 0,
+        units INTEGER NOT NULL DEFAULT 0,
+        amount REAL NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (grain, day, product_id, category, customer_id)
+    ) WITHOUT ROWID""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS sales_rollup_item AFTER INSERT ON sale_items BEGIN
+        INSERT INTO sales_rollup (grain, day, product_id, category, customer_id, units, amount, revenue)
+        SELECT g.grain, s.date,
+               CASE WHEN g.grain = 'item' THEN new.product_id ELSE 0 END,
+               CASE WHEN g.grain IN ('item', 'category') THEN COALESCE(p.category, '') ELSE '' END,
+               CASE WHEN g.grain IN ('item', 'customer') THEN s.customer_id ELSE 0 END,
+               new.quantity, new.quantity * new.price, new.quantity * new.price * (1 - COALESCE(s.discount, 0) / 100.0)
+        FROM sales s LEFT JOIN products p ON p.id = new.product_id JOIN ({ROLLUP_GRAINS}) g
+        WHERE s.id = new.sale_id
+        ON CONFLICT (grain, day, product_id, category, customer_id) DO UPDATE SET
+            units = units + excluded.units, amount = amount + excluded.amount, revenue = revenue + excluded.revenue;
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS sales_rollup_total AFTER UPDATE OF total ON sales WHEN new.total IS NOT old.total BEGIN
+        INSERT INTO sales_rollup (grain, day, customer_id, revenue)
+        SELECT g.grain, new.date, CASE WHEN g.grain = 'day' THEN 0 ELSE new.customer_id END, new.total - old.total
+        FROM (SELECT 'item' AS grain UNION ALL SELECT 'day' UNION ALL SELECT 'customer') g WHERE true
+        ON CONFLICT (grain, day, product_id, category, customer_id) DO UPDATE SET revenue = revenue + excluded.revenue;
+    END""")
+    rebuild_rollup(conn)
+
+
+def migrate_10_audit_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp ON audit_logs(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_user ON audit_logs(user, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_action ON audit_logs(action, timestamp)")
+
+
+def migrate_11_audit_archive(conn):
+    # How much of each monthly audit archive file is committed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS audit_archive (
+            month TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            entries INTEGER NOT NULL,
+            first TEXT NOT NULL,
+            last TEXT NOT NULL
+        )
+    """)
+
+
+def migrate_12_sync_conflicts(conn):
+    # Incoming changes that couldn't be applied here (a clashing barcode, a
+    # row or reference that doesn't exist), kept instead of dropped
+    conn.execute("""CREATE TABLE IF NOT EXISTS sync_conflicts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        origin TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        tbl TEXT NOT NULL,
+        uid TEXT NOT NULL,
+        op TEXT NOT NULL,
+        data TEXT,
+        reason TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )""")
+
+
+def migrate_13_database_id(conn):
+    # Copies of the hub's database share its id. One created on its own has
+    # the same 'legacy-' uids for different rows, so it must not sync.
+    if 'database_id' not in _columns(conn, 'sync_state'):
+        conn.execute("ALTER TABLE sync_state ADD COLUMN database_id TEXT")
+    # Terminals that joined before ids existed take the hub's on their next sync
+    conn.execute("""UPDATE sync_state SET database_id = lower(hex(randomblob(16)))
+        WHERE database_id IS NULL AND NOT EXISTS (SELECT 1 FROM sync_cursors WHERE peer = 'hub' AND kind = 'pulled')""")
+
+
+def migrate_14_sync_opt_in(conn):
+    # The log triggers filled change_log on every till, syncing or not. Now
+    # SyncStore.host() and join() install them; databases already syncing
+    # (any cursor: a joined terminal, or a hub that took pushes) keep theirs.
+    # pruned is the hub's log floor; see SyncStore.record_pull.
+    columns = _columns(conn, 'sync_state')
+    if 'enabled' not in columns:
+        conn.execute("ALTER TABLE sync_state ADD COLUMN enabled INTEGER NOT NULL DEFAULT 0")
+    if 'pruned' not in columns:
+        conn.execute("ALTER TABLE sync_state ADD COLUMN pruned INTEGER NOT NULL DEFAULT 0")
+    conn.execute("UPDATE sync_state SET enabled = 1 WHERE EXISTS (SELECT 1 FROM sync_cursors)")
+    # A hub prunes its log below every terminal's pull cursor, which it only
+    # records from now on; the terminals it knows of hold the log until they pull
+    conn.execute("INSERT OR IGNORE INTO sync_cursors (peer, kind, seq) SELECT peer, 'pulled', 0 FROM sync_cursors WHERE kind = 'received'")
+    if not conn.execute("SELECT enabled FROM sync_state").fetchone()[0]:
+        drop_sync_triggers(conn)
+        conn.execute("DELETE FROM change_log")
+
+
+MIGRATIONS = [
+    migrate_1_baseline,
+    migrate_2_indexes,
+    migrate_3_product_search,
+    migrate_4_dashboard_summaries,
+    migrate_5_email_outbox,
+    migrate_6_customer_statement_index,
+    migrate_7_product_versions,
+    migrate_8_sync_log,
+    migrate_9_sales_rollup,
+    migrate_10_audit_indexes,
+    migrate_11_audit_archive,
+    migrate_12_sync_conflicts,
+    migrate_13_database_id,
+    migrate_14_sync_opt_in,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db(conn):
+    version = schema_version(conn)
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# In-process change notifications. Write paths publish the table and row ids
+# they touched; the UI drains the bus on its own thread and refreshes only
+# those rows. ids=None means "anything in this table may have changed".
+class ChangeBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        # callback(table, ids) runs on the publishing thread
+        self._subscribers.append(callback)
+
+    def publish(self, table, ids=None):
+        with self._lock:
+            if ids is None:
+                self._pending[table] = None
+            elif table not in self._pending:
+                self._pending[table] = set(ids)
+            elif self._pending[table] is not None:
+                self._pending[table].update(ids)
+        for callback in self._subscribers:
+            callback(table, ids)
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+
+def _placeholders(ids):
+    return ", ".join("?" * len(ids))
+
+
+PAGE_SIZE = 200
+
+
+def _fts_query(term):
+    # Every word must appear as a substring; the trigram tokenizer needs at
+    # least three characters, so shorter words return None (use LIKE instead).
+    words = term.split()
+    if not words or any(len(word) < 3 for word in words):
+        return None
+    return " AND ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def _keyset_page(conn, columns, source, id_expr, sort_expr, after, descending, limit, where=None, params=()):
+    # Keyset pagination: after is the (sort value, id) of the last row already
+    # shown, so each page is an index range scan instead of an OFFSET skip.
+    # Returns the rows and the cursor for the next page (None when exhausted).
+    op, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+    clauses = [where] if where else []
+    args = list(params)
+    if after is not None:
+        if sort_expr == id_expr:
+            clauses.append(f"{id_expr} {op} ?")
+            args.append(after[1])
+        else:
+            clauses.append(f"({sort_expr}, {id_expr}) {op} (?, ?)")
+            args += after
+    sql = f"SELECT {columns}, {sort_expr} FROM {source}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(f"({clause})" for clause in clauses)
+    if sort_expr == id_expr:
+        sql += f" ORDER BY {id_expr} {direction} LIMIT ?"
+    else:
+        sql += f" ORDER BY {sort_expr} {direction}, {id_expr} {direction} LIMIT ?"
+    rows = conn.execute(sql, args + [limit]).fetchall()
+    next_after = (rows[-1][-1], rows[-1][0]) if len(rows) == limit else None
+    return [row[:-1] for row in rows], next_after
+
+
+# Data access layer: every query lives here and returns plain rows so the
+# UI only renders results and the same paths can run headless.
+class ProductStore:
+    COLUMNS = "p.id, p.name, p.category, p.quantity, p.price, p.min_stock, s.name, p.barcode, p.image_path, p.discount"
+    SOURCE = "products p LEFT JOIN suppliers s ON p.supplier_id = s.id"
+    SORT_COLUMNS = {
+        'id': "p.id",
+        'name': "p.name",
+        'category': "p.category",
+        'quantity': "p.quantity",
+        'price': "p.price",
+        'min_stock': "p.min_stock",
+        'supplier': "COALESCE(s.name, '')",
+        'barcode': "COALESCE(p.barcode, '')",
+        'image': "COALESCE(p.image_path, '')",
+        'discount': "COALESCE(p.discount, 0)",
+    }
+
+    def __init__(self, db):
+        self.db = db
+
+    def page(self, after=None, sort='id', descending=False, limit=PAGE_SIZE, term=''):
+        term = term.strip()
+        query = _fts_query(term)
+        if query and sort == 'id' and not descending:
+            return self.ranked_search(query, after, limit)
+        where, params = None, ()
+        if query:
+            where, params = "p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)", (query,)
+        elif term:
+            where = "LOWER(p.name) LIKE ? OR LOWER(p.barcode) LIKE ? OR LOWER(p.category) LIKE ? OR LOWER(s.name) LIKE ?"
+            params = (f"%{term.lower()}%",) * 4
+        return _keyset_page(self.db.conn, self.COLUMNS, self.SOURCE, "p.id", self.SORT_COLUMNS[sort],
+                            after, descending, limit, where, params)
+
+    def ranked_search(self, query, after=None, limit=PAGE_SIZE):
+        # Best matches first (bm25 with name weighted highest). Result sets are
+        # small, so the cursor is a plain offset.
+        offset = after[1] if after else 0
+        rows = self.db.conn.execute(f"""SELECT {self.COLUMNS} FROM (
+                SELECT rowid AS id, bm25(products_fts, 10.0, 2.0, 2.0, 5.0) AS score FROM products_fts
+                WHERE products_fts MATCH ? ORDER BY score, rowid LIMIT ? OFFSET ?
+            ) m JOIN products p ON p.id = m.id LEFT JOIN suppliers s ON p.supplier_id = s.id
+            ORDER BY m.score, m.id""", (query, limit, offset)).fetchall()
+        next_after = ('offset', offset + len(rows)) if len(rows) == limit else None
+        return rows, next_after
+
+    def rows(self, ids):
+        ids = list(ids)
+        return self.db.conn.execute(f"SELECT {self.COLUMNS} FROM {self.SOURCE} WHERE p.id IN ({_placeholders(ids)})", ids).fetchall()
+
+    def names(self):
+        return [row[0] for row in self.db.conn.execute("SELECT name FROM products")]
+
+    def count(self):
+        return self.db.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def low_stock(self):
+        return self.db.conn.execute("SELECT id, name, quantity, min_stock FROM products WHERE quantity < min_stock").fetchall()
+
+    def add(self, name, category, quantity, price, min_stock, supplier_id, barcode, image_path, discount):
+        barcode = barcode or None
+        with self.db.conn:
+            cur = self.db.conn.execute("INSERT INTO products (name, category, quantity, price, min_stock, supplier_id, barcode, image_path, discount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       (name, category, quantity, price, min_stock, supplier_id, barcode, image_path, discount))
+            bump_stat(self.db.conn, 'products', 1)
+        self.db.changes.publish('products', [cur.lastrowid])
+        return cur.lastrowid
+
+    def update(self, product_id, name, category, quantity, price, min_stock, supplier_id, barcode, image_path, discount):
+        barcode = barcode or None
+        with self.db.conn:
+            self.db.conn.execute("UPDATE products SET name=?, category=?, quantity=?, price=?, min_stock=?, supplier_id=?, barcode=?, image_path=?, discount=? WHERE id=?",
+                                 (name, category, quantity, price, min_stock, supplier_id, barcode, image_path, discount, product_id))
+            row = self.db.conn.execute("SELECT id, quantity, version FROM products WHERE id=?", (product_id,)).fetchone()
+        self.db.changes.publish('products', [product_id])
+        # The resulting (id, quantity, version), as apply_inventory returns
+        return row
+
+    def apply_inventory(self, updates):
+        # updates are (product_id, delta, quantity, version): a delta or an
+        # absolute quantity, optionally checked against the version the client
+        # last saw. All apply in one transaction or none do; returns the
+        # resulting (id, quantity, version) rows.
+        if not updates:
+            return []
+        conn = self.db.conn
+        ids = [update[0] for update in updates]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = {row[0]: row[1:] for row in conn.execute(
+                f"SELECT id, quantity, version FROM products WHERE id IN ({_placeholders(ids)})", ids)}
+            conflicts = []
+            changes = []
+            for product_id, delta, quantity, version in updates:
+                if product_id not in current:
+                    conflicts.append({'id': product_id, 'reason': 'not found', 'quantity': None, 'version': None})
+                    continue
+                stock, stock_version = current[product_id]
+                new_quantity = stock + delta if delta is not None else quantity
+                if version is not None and version != stock_version:
+                    reason = 'version'
+                elif new_quantity < 0:
+                    reason = 'insufficient stock'
+                else:
+                    changes.append((new_quantity, product_id))
+                    continue
+                conflicts.append({'id': product_id, 'reason': reason, 'quantity': stock, 'version': stock_version})
+            if conflicts:
+                raise InventoryConflict(conflicts)
+            conn.executemany("UPDATE products SET quantity=? WHERE id=?", changes)
+            rows = conn.execute(f"SELECT id, quantity, version FROM products WHERE id IN ({_placeholders(ids)})", ids).fetchall()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self.db.changes.publish('products', ids)
+        return rows
+
+    def delete(self, product_id):
+        with self.db.conn:
+            cur = self.db.conn.execute("DELETE FROM products WHERE id=?", (product_id,))
+            bump_stat(self.db.conn, 'products', -cur.rowcount)
+        self.db.changes.publish('products', [product_id])
+
+
+class CatalogItem:
+    __slots__ = ('id', 'name', 'quantity', 'price', 'discount', 'barcode')
+
+    def __init__(self, id, name, quantity, price, discount, barcode):
+        self.id = id
+        self.name = name
+        self.quantity = quantity
+        self.price = price
+        self.discount = discount
+        self.barcode = barcode
+
+
+class ProductCatalog:
+    # Checkout lookups (name, barcode, id) served from memory. Our own writes
+    # invalidate single rows through the change bus; writes from other
+    # connections invalidate everything via Database.external_change.
+    COLUMNS = "id, name, quantity, price, discount, barcode"
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_name = {}
+        self._by_barcode = {}
+        self._names = []
+        self._loaded = False
+        self._stale = set()
+        self.version = 0
+        db.changes.subscribe(self._on_change)
+
+    def _on_change(self, table, ids):
+        if table == 'products':
+            self.invalidate(ids)
+        elif table == 'suppliers' and ids is None:
+            self.invalidate()
+
+    def invalidate(self, ids=None):
+        with self._lock:
+            if ids is None:
+                self._loaded = False
+                self._stale.clear()
+            else:
+                self._stale.update(ids)
+
+    def _sync(self):
+        with self._lock:
+            loaded, self._loaded = self._loaded, True
+            stale, self._stale = self._stale, set()
+        if not loaded:
+            rows = self.db.conn.execute(f"SELECT {self.COLUMNS} FROM products ORDER BY id").fetchall()
+            by_id = {row[0]: CatalogItem(*row) for row in rows}
+        elif stale:
+            ids = list(stale)
+            rows = self.db.conn.execute(f"SELECT {self.COLUMNS} FROM products WHERE id IN ({_placeholders(ids)})", ids).fetchall()
+            by_id = dict(self._by_id)
+            for product_id in stale.difference(row[0] for row in rows):
+                by_id.pop(product_id, None)
+            for row in rows:
+                by_id[row[0]] = CatalogItem(*row)
+            if any(row[0] not in self._by_id for row in rows):
+                by_id = dict(sorted(by_id.items()))
+        else:
+            return
+        # Build the indexes aside and swap them in together
+        by_name = {}
+        by_barcode = {}
+        for item in by_id.values():
+            by_name.setdefault(item.name, item)
+            if item.barcode:
+                by_barcode[item.barcode] = item
+        self._by_id, self._by_name, self._by_barcode = by_id, by_name, by_barcode
+        self._names = list(by_name)
+        self.version += 1
+
+    def get(self, product_id):
+        self._sync()
+        return self._by_id.get(product_id)
+
+    def by_name(self, name):
+        self._sync()
+        return self._by_name.get(name)
+
+    def by_barcode(self, barcode):
+        self._sync()
+        return self._by_barcode.get(barcode)
+
+    def names(self):
+        self._sync()
+        return list(self._names)
+
+
+class CustomerStore:
+    COLUMNS = "id, name, phone, email, loyalty_points, notes"
+    SORT_COLUMNS = {
+        'id': "id",
+        'name': "name",
+        'phone': "COALESCE(phone, '')",
+        'email': "COALESCE(email, '')",
+        'points': "COALESCE(loyalty_points, 0)",
+        'notes': "COALESCE(notes, '')",
+    }
+
+    def __init__(self, db):
+        self.db = db
+
+    def page(self, after=None, sort='id', descending=False, limit=PAGE_SIZE, term=''):
+        where, params = None, ()
+        if term:
+            where, params = "LOWER(name) LIKE ?", (f"%{term.lower()}%",)
+        return _keyset_page(self.db.conn, self.COLUMNS, "customers", "id", self.SORT_COLUMNS[sort],
+                            after, descending, limit, where, params)
+
+    def rows(self, ids):
+        ids = list(ids)
+        return self.db.conn.execute(f"SELECT {self.COLUMNS} FROM customers WHERE id IN ({_placeholders(ids)})", ids).fetchall()
+
+    def names(self):
+        return [row[0] for row in self.db.conn.execute("SELECT name FROM customers")]
+
+    def get(self, customer_id):
+        return self.db.conn.execute("SELECT name, phone, email, loyalty_points, notes FROM customers WHERE id=?", (customer_id,)).fetchone()
+
+    def id_for_name(self, name):
+        row = self.db.conn.execute("SELECT id FROM customers WHERE name=?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def count(self):
+        return self.db.conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+
+    def ids(self):
+        return [row[0] for row in self.db.conn.execute("SELECT id FROM customers ORDER BY id")]
+
+    def statement(self, customer_id, start=None, end=None):
+        # One pass over the customer's sale lines in sale order; the window
+        # gives each line its sale's subtotal so the caller can stream rows.
+        # Yields (sale_id, date, total, discount, subtotal, product, quantity, price);
+        # product is None for a sale without lines.
+        where = ["s.customer_id = ?"]
+        params = [customer_id]
+        if start:
+            where.append("s.date >= ?")
+            params.append(start)
+        if end:
+            where.append("s.date <= ?")
+            params.append(end)
+        return self.db.conn.execute(f"""SELECT s.id, s.date, s.total, s.discount,
+                   COALESCE(SUM(si.quantity * si.price) OVER (PARTITION BY s.id), 0),
+                   p.name, si.quantity, si.price
+            FROM sales s
+            LEFT JOIN sale_items si ON si.sale_id = s.id AND si.product_id IN (SELECT id FROM products)
+            LEFT JOIN products p ON p.id = si.product_id
+            WHERE {' AND '.join(where)}
+            ORDER BY s.date, s.id, si.id""", params)
+
+    def add(self, name, phone, email, points, notes):
+        with self.db.conn:
+            cur = self.db.conn.execute("INSERT INTO customers (name, phone, email, loyalty_points, notes) VALUES (?, ?, ?, ?, ?)",
+                                       (name, phone, email, points, notes))
+            bump_stat(self.db.conn, 'customers', 1)
+        self.db.changes.publish('customers', [cur.lastrowid])
+        return cur.lastrowid
+
+    def update(self, customer_id, name, phone, email, points, notes):
+        with self.db.conn:
+            self.db.conn.execute("UPDATE customers SET name=?, phone=?, email=?, loyalty_points=?, notes=? WHERE id=?",
+                                 (name, phone, email, points, notes, customer_id))
+        self.db.changes.publish('customers', [customer_id])
+
+    def delete(self, customer_id):
+        with self.db.conn:
+            cur = self.db.conn.execute("DELETE FROM customers WHERE id=?", (customer_id,))
+            bump_stat(self.db.conn, 'customers', -cur.rowcount)
+        self.db.changes.publish('customers', [customer_id])
+
+
+class SupplierStore:
+    def __init__(self, db):
+        self.db = db
+
+    def all(self):
+        return self.db.conn.execute("SELECT id, name, contact, email, products FROM suppliers").fetchall()
+
+    def names(self):
+        return [row[0] for row in self.db.conn.execute("SELECT name FROM suppliers")]
+
+    def id_for_name(self, name):
+        row = self.db.conn.execute("SELECT id FROM suppliers WHERE name=?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, name, contact, email, products):
+        with self.db.conn:
+            cur = self.db.conn.execute("INSERT INTO suppliers (name, contact, email, products) VALUES (?, ?, ?, ?)",
+                                       (name, contact, email, products))
+        self.db.changes.publish('suppliers', [cur.lastrowid])
+        return cur.lastrowid
+
+    def update(self, supplier_id, name, contact, email, products):
+        with self.db.conn:
+            self.db.conn.execute("UPDATE suppliers SET name=?, contact=?, email=?, products=? WHERE id=?",
+                                 (name, contact, email, products, supplier_id))
+        self.db.changes.publish('suppliers', [supplier_id])
+
+    def delete(self, supplier_id):
+        with self.db.conn:
+            self.db.conn.execute("DELETE FROM suppliers WHERE id=?", (supplier_id,))
+        self.db.changes.publish('suppliers', [supplier_id])
+
+
+class SalesService:
+    HISTORY_COLUMNS = "s.id, s.date, c.name, s.total, s.payment_method"
+    HISTORY_SORT_COLUMNS = {
+        'id': "s.id",
+        'date': "s.date",
+        'customer': "c.name",
+        'total': "s.total",
+        'payment_method': "COALESCE(s.payment_method, '')",
+    }
+
+    def __init__(self, db):
+        self.db = db
+
+    def history_page(self, after=None, sort='id', descending=True, limit=PAGE_SIZE, term=''):
+        return _keyset_page(self.db.conn, self.HISTORY_COLUMNS, "sales s JOIN customers c ON s.customer_id = c.id", "s.id",
+                            self.HISTORY_SORT_COLUMNS[sort], after, descending, limit)
+
+    def create_sale(self, customer_id, items, discount, payment_method, user=None):
+        subtotal = sum(item['quantity'] * item['price'] for item in items)
+        total = subtotal * (1 - discount / 100)
+        date = datetime.date.today().isoformat()
+
+        # The same product can appear on several lines; guard on the total
+        needed = {}
+        for item in items:
+            needed[item['id']] = needed.get(item['id'], 0) + item['quantity']
+
+        conn = self.db.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.executemany("UPDATE products SET quantity = quantity - ? WHERE id = ? AND quantity >= ?",
+                                   [(qty, product_id, qty) for product_id, qty in needed.items()])
+            if cur.rowcount != len(needed):
+                conn.rollback()
+                raise InsufficientStock(self._shortages(needed))
+
+            cur = conn.execute("INSERT INTO sales (customer_id, date, total, discount, payment_method) VALUES (?, ?, ?, ?, ?)",
+                               (customer_id, date, total, discount, payment_method))
+            sale_id = cur.lastrowid
+            conn.executemany("INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                             [(sale_id, item['id'], item['quantity'], item['price']) for item in items])
+
+            points_earned = int(total // 10)
+            conn.execute("UPDATE customers SET loyalty_points = loyalty_points + ? WHERE id = ?",
+                         (points_earned, customer_id))
+
+            bump_stat(conn, 'sales', 1)
+            bump_stat(conn, 'revenue', total)
+            conn.execute("INSERT INTO daily_sales (date, sales_count, revenue) VALUES (?, 1, ?) ON CONFLICT(date) DO UPDATE SET sales_count = sales_count + 1, revenue = revenue + excluded.revenue",
+                         (date, total))
+            conn.executemany("INSERT INTO product_sales (product_id, units_sold) VALUES (?, ?) ON CONFLICT(product_id) DO UPDATE SET units_sold = units_sold + excluded.units_sold",
+                             list(needed.items()))
+            if user is not None:
+                self.db.audit.record(conn, user, "Complete Sale", f"Completed sale ID {sale_id} via {payment_method}")
+            ids = list(needed)
+            stock = conn.execute(f"SELECT id, quantity, version FROM products WHERE id IN ({_placeholders(ids)})", ids).fetchall()
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        self.db.changes.publish('sales', [sale_id])
+        self.db.changes.publish('products', list(needed))
+        self.db.changes.publish('customers', [customer_id])
+        # stock is the resulting (id, quantity, version) of each product sold
+        return sale_id, total, date, stock
+
+    def _shortages(self, needed):
+        ids = list(needed)
+        rows = self.db.conn.execute(f"SELECT id, name, quantity FROM products WHERE id IN ({_placeholders(ids)})", ids).fetchall()
+        found = {row[0]: row for row in rows}
+        shortages = []
+        for product_id, qty in needed.items():
+            if product_id not in found:
+                shortages.append((product_id, None, 0, qty))
+            elif found[product_id][2] < qty:
+                shortages.append((product_id, found[product_id][1], found[product_id][2], qty))
+        return shortages
+
+    def history_rows(self, ids):
+        ids = list(ids)
+        return self.db.conn.execute(f"SELECT {self.HISTORY_COLUMNS} FROM sales s JOIN customers c ON s.customer_id = c.id WHERE s.id IN ({_placeholders(ids)})", ids).fetchall()
+
+    def items(self, sale_id):
+        return self.db.conn.execute("SELECT p.name, si.quantity, si.price, si.quantity * si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id=?", (sale_id,)).fetchall()
+
+    def receipt(self, sale_id):
+        sale = self.db.conn.execute("SELECT s.date, c.name, s.total, s.discount, s.payment_method FROM sales s JOIN customers c ON s.customer_id = c.id WHERE s.id=?", (sale_id,)).fetchone()
+        if not sale:
+            return None, []
+        items = self.db.conn.execute("SELECT p.name, si.quantity, si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id=?", (sale_id,)).fetchall()
+        return sale, items
+
+    def ids_between(self, start, end):
+        return [row[0] for row in self.db.conn.execute("SELECT id FROM sales WHERE date BETWEEN ? AND ? ORDER BY id", (start, end))]
+
+    def receipts(self, sale_ids):
+        # Batched receipt(): {sale_id: (sale, items)} in two queries
+        ids = list(sale_ids)
+        if not ids:
+            return {}
+        sales = self.db.conn.execute(f"SELECT s.id, s.date, c.name, s.total, s.discount, s.payment_method FROM sales s JOIN customers c ON s.customer_id = c.id WHERE s.id IN ({_placeholders(ids)})", ids).fetchall()
+        receipts = {row[0]: (row[1:], []) for row in sales}
+        items = self.db.conn.execute(f"SELECT si.sale_id, p.name, si.quantity, si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id IN ({_placeholders(ids)}) ORDER BY si.id", ids)
+        for sale_id, name, quantity, price in items:
+            receipts[sale_id][1].append((name, quantity, price))
+        return receipts
+
+    def returnable_items(self, sale_id):
+        return self.db.conn.execute("SELECT si.id, p.name, si.quantity, si.price FROM sale_items si JOIN products p ON si.product_id = p.id WHERE si.sale_id=?", (sale_id,)).fetchall()
+
+    def process_return(self, sale_id, quantities, user=None):
+        # quantities maps sale_items.id -> quantity to return
+        conn = self.db.conn
+        total_return = 0
+        returned = []
+        with conn:
+            for item_id, qty in quantities.items():
+                if qty <= 0:
+                    continue
+                sale_qty, price = conn.execute("SELECT quantity, price FROM sale_items WHERE id=?", (item_id,)).fetchone()
+                if qty > sale_qty:
+                    raise StoreError(f"Cannot return more than sold for item ID {item_id}")
+                total_return += qty * price
+                product_id = conn.execute("SELECT product_id FROM sale_items WHERE id=?", (item_id,)).fetchone()[0]
+                conn.execute("UPDATE products SET quantity = quantity + ? WHERE id = ?", (qty, product_id))
+                returned.append((item_id, qty))
+                if user is not None:
+                    self.db.audit.record(conn, user, "Return Item", f"Returned {qty} of item ID {item_id} from sale ID {sale_id}")
+                self.db.changes.publish('products', [product_id])
+            if total_return > 0:
+                conn.execute("UPDATE sales SET total = total - ? WHERE id=?", (total_return, sale_id))
+                bump_stat(conn, 'revenue', -total_return)
+                conn.execute("UPDATE daily_sales SET revenue = revenue - ? WHERE date = (SELECT date FROM sales WHERE id=?)", (total_return, sale_id))
+                self.db.changes.publish('sales', [sale_id])
+        return total_return, returned
+
+
+class ExpenseStore:
+    def __init__(self, db):
+        self.db = db
+
+    def all(self):
+        return self.db.conn.execute("SELECT id, date, category, amount, description FROM expenses").fetchall()
+
+    def add(self, date, category, amount, description):
+        with self.db.conn:
+            cur = self.db.conn.execute("INSERT INTO expenses (date, category, amount, description) VALUES (?, ?, ?, ?)", (date, category, amount, description))
+            bump_stat(self.db.conn, 'expenses', amount)
+        self.db.changes.publish('expenses', [cur.lastrowid])
+        return cur.lastrowid
+
+
+class PurchaseOrderStore:
+    def __init__(self, db):
+        self.db = db
+
+    def all(self):
+        return self.db.conn.execute("SELECT po.id, s.name, po.date, po.status FROM purchase_orders po JOIN suppliers s ON po.supplier_id = s.id").fetchall()
+
+    def product_for_name(self, name):
+        return self.db.conn.execute("SELECT id, name FROM products WHERE name=?", (name,)).fetchone()
+
+    def create(self, supplier_id, items):
+        conn = self.db.conn
+        date = datetime.date.today().isoformat()
+        with conn:
+            cur = conn.execute("INSERT INTO purchase_orders (supplier_id, date, status) VALUES (?, ?, ?)", (supplier_id, date, "Pending"))
+            po_id = cur.lastrowid
+            for item in items:
+                conn.execute("INSERT INTO purchase_order_items (po_id, product_id, quantity) VALUES (?, ?, ?)", (po_id, item['id'], item['quantity']))
+        self.db.changes.publish('purchase_orders', [po_id])
+        return po_id, date
+
+    def auto_generate(self):
+        conn = self.db.conn
+        low_stock_products = conn.execute("SELECT p.id, p.name, p.quantity, p.min_stock, p.supplier_id FROM products p WHERE p.quantity < p.min_stock AND p.supplier_id IS NOT NULL").fetchall()
+
+        suppliers = {}
+        for product in low_stock_products:
+            product_id, name, quantity, min_stock, supplier_id = product
+            reorder_qty = min_stock - quantity + 10
+            if supplier_id not in suppliers:
+                suppliers[supplier_id] = []
+            suppliers[supplier_id].append({'id': product_id, 'name': name, 'quantity': reorder_qty})
+
+        created = []
+        for supplier_id, items in suppliers.items():
+            po_id, date = self.create(supplier_id, items)
+            supplier_name = conn.execute("SELECT name FROM suppliers WHERE id=?", (supplier_id,)).fetchone()[0]
+            created.append({'po_id': po_id, 'supplier': supplier_name, 'date': date, 'status': 'Pending'})
+        return created
+
+    def set_status(self, po_id, status):
+        with self.db.conn:
+            self.db.conn.execute("UPDATE purchase_orders SET status=? WHERE id=?", (status, po_id))
+        self.db.changes.publish('purchase_orders', [po_id])
+
+
+# Period labels for report grouping; weeks are labelled by their Monday
+REPORT_PERIODS = {
+    'day': "day",
+    'week': "date(day, '-6 days', 'weekday 1')",
+    'month': "strftime('%Y-%m', day)",
+    'quarter': "strftime('%Y', day) || '-Q' || ((CAST(strftime('%m', day) AS INTEGER) + 2) / 3)",
+}
+
+
+class ReportService:
+    def __init__(self, db):
+        self.db = db
+
+    def dashboard_stats(self):
+        conn = self.db.conn
+        stats = dict(conn.execute("SELECT key, value FROM dashboard_stats"))
+        best_seller = conn.execute("SELECT p.name, ps.units_sold FROM product_sales ps JOIN products p ON ps.product_id = p.id ORDER BY ps.units_sold DESC LIMIT 1").fetchone()
+
+        today = datetime.date.today()
+        first_day_this_month = today.replace(day=1)
+        last_month = first_day_this_month - datetime.timedelta(days=1)
+        first_day_last_month = last_month.replace(day=1)
+        sales_this_month = self.sales_between(first_day_this_month.isoformat(), today.isoformat())
+        sales_last_month = self.sales_between(first_day_last_month.isoformat(), first_day_this_month.isoformat())
+
+        return {
+            'products': int(stats.get('products', 0)),
+            'customers': int(stats.get('customers', 0)),
+            'sales': int(stats.get('sales', 0)),
+            'revenue': stats.get('revenue', 0),
+            'expenses': stats.get('expenses', 0),
+            'best_seller': best_seller,
+            'sales_this_month': sales_this_month,
+            'sales_last_month': sales_last_month,
+            'low_stock': conn.execute("SELECT name, quantity FROM products WHERE quantity < min_stock").fetchall(),
+        }
+
+    def sales_between(self, start, end):
+        # Half-open range [start, end)
+        return self.db.conn.execute("SELECT SUM(revenue) FROM daily_sales WHERE date >= ? AND date < ?", (start, end)).fetchone()[0] or 0
+
+    def rebuild_summaries(self):
+        with self.db.conn:
+            rebuild_summaries(self.db.conn)
+
+    def period_totals(self, start, end):
+        conn = self.db.conn
+        total_sales = conn.execute("SELECT SUM(revenue) FROM sales_rollup WHERE grain = 'day' AND day BETWEEN ? AND ?", (start, end)).fetchone()[0] or 0
+        total_expenses = conn.execute("SELECT SUM(amount) FROM expenses WHERE date BETWEEN ? AND ?", (start, end)).fetchone()[0] or 0
+        return total_sales, total_expenses
+
+    def sales_by_period(self, start, end, granularity='month'):
+        period = REPORT_PERIODS[granularity]
+        return self.db.conn.execute(f"SELECT {period} AS period, SUM(revenue) FROM sales_rollup WHERE grain = 'day' AND day BETWEEN ? AND ? GROUP BY period ORDER BY period",
+                                    (start, end)).fetchall()
+
+    def sales_by_category(self, start, end):
+        # Line totals before discount, as on the receipts
+        return self.db.conn.execute("""
+            SELECT category, SUM(amount) as total
+            FROM sales_rollup
+            WHERE grain = 'category' AND day BETWEEN ? AND ?
+            GROUP BY category
+        """, (start, end)).fetchall()
+
+    def top_customers(self, start, end, limit=10):
+        return self.db.conn.execute("""
+            SELECT c.name, SUM(r.revenue) as total_spent
+            FROM sales_rollup r
+            JOIN customers c ON r.customer_id = c.id
+            WHERE r.grain = 'customer' AND r.day BETWEEN ? AND ?
+            GROUP BY r.customer_id
+            ORDER BY total_spent DESC
+            LIMIT ?
+        """, (start, end, limit)).fetchall()
+
+
+class UserStore:
+    def __init__(self, db):
+        self.db = db
+
+    def count(self):
+        return self.db.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def all(self):
+        return self.db.conn.execute("SELECT id, full_name, email, username, role FROM users").fetchall()
+
+    def authenticate(self, username, hashed):
+        return self.db.conn.execute("SELECT * FROM users WHERE username=? AND password=?", (username, hashed)).fetchone()
+
+    def add(self, username, hashed, role, full_name=None, email=None):
+        # Raises sqlite3.IntegrityError when the username is taken
+        with self.db.conn:
+            cur = self.db.conn.execute("INSERT INTO users (full_name, email, username, password, role) VALUES (?, ?, ?, ?, ?)",
+                                       (full_name, email, username, hashed, role))
+        self.db.changes.publish('users', [cur.lastrowid])
+        return cur.lastrowid
+
+
+# Settings are read on every receipt and email, so the table is loaded once
+# and served from memory. version moves whenever a value changes, here or
+# (through Database.external_change) in another connection, so caches built
+# from settings can key on it.
+class SettingsStore:
+    TRUE = ('1', 'true', 'yes', 'on')
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._values = {}
+        self._stale = True
+        self._version = 0
+
+    @property
+    def version(self):
+        self._current()
+        return self._version
+
+    def _current(self):
+        if self._stale:
+            values = dict(self.db.conn.execute("SELECT key, value FROM settings"))
+            with self._lock:
+                if values != self._values:
+                    self._values = values
+                    self._version += 1
+                self._stale = False
+        return self._values
+
+    def invalidate(self):
+        self._stale = True
+
+    def get(self, key, default=''):
+        return self._current().get(key, default)
+
+    def get_int(self, key, default=0):
+        try:
+            return int(self._current().get(key) or default)
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self._current().get(key) or default)
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key, default=False):
+        value = self._current().get(key)
+        if value is None or value == '':
+            return default
+        return str(value).strip().lower() in self.TRUE
+
+    def get_many(self, defaults):
+        # defaults maps key -> default value
+        values = self._current()
+        return {key: values.get(key, default) for key, default in defaults.items()}
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        # Any number of settings in one transaction. Stored and cached as
+        # text, which is what a reload from the table returns.
+        values = {key: None if value is None else str(value) for key, value in dict(values).items()}
+        with self.db.conn:
+            self.db.conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", list(values.items()))
+        current = self._current()
+        with self._lock:
+            if any(key not in current or current[key] != value for key, value in values.items()):
+                self._values = {**current, **values}
+                self._version += 1
+
+
+# Audit trail. Actions that are part of a business write are recorded inside
+# its transaction (record); everything else is buffered by log() and written
+# in one transaction by the next flush(), or as soon as FLUSH_MAX entries are
+# waiting. Reads flush first so nothing looks missing.
+class AuditLog:
+    COLUMNS = "id, timestamp, user, action, details"
+    SORT_COLUMNS = {
+        'id': "id",
+        'time': "timestamp",
+        'user': "user",
+        'action': "action",
+    }
+    FLUSH_MAX = 500
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def record(self, conn, user, action, details):
+        conn.execute("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?, ?, ?, ?)",
+                     (datetime.datetime.now().isoformat(), user, action, details))
+
+    def log(self, user, action, details):
+        # Buffered and written in one transaction by the next flush(): the
+        # UI's refresh tick, the end of a realtime, sync, archive or intake
+        # operation, every FLUSH_MAX entries, or Database.close()
+        with self._lock:
+            self._pending.append((datetime.datetime.now().isoformat(), user, action, details))
+            full = len(self._pending) >= self.FLUSH_MAX
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            with self.db.conn:
+                self.db.conn.executemany("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?, ?, ?, ?)", pending)
+        except sqlite3.Error:
+            # Keep them for the next flush
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+        self.db.changes.publish('audit_logs')
+
+    def actions(self):
+        self.flush()
+        return [row[0] for row in self.db.conn.execute("SELECT DISTINCT action FROM audit_logs ORDER BY action")]
+
+    def users(self):
+        self.flush()
+        return [row[0] for row in self.db.conn.execute("SELECT DISTINCT user FROM audit_logs ORDER BY user")]
+
+    def page(self, after=None, sort='time', descending=True, limit=PAGE_SIZE, term='', user=None, action=None, start=None, end=None):
+        # start and end are YYYY-MM-DD, both inclusive
+        self.flush()
+        where, params = [], []
+        if user:
+            where.append("user = ?")
+            params.append(user)
+        if action:
+            where.append("action = ?")
+            params.append(action)
+        if start:
+            where.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            where.append("timestamp < date(?, '+1 day')")
+            params.append(end)
+        term = term.strip()
+        if term:
+            where.append("LOWER(details) LIKE ?")
+            params.append(f"%{term.lower()}%")
+        return _keyset_page(self.db.conn, self.COLUMNS, "audit_logs", "id", self.SORT_COLUMNS[sort],
+                            after, descending, limit, " AND ".join(where) or None, params)
+
+    def rows(self, ids):
+        ids = list(ids)
+        return self.db.conn.execute(f"SELECT {self.COLUMNS} FROM audit_logs WHERE id IN ({_placeholders(ids)})", ids).fetchall()
+
+
+class PoolConnection(sqlite3.Connection):
+    # Commits go through the pool so it can tell this process's writes from
+    # other processes'; see ConnectionPool.external_writes
+    pool = None
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        with self.pool.committing():
+            super().commit()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None or not self.in_transaction:
+            return super().__exit__(exc_type, exc, tb)
+        with self.pool.committing():
+            return super().__exit__(exc_type, exc, tb)
+
+
+class ConnectionPool:
+    # One connection per thread; sqlite3 connections must not be shared
+    # between the Tk mainloop and the Socket.IO server thread.
+    def __init__(self, path=DB_PATH, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        # PRAGMA data_version on a connection of its own, as of this
+        # process's last commit, and whether another process wrote before it
+        self._probe = None
+        self._seen = None
+        self._external = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, factory=PoolConnection)
+        conn.pool = self
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+        return conn
+
+    def _data_version(self):
+        if self._probe is None:
+            self._probe = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        return self._probe.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def committing(self):
+        # The committing connection holds the write lock, so nothing else
+        # commits between the first read and its commit: a move seen there
+        # is another process's write, and the one after is ours
+        with self._lock:
+            version = self._data_version()
+            if self._seen is not None and version != self._seen:
+                self._external = True
+            try:
+                yield
+            finally:
+                self._seen = self._data_version()
+
+    def external_writes(self):
+        # Whether another process committed since the last call
+        with self._lock:
+            version = self._data_version()
+            external = self._external or (self._seen is not None and version != self._seen)
+            self._seen = version
+            self._external = False
+        return external
+
+    def release(self):
+        # Close the calling thread's connection, e.g. when a worker exits
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.remove(conn)
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            # Refresh planner statistics for the indexes the queries rely on
+            conn.execute("PRAGMA optimize")
+            conn.close()
+        self._local = threading.local()
+        with self._lock:
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
+            self._seen = None
+
+
+# Outgoing email is queued here and delivered by mailer.Mailer off the UI
+# thread. Low-stock alerts are stored one row per product so repeats within
+# LOW_STOCK_WINDOW are dropped and due rows can be merged into one message.
+LOW_STOCK_WINDOW = 6 * 3600
+LOW_STOCK_DELAY = 60
+RETRY_BASE = 30
+RETRY_MAX = 3600
+MAX_ATTEMPTS = 8
+
+
+class OutboxStore:
+    def __init__(self, db):
+        self.db = db
+
+    def enqueue(self, subject, body, kind='email', dedupe_key=None, delay=0):
+        now = time.time()
+        with self.db.conn:
+            cur = self.db.conn.execute("INSERT INTO email_outbox (kind, dedupe_key, subject, body, created_at, next_attempt) VALUES (?, ?, ?, ?, ?, ?)",
+                                       (kind, dedupe_key, subject, body, now, now + delay))
+        return cur.lastrowid
+
+    def enqueue_low_stock(self, products, window=LOW_STOCK_WINDOW):
+        # products are (id, name, quantity, min_stock) rows
+        now = time.time()
+        queued = 0
+        with self.db.conn:
+            for product_id, name, quantity, min_stock in products:
+                key = f"low_stock:{product_id}"
+                recent = self.db.conn.execute("SELECT 1 FROM email_outbox WHERE dedupe_key=? AND (status='pending' OR created_at >= ?) LIMIT 1",
+                                              (key, now - window)).fetchone()
+                if recent:
+                    continue
+                self.db.conn.execute("INSERT INTO email_outbox (kind, dedupe_key, subject, body, created_at, next_attempt) VALUES ('low_stock', ?, 'Low Stock Alert', ?, ?, ?)",
+                                     (key, f"- {name}: {quantity} (min: {min_stock})", now, now + LOW_STOCK_DELAY))
+                queued += 1
+        return queued
+
+    def due(self, now=None, limit=100):
+        now = time.time() if now is None else now
+        return self.db.conn.execute("SELECT id, kind, subject, body, attempts FROM email_outbox WHERE status='pending' AND next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                                    (now, limit)).fetchall()
+
+    def next_due(self):
+        row = self.db.conn.execute("SELECT MIN(next_attempt) FROM email_outbox WHERE status='pending'").fetchone()
+        return row[0]
+
+    def mark_sent(self, ids):
+        with self.db.conn:
+            self.db.conn.executemany("UPDATE email_outbox SET status='sent', sent_at=?, last_error=NULL WHERE id=?",
+                                     [(time.time(), message_id) for message_id in ids])
+
+    def retry_later(self, ids, error):
+        # Exponential backoff; give up after MAX_ATTEMPTS
+        now = time.time()
+        with self.db.conn:
+            for message_id in ids:
+                attempts = self.db.conn.execute("SELECT attempts FROM email_outbox WHERE id=?", (message_id,)).fetchone()[0] + 1
+                status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+                delay = min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+                self.db.conn.execute("UPDATE email_outbox SET attempts=?, status=?, next_attempt=?, last_error=? WHERE id=?",
+                                     (attempts, status, now + delay, error, message_id))
+
+
+SYNC_HUB = 'hub'
+SYNC_PAGE = 500
+
+
+# Change exchange between terminals. A terminal pushes its own change_log rows
+# to the hub and pulls everyone else's; cursors in sync_cursors make both
+# directions resumable after time offline and safe to retry.
+class SyncStore:
+    def __init__(self, db):
+        self.db = db
+        self._database_id = None
+
+    def terminal_id(self):
+        terminal = self.db.settings.get('terminal_id')
+        if not terminal:
+            terminal = uuid.uuid4().hex
+            self.db.settings.set('terminal_id', terminal)
+        return terminal
+
+    def database_id(self):
+        if self._database_id is None:
+            self._database_id = self.db.conn.execute("SELECT database_id FROM sync_state").fetchone()[0]
+        return self._database_id
+
+    def adopt_database_id(self, database):
+        # For terminals that joined before databases had ids
+        with self.db.conn:
+            self.db.conn.execute("UPDATE sync_state SET database_id = ? WHERE database_id IS NULL", (database,))
+        self._database_id = None
+        return self.database_id()
+
+    def enabled(self):
+        return bool(self.db.conn.execute("SELECT enabled FROM sync_state").fetchone()[0])
+
+    def _enable(self, conn):
+        # Rows written while sync was off have no uid; id-based ones match
+        # across copies, as in migrate_8
+        for table in SYNC_TABLES:
+            conn.execute(f"UPDATE {table} SET uid = 'legacy-' || id WHERE uid IS NULL")
+        create_sync_triggers(conn)
+        conn.execute("UPDATE sync_state SET enabled = 1")
+
+    def host(self):
+        # Run once on the hub before its database is copied to the tills, so
+        # the copies start out logging with the same uids and carry the
+        # secret the hub wants from them. Returns the secret.
+        with self.db.conn:
+            self._enable(self.db.conn)
+            self.db.conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('sync_secret', ?)", (secrets.token_hex(16),))
+        self.db.settings.invalidate()
+        return self.db.settings.get('sync_secret')
+
+    def join(self, database):
+        # Run on a fresh copy of the hub's database before it is used, with
+        # the hub's database_id: the copied log is the hub's own history, so
+        # start both cursors at the copy point instead of sending it back
+        if self.database_id() != database:
+            raise StoreError("This database is not a copy of the hub's; copy the hub's shop.db and join with that")
+        if not self.enabled():
+            raise StoreError("This copy was made before the hub started hosting sync; run sync.py --host on the hub and copy its shop.db again")
+        conn = self.db.conn
+        with conn:
+            # The copy's log may be pruned, so take the last seq handed out
+            last = conn.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0)").fetchone()[0]
+            conn.execute("DELETE FROM change_log")
+            conn.execute("DELETE FROM sync_cursors")
+            self._set_cursor(conn, SYNC_HUB, 'pushed', last)
+            self._set_cursor(conn, SYNC_HUB, 'pulled', last)
+            conn.execute("INSERT INTO settings (key, value) VALUES ('terminal_id', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                         (uuid.uuid4().hex,))
+        self.db.settings.invalidate()
+
+    def joined(self):
+        return self.db.conn.execute("SELECT 1 FROM sync_cursors WHERE peer=? AND kind='pulled'", (SYNC_HUB,)).fetchone() is not None
+
+    def cursor(self, peer, kind):
+        row = self.db.conn.execute("SELECT seq FROM sync_cursors WHERE peer=? AND kind=?", (peer, kind)).fetchone()
+        return row[0] if row else 0
+
+    def _set_cursor(self, conn, peer, kind, seq):
+        conn.execute("INSERT INTO sync_cursors (peer, kind, seq) VALUES (?, ?, ?) ON CONFLICT(peer, kind) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+                     (peer, kind, seq))
+
+    def local_changes(self, limit=SYNC_PAGE):
+        # This terminal's own changes the hub hasn't acknowledged yet
+        rows = self.db.conn.execute("SELECT seq, tbl, uid, op, data FROM change_log WHERE origin IS NULL AND seq > ? ORDER BY seq LIMIT ?",
+                                    (self.cursor(SYNC_HUB, 'pushed'), limit))
+        return [[seq, table, uid, op, json.loads(data) if data else None] for seq, table, uid, op, data in rows]
+
+    def mark_pushed(self, seq):
+        # Terminals only keep what they still have to send; the hub keeps its
+        # log for the others to pull (see record_pull)
+        with self.db.conn:
+            self._set_cursor(self.db.conn, SYNC_HUB, 'pushed', seq)
+            self.db.conn.execute("DELETE FROM change_log WHERE (origin IS NULL AND seq <= ?) OR origin IS NOT NULL", (seq,))
+
+    def record_pull(self, peer, after):
+        # The hub keeps its log until every terminal has pulled it, then drops
+        # what they all have. A terminal behind the floor can't catch up.
+        conn = self.db.conn
+        pruned = conn.execute("SELECT pruned FROM sync_state").fetchone()[0]
+        if after < pruned:
+            raise StoreError(f"the hub no longer has changes before {pruned + 1}; copy the hub's shop.db again and run sync.py --join")
+        row = conn.execute("SELECT seq FROM sync_cursors WHERE peer=? AND kind='pulled'", (peer,)).fetchone()
+        if row is not None and row[0] >= after:
+            return
+        with conn:
+            self._set_cursor(conn, peer, 'pulled', after)
+            floor = conn.execute("SELECT MIN(seq) FROM sync_cursors WHERE kind='pulled'").fetchone()[0]
+            if floor > pruned:
+                conn.execute("DELETE FROM change_log WHERE seq <= ?", (floor,))
+                conn.execute("UPDATE sync_state SET pruned = ?", (floor,))
+
+    def changes_since(self, after, exclude_origin=None, limit=SYNC_PAGE):
+        # Returns (changes, last seq scanned, more to come)
+        rows = self.db.conn.execute("SELECT seq, tbl, uid, op, data, origin FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                                    (after, limit)).fetchall()
+        changes = [[seq, table, uid, op, json.loads(data) if data else None]
+                   for seq, table, uid, op, data, origin in rows if origin is None or origin != exclude_origin]
+        return changes, rows[-1][0] if rows else after, len(rows) == limit
+
+    def conflicts(self, limit=100):
+        return self.db.conn.execute("SELECT id, created_at, origin, seq, tbl, uid, op, data, reason FROM sync_conflicts ORDER BY id DESC LIMIT ?",
+                                    (limit,)).fetchall()
+
+    def conflict_count(self):
+        return self.db.conn.execute("SELECT COUNT(*) FROM sync_conflicts").fetchone()[0]
+
+    def _check(self, changes):
+        for change in changes:
+            if not isinstance(change, (list, tuple)) or len(change) != 5:
+                raise StoreError("Malformed change")
+            seq, table, uid, op, data = change
+            if not isinstance(seq, int) or table not in SYNC_TABLES or not isinstance(uid, str) or op not in SYNC_OPS \
+                    or not (data is None or isinstance(data, dict)):
+                raise StoreError(f"Malformed change {seq!r}")
+
+    def apply(self, origin, changes, kind, last=None):
+        # Applies another terminal's changes in one transaction. Changes at or
+        # below the cursor were applied before and are skipped, so a retried
+        # batch is harmless. A change that can't be applied here is undone on
+        # its own and recorded in sync_conflicts and the audit log, so the rest
+        # of the batch still lands. Returns the new cursor.
+        self._check(changes)
+        conn = self.db.conn
+        touched = {}
+        conflicts = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self.cursor(origin, kind)
+            conn.execute("UPDATE sync_state SET origin = ?", (origin,))
+            for seq, table, uid, op, data in changes:
+                if seq <= cursor:
+                    continue
+                conn.execute("SAVEPOINT sync_change")
+                try:
+                    row_id = self._apply_change(conn, table, uid, op, data or {})
+                except (sqlite3.IntegrityError, StoreError) as e:
+                    conn.execute("ROLLBACK TO sync_change")
+                    self._conflict(conn, origin, seq, table, uid, op, data, str(e))
+                    conflicts += 1
+                    row_id = None
+                conn.execute("RELEASE sync_change")
+                # Items arrive with their sale, which is published already
+                if row_id is not None and table != 'sale_items':
+                    touched.setdefault(table, set()).add(row_id)
+            cursor = max([cursor, last or 0] + [change[0] for change in changes])
+            self._set_cursor(conn, origin, kind, cursor)
+            conn.execute("UPDATE sync_state SET origin = NULL")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        for table, ids in touched.items():
+            self.db.changes.publish(table, ids)
+        if conflicts:
+            self.db.changes.publish('audit_logs')
+        return cursor
+
+    def _conflict(self, conn, origin, seq, table, uid, op, data, reason):
+        conn.execute("INSERT INTO sync_conflicts (origin, seq, tbl, uid, op, data, reason, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (origin, seq, table, uid, op, json.dumps(data) if data is not None else None, reason,
+                      datetime.datetime.now().isoformat()))
+        self.db.audit.record(conn, 'system', "Sync Conflict", f"Could not apply {op} of {table} {uid} from {origin} (change {seq}): {reason}")
+
+    def _apply_change(self, conn, table, uid, op, data):
+        fields, counters, refs = SYNC_TABLES[table]
+        row = conn.execute(f"SELECT id FROM {table} WHERE uid=?", (uid,)).fetchone()
+        row_id = row[0] if row else None
+        if op == 'delete':
+            if row_id is not None:
+                self._summaries(conn, table, row_id, -1)
+                conn.execute(f"DELETE FROM {table} WHERE id=?", (row_id,))
+            return row_id
+        if op == 'add':
+            if row_id is None:
+                raise StoreError("no such row here")
+            # Counters can't go below zero; an oversold product stops at 0
+            for column in counters:
+                if column in data:
+                    conn.execute(f"UPDATE {table} SET {column} = MAX({column} + ?, 0) WHERE id=?", (data[column], row_id))
+            if table == 'sales' and 'total' in data:
+                bump_stat(conn, 'revenue', data['total'])
+                conn.execute("UPDATE daily_sales SET revenue = revenue + ? WHERE date = (SELECT date FROM sales WHERE id=?)",
+                             (data['total'], row_id))
+            return row_id
+
+        columns = [column for column in fields + (counters if row_id is None else ()) if column in data]
+        values = [data[column] for column in columns]
+        for column, (ref, key) in refs.items():
+            if column in data:
+                found = conn.execute(f"SELECT id FROM {ref} WHERE {key}=?", (data[column],)).fetchone()
+                # Suppliers aren't replicated, so an unknown name is left unset
+                if found is None and key == 'uid' and data[column] is not None:
+                    raise StoreError(f"{column} refers to {ref} {data[column]}, which isn't here")
+                columns.append(column)
+                values.append(found[0] if found else None)
+        # A clashing barcode or a missing value raises IntegrityError, which
+        # apply() records as a conflict
+        if row_id is None:
+            if op != 'insert':
+                raise StoreError("no such row here")
+            cur = conn.execute(f"INSERT INTO {table} ({', '.join(columns + ['uid'])}) VALUES ({_placeholders(values + [uid])})",
+                               values + [uid])
+            self._summaries(conn, table, cur.lastrowid, 1)
+            return cur.lastrowid
+        if columns:
+            conn.execute(f"UPDATE {table} SET {', '.join(f'{column}=?' for column in columns)} WHERE id=?", values + [row_id])
+        return row_id
+
+    def _summaries(self, conn, table, row_id, sign):
+        # Keep the dashboard summaries in step with rows arriving or leaving
+        if table in ('products', 'customers'):
+            bump_stat(conn, table, sign)
+        elif table == 'sales':
+            date, total = conn.execute("SELECT date, total FROM sales WHERE id=?", (row_id,)).fetchone()
+            bump_stat(conn, 'sales', sign)
+            bump_stat(conn, 'revenue', sign * total)
+            conn.execute("INSERT INTO daily_sales (date, sales_count, revenue) VALUES (?, ?, ?) ON CONFLICT(date) DO UPDATE SET sales_count = sales_count + excluded.sales_count, revenue = revenue + excluded.revenue",
+                         (date, sign, sign * total))
+        elif table == 'sale_items':
+            product_id, quantity = conn.execute("SELECT product_id, quantity FROM sale_items WHERE id=?", (row_id,)).fetchone()
+            conn.execute("INSERT INTO product_sales (product_id, units_sold) VALUES (?, ?) ON CONFLICT(product_id) DO UPDATE SET units_sold = units_sold + excluded.units_sold",
+                         (product_id, sign * quantity))
+
+
+class Database:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.pool = ConnectionPool(path)
+        self.changes = ChangeBus()
+        init_db(self.conn)
+
+        self.products = ProductStore(self)
+        self.customers = CustomerStore(self)
+        self.suppliers = SupplierStore(self)
+        self.sales = SalesService(self)
+        self.expenses = ExpenseStore(self)
+        self.purchase_orders = PurchaseOrderStore(self)
+        self.reports = ReportService(self)
+        self.users = UserStore(self)
+        self.settings = SettingsStore(self)
+        self.audit = AuditLog(self)
+        self.outbox = OutboxStore(self)
+        self.catalog = ProductCatalog(self)
+        self.sync = SyncStore(self)
+
+    @property
+    def conn(self):
+        return self.pool.get()
+
+    def external_change(self):
+        # Another terminal or process committed. Writes from this process's
+        # threads (UI, realtime, sync, mailer, archive) are published on
+        # self.changes instead and don't count.
+        changed = self.pool.external_writes()
+        if changed:
+            self.catalog.invalidate()
+            self.settings.invalidate()
+        return changed
+
+    def close(self):
+        self.audit.flush()
+        self.pool.close_all()
+
+
+# Maintenance commands: python store.py [--db shop.db] migrate|rebuild-summaries
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shop database maintenance")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("command", choices=["migrate", "rebuild-summaries"])
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    if args.command == "rebuild-summaries":
+        db.reports.rebuild_summaries()
+    print(f"{args.db}: schema version {schema_version(db.conn)}")
+    db.close()
@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import sys
+import threading
+
+from store import Database, DB_PATH, StoreError, SYNC_HUB, SYNC_PAGE, SYNC_TABLES
+
+# Terminal side of multi-terminal sync. One till runs the hub (its realtime
+# server); every other till keeps a socket.io connection to it, pushing its
+# own change_log and pulling everyone else's. Local writes and the hub's
+# 'sync_available' events trigger a round straight away; SYNC_INTERVAL is the
+# fallback, and a lost connection is retried with backoff. The hub is set up
+# once with `python sync.py --host`; a till then starts from a copy of the
+# hub's shop.db and runs `python sync.py --join URL` once.
+SYNC_INTERVAL = 10
+CALL_TIMEOUT = 30
+RETRY_MAX = 60
+
+
+class SyncClient:
+    def __init__(self, db, url, store, interval=SYNC_INTERVAL):
+        self.db = db
+        self.url = url
+        self.store = store
+        self.interval = interval
+        self.terminal = db.sync.terminal_id()
+        # The hub's shared secret, carried by the copy of its database
+        self.secret = db.settings.get('sync_secret')
+        self.loop = None
+        self.error = None
+        self.conflicts = 0
+        self.last_sync = None
+        self._wake = None
+        self._stopping = False
+        self._thread = None
+        db.changes.subscribe(self._on_change)
+
+    def _on_change(self, table, ids):
+        if table in SYNC_TABLES:
+            self.wake()
+
+    def wake(self):
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), name='sync', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self.wake()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    async def _connect(self, client=None):
+        # Imported here so socket.io's client loads off the UI thread
+        import socketio
+
+        if client is None:
+            client = socketio.AsyncClient(reconnection=False)
+            client.on('sync_available', lambda data: self._wake.set())
+            client.on('batch', lambda events: any(event == 'sync_available' for event, data in events) and self._wake.set())
+        await client.connect(self.url, auth={'store': self.store, 'terminal': self.terminal, 'secret': self.secret}, transports=['websocket'])
+        return client
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        client = None
+        delay = 1
+        try:
+            while not self._stopping:
+                self._wake.clear()
+                try:
+                    if client is None:
+                        client = await self._connect()
+                    elif not client.connected:
+                        await self._connect(client)
+                    await self.sync_once(client)
+                    self.error = None
+                    delay = 1
+                    wait = self.interval
+                except Exception as e:
+                    self.error = str(e)
+                    print(f"Sync error: {e}")
+                    wait = delay
+                    delay = min(delay * 2, RETRY_MAX)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.loop = None
+            if client is not None and client.connected:
+                await client.disconnect()
+            self.db.pool.release()
+
+    async def _call(self, client, event, data):
+        reply = await client.call(event, data, timeout=CALL_TIMEOUT)
+        if not reply.get('ok'):
+            raise StoreError(f"{event}: {reply.get('error')}")
+        return reply
+
+    async def sync_once(self, client):
+        # Push everything local first, then pull until caught up
+        sync = self.db.sync
+        if not await asyncio.to_thread(sync.joined):
+            raise StoreError("This database has not joined a hub; copy the hub's shop.db and run sync.py --join")
+        database = await asyncio.to_thread(sync.database_id)
+        if database is None:
+            reply = await self._call(client, 'sync_hello', {})
+            database = await asyncio.to_thread(sync.adopt_database_id, reply['database'])
+        pushed = pulled = 0
+        while True:
+            changes = await asyncio.to_thread(sync.local_changes, SYNC_PAGE)
+            if not changes:
+                break
+            reply = await self._call(client, 'sync_push', {'changes': changes, 'database': database})
+            await asyncio.to_thread(sync.mark_pushed, reply['seq'])
+            pushed += len(changes)
+        while True:
+            after = await asyncio.to_thread(sync.cursor, SYNC_HUB, 'pulled')
+            reply = await self._call(client, 'sync_pull', {'after': after, 'database': database})
+            if reply['last'] > after:
+                await asyncio.to_thread(sync.apply, SYNC_HUB, reply['changes'], 'pulled', reply['last'])
+                pulled += len(reply['changes'])
+            if not reply['more']:
+                break
+        # Changes the hub sent that couldn't be applied here; see the audit log
+        self.conflicts = await asyncio.to_thread(sync.conflict_count)
+        await asyncio.to_thread(self.db.audit.flush)
+        self.last_sync = self.loop.time()
+        return pushed, pulled
+
+
+# python sync.py [--join] http://hub:5000 [--db shop.db] pushes and pulls once;
+# python sync.py --host [--db shop.db] sets up the hub's database and prints
+# its secret, which tills set up before it need: sync.py --secret S URL
+def main():
+    parser = argparse.ArgumentParser(description="Sync this terminal's database with the hub")
+    parser.add_argument('url', nargs='?', help="hub address, e.g. http://192.168.1.10:5000")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--store')
+    parser.add_argument('--join', action='store_true', help="first sync of a fresh copy of the hub's database")
+    parser.add_argument('--host', action='store_true', help="start logging changes on the hub, before copying its database")
+    parser.add_argument('--secret', help="the hub's sync secret, for a till whose copy predates it")
+    args = parser.parse_args()
+    if not args.host and not args.url:
+        parser.error("the hub address is required")
+
+    from realtime import STORE_ID
+
+    db = Database(args.db)
+    if args.host:
+        secret = db.sync.host()
+        db.close()
+        print(f"{args.db} now hosts sync with secret {secret}; copy it to each till and run sync.py --join there")
+        return 0
+    if args.secret:
+        db.settings.set('sync_secret', args.secret)
+    sync = SyncClient(db, args.url, args.store or db.settings.get('store_id', STORE_ID))
+
+    async def once():
+        sync.loop = asyncio.get_running_loop()
+        sync._wake = asyncio.Event()
+        client = await sync._connect()
+        try:
+            if args.join:
+                if await asyncio.to_thread(db.sync.joined):
+                    print("Already joined; not resetting the sync log")
+                else:
+                    reply = await sync._call(client, 'sync_hello', {})
+                    await asyncio.to_thread(db.sync.join, reply['database'])
+            return await sync.sync_once(client)
+        finally:
+            await client.disconnect()
+
+    try:
+        pushed, pulled = asyncio.run(once())
+    except Exception as e:
+        print(f"Sync failed: {e}")
+        return 1
+    finally:
+        db.close()
+    print(f"Pushed {pushed} changes, pulled {pulled}")
+    if sync.conflicts:
+        print(f"{sync.conflicts} changes could not be applied here; see 'Sync Conflict' in the audit log")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import re
+
+import pytest
+
+from store import Database
+
+# Tables that grow with the business; a lookup must never read all of them
+LARGE_TABLES = ('products', 'customers', 'sales', 'sale_items')
+ALIAS = re.compile(r"\b(" + "|".join(LARGE_TABLES) + r")\s+(?:AS\s+)?([a-z]{1,2})\b")
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'shop.db'))
+    supplier_id = db.suppliers.add("Supplier", "", "", "")
+    for i in range(20):
+        db.products.add(f"Product {i}", "Category", 100, 2.5, 5, supplier_id, f"{i:012d}", None, 0)
+    customer_id = db.customers.add("Customer", "555-0100", "", 0, "")
+    for i in range(5):
+        db.sales.create_sale(customer_id, [{'id': 1 + i, 'quantity': 2, 'price': 2.5}, {'id': 2 + i, 'quantity': 1, 'price': 2.5}], 0, 'Cash')
+    # The catalog reads every product once by design; after that it reloads rows
+    db.catalog.get(1)
+    yield db
+    db.close()
+
+
+def traced(db, call):
+    # The statements the call actually runs, with their parameters bound
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        db.conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE')]
+
+
+def full_scans(db, sql):
+    names = {table: table for table in LARGE_TABLES}
+    names.update((alias, table) for table, alias in ALIAS.findall(sql))
+    scans = []
+    for row in db.conn.execute("EXPLAIN QUERY PLAN " + sql):
+        words = row[-1].split()
+        if words[0] == 'SCAN' and words[1] in names:
+            scans.append(row[-1])
+    return scans
+
+
+LOOKUPS = {
+    'product rows': lambda db: db.products.rows([1, 2, 3]),
+    'product update': lambda db: db.products.update(1, "Product 0", "Category", 50, 2.5, 5, None, "000000000000", None, 0),
+    'inventory update': lambda db: db.products.apply_inventory([(1, -1, None, None), (2, None, 40, None)]),
+    'catalog refresh': lambda db: (db.catalog.invalidate([1, 2]), db.catalog.get(1)),
+    'product by name': lambda db: db.purchase_orders.product_for_name("Product 3"),
+    'customer by name': lambda db: db.customers.id_for_name("Customer"),
+    'customer rows': lambda db: (db.customers.get(1), db.customers.rows([1])),
+    'customer statement': lambda db: db.customers.statement(1).fetchall(),
+    'dated statement': lambda db: db.customers.statement(1, '2020-01-01', '2030-12-31').fetchall(),
+    'sale items by sale': lambda db: (db.sales.items(1), db.sales.returnable_items(1)),
+    'receipt': lambda db: db.sales.receipt(1),
+    'receipts': lambda db: db.sales.receipts([1, 2, 3]),
+    'sales by date': lambda db: db.sales.ids_between('2020-01-01', '2030-12-31'),
+    'history rows': lambda db: db.sales.history_rows([1, 2]),
+    'create sale': lambda db: db.sales.create_sale(1, [{'id': 3, 'quantity': 1, 'price': 2.5}], 0, 'Cash'),
+    'return': lambda db: db.sales.process_return(1, {1: 1}),
+}
+
+
+@pytest.mark.parametrize('name', LOOKUPS)
+def test_lookup_uses_indexes(db, name):
+    statements = traced(db, lambda: LOOKUPS[name](db))
+    assert statements
+    for sql in statements:
+        assert full_scans(db, sql) == [], sql